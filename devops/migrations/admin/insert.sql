@@ -60,6 +60,8 @@ INSERT INTO Clients (name, phone_number, email, date_of_birth) VALUES
     ('Орлова Анастасия', '+79994445566', 'nastya@email.com', '1995-03-28');
 
 -- 10. Заказы (после создания клиентов и магазинов)
+-- Секция для месяца тестовых заказов (миграция 007 создаёт секции начиная с текущего месяца)
+SELECT create_month_partitions('orders', '2023-12-01', '2024-01-01');
 INSERT INTO Orders (order_number, client_id, shop_id, date_of_order, total_price, status) VALUES
     ('ORD-001', 1, 1, '2023-12-14', 15000.50, 'completed'),
     ('ORD-002', 2, 1, '2023-12-14', 8900.00, 'completed'),
@@ -67,9 +69,9 @@ INSERT INTO Orders (order_number, client_id, shop_id, date_of_order, total_price
     ('ORD-004', 4, 2, '2023-12-14', 6700.25, 'completed');
 
 -- 11. Накладные (после создания поставок, товаров и магазинов)
-INSERT INTO Invoices (invoicenumber, total_price, dispatch_date, receipt_date, supply_id, goodid, shop_id, status) VALUES
-    ('INV-001', 29999.99, '2023-12-01', '2023-12-03', 1, 1, 1, 'delivered'),
-    ('INV-002', 9998.00, '2023-12-05', '2023-12-07', 2, 2, 1, 'delivered'),
-    ('INV-003', 450.00, '2023-12-10', '2023-12-12', 3, 3, 2, 'delivered'),
-    ('INV-004', 241.00, '2023-12-10', '2023-12-12', 3, 4, 2, 'delivered'),
-    ('INV-005', 5998.00, '2023-12-08', '2023-12-10', 2, 5, 1, 'delivered');
\ No newline at end of file
+INSERT INTO Invoices (invoicenumber, total_price, dispatch_date, receipt_date, supply_id, goodid, shop_id, status, quantity) VALUES
+    ('INV-001', 29999.99, '2023-12-01', '2023-12-03', 1, 1, 1, 'delivered', 1),
+    ('INV-002', 9998.00, '2023-12-05', '2023-12-07', 2, 2, 1, 'delivered', 2),
+    ('INV-003', 450.00, '2023-12-10', '2023-12-12', 3, 3, 2, 'delivered', 1),
+    ('INV-004', 241.00, '2023-12-10', '2023-12-12', 3, 4, 2, 'delivered', 2),
+    ('INV-005', 5998.00, '2023-12-08', '2023-12-10', 2, 5, 1, 'delivered', 3);
\ No newline at end of file
@@ -10,7 +10,9 @@ CREATE PUBLICATION rpc_pub FOR TABLE
     Supplies_from_warehouse,
     Invoices,
     Orders,
-    Clients;
+    Clients
+-- Orders секционирована по месяцам (миграция 007): изменения публикуются от имени корневой
+WITH (publish_via_partition_root = true);
 
 -- CREATE SUBSCRIPTION rkd_sub1
 -- CONNECTION 'host=shop1 port=5432 dbname=vinlab user=replicator password=replicator'
@@ -156,4 +156,12 @@ GRANT USAGE ON SCHEMA public TO replicator;
 
 GRANT SELECT ON ALL TABLES IN SCHEMA public TO replicator;
 
-GRANT CONNECT ON DATABASE vinlab TO replicator;
\ No newline at end of file
+GRANT CONNECT ON DATABASE vinlab TO replicator;
+
+-- Применённые версионированные миграции (versions/*.sql): каждая миграция
+-- отмечает себя сама, поэтому `flask migrate` после инициализации контейнера
+-- не выполняет их повторно
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -6,7 +6,9 @@ CREATE PUBLICATION rkd_pub2 FOR TABLE
     Receipts,
     Receipt_positions,
     Orders,
-    Ordered_goods;
+    Ordered_goods
+-- Таблицы секционированы по месяцам (миграция 007): изменения публикуются от имени корневых
+WITH (publish_via_partition_root = true);
 
 ALTER SEQUENCE receipt_positions_id_seq RESTART WITH 200001;
 
@@ -0,0 +1,57 @@
+-- Индексы для путей запросов приложения order_management.
+-- Применяется одинаково на всех узлах (administration, shop*, warehouse*).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Список заказов сотрудника: сортировка и курсор (date_of_order, order_number)
+CREATE INDEX IF NOT EXISTS orders_date_number_idx
+    ON Orders (date_of_order DESC, order_number DESC);
+
+-- Фильтры списка: магазин + статус + период
+CREATE INDEX IF NOT EXISTS orders_shop_status_date_idx
+    ON Orders (shop_id, status, date_of_order DESC, order_number DESC);
+
+-- Фильтр только по статусу
+CREATE INDEX IF NOT EXISTS orders_status_date_idx
+    ON Orders (status, date_of_order DESC, order_number DESC);
+
+-- Заказы клиента (client.orders)
+CREATE INDEX IF NOT EXISTS orders_client_date_idx
+    ON Orders (client_id, date_of_order DESC);
+
+-- Внешние ключи позиций заказа и чека
+CREATE INDEX IF NOT EXISTS ordered_goods_order_id_idx
+    ON Ordered_goods (order_id);
+
+CREATE INDEX IF NOT EXISTS ordered_goods_invoice_id_idx
+    ON Ordered_goods (invoice_id);
+
+CREATE INDEX IF NOT EXISTS receipt_positions_receipt_id_idx
+    ON Receipt_positions (receipt_id);
+
+CREATE INDEX IF NOT EXISTS receipt_positions_invoice_id_idx
+    ON Receipt_positions (invoice_id);
+
+CREATE INDEX IF NOT EXISTS receipts_client_id_idx
+    ON Receipts (client_id);
+
+CREATE INDEX IF NOT EXISTS invoices_shop_good_idx
+    ON Invoices (shop_id, goodid);
+
+CREATE INDEX IF NOT EXISTS workers_shop_id_idx
+    ON Workers (shop_id);
+
+-- Подстрочный поиск (ilike '%q%') в /api/clients/search и /api/goods/search
+CREATE INDEX IF NOT EXISTS clients_name_trgm_idx
+    ON Clients USING GIN (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS clients_email_trgm_idx
+    ON Clients USING GIN (email gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS clients_phone_trgm_idx
+    ON Clients USING GIN (phone_number gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS list_of_goods_name_trgm_idx
+    ON List_of_goods USING GIN (name gin_trgm_ops);
+
+INSERT INTO schema_migrations (version) VALUES ('001_order_indexes') ON CONFLICT DO NOTHING;
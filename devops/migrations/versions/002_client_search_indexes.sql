@@ -0,0 +1,10 @@
+-- Префиксный поиск клиентов по нормализованному телефону и email
+-- (выражения совпадают с search.phone_digits_expr / search.email_expr).
+
+CREATE INDEX IF NOT EXISTS clients_phone_digits_idx
+    ON Clients (regexp_replace(phone_number, '\D', '', 'g') text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS clients_email_lower_idx
+    ON Clients (lower(email) text_pattern_ops);
+
+INSERT INTO schema_migrations (version) VALUES ('002_client_search_indexes') ON CONFLICT DO NOTHING;
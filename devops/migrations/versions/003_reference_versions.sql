@@ -0,0 +1,38 @@
+-- Счётчик версий справочных таблиц для кэша приложения (reference.py).
+-- Триггеры включены как ALWAYS, чтобы срабатывать и при применении
+-- изменений из подписки rpc_pub на узлах магазинов и складов.
+
+CREATE TABLE IF NOT EXISTS reference_versions (
+    table_name VARCHAR PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO reference_versions (table_name, version)
+    VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE
+        SET version = reference_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'shops', 'workers', 'warehouses', 'list_of_goods',
+        'nsi_category_of_goods', 'nsi_unit_of_measure', 'nsi_of_supplies'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I_reference_version ON %I', t, t);
+        EXECUTE format(
+            'CREATE TRIGGER %I_reference_version AFTER INSERT OR UPDATE OR DELETE ON %I '
+            'FOR EACH ROW EXECUTE FUNCTION bump_reference_version()', t, t);
+        EXECUTE format('ALTER TABLE %I ENABLE ALWAYS TRIGGER %I_reference_version', t, t);
+        INSERT INTO reference_versions (table_name) VALUES (t) ON CONFLICT DO NOTHING;
+    END LOOP;
+END;
+$$;
+
+INSERT INTO schema_migrations (version) VALUES ('003_reference_versions') ON CONFLICT DO NOTHING;
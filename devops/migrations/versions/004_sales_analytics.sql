@@ -0,0 +1,138 @@
+-- Агрегаты продаж (analytics.py): дневные и часовые срезы по магазину,
+-- сотруднику, товару и категории. Пересчитываются инкрементально по очереди
+-- изменённых пар (день, магазин), которую заполняют триггеры.
+-- Триггеры создаются выключенными и включаются командой
+-- `flask analytics-rebuild` на узле, где строится отчётность (administration).
+
+-- Время пробития чека нужно для часовых срезов
+ALTER TABLE Receipts ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT now();
+
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE NOT NULL,
+    shop_id INT NOT NULL,
+    worker_id INT NOT NULL,
+    good_id INT NOT NULL,
+    category_id INT NOT NULL,
+    quantity BIGINT NOT NULL,
+    revenue DECIMAL NOT NULL,
+    receipts INT NOT NULL,
+    PRIMARY KEY (day, shop_id, worker_id, good_id)
+);
+
+CREATE TABLE IF NOT EXISTS sales_hourly (
+    hour TIMESTAMP NOT NULL,
+    shop_id INT NOT NULL,
+    worker_id INT NOT NULL,
+    good_id INT NOT NULL,
+    category_id INT NOT NULL,
+    quantity BIGINT NOT NULL,
+    revenue DECIMAL NOT NULL,
+    receipts INT NOT NULL,
+    PRIMARY KEY (hour, shop_id, worker_id, good_id)
+);
+
+-- Пересчёт агрегатов выбирает чеки за день
+CREATE INDEX IF NOT EXISTS receipts_date_idx ON Receipts (date_oforder);
+
+CREATE INDEX IF NOT EXISTS sales_daily_shop_day_idx ON sales_daily (shop_id, day);
+CREATE INDEX IF NOT EXISTS sales_hourly_shop_hour_idx ON sales_hourly (shop_id, hour);
+
+-- Очередь пар (день, магазин), требующих пересчёта
+CREATE TABLE IF NOT EXISTS sales_changes (
+    id BIGSERIAL PRIMARY KEY,
+    day DATE NOT NULL,
+    shop_id INT NOT NULL
+);
+
+-- Магазин продажи: из заказа, иначе из места работы кассира (0 — неизвестен)
+CREATE OR REPLACE FUNCTION sales_receipt_key(p_receipt VARCHAR, OUT day DATE, OUT shop_id INT) AS $$
+    SELECT r.date_oforder, COALESCE(o.shop_id, w.shop_id, 0)
+    FROM Receipts r
+    LEFT JOIN Orders o ON o.order_number = r.orders_id
+    LEFT JOIN Workers w ON w.id = r.shop_workerid
+    WHERE r.receipt_number = p_receipt;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_position() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(OLD.receipt_id) k WHERE k.day IS NOT NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(NEW.receipt_id) k WHERE k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_receipt() RETURNS trigger AS $$
+BEGIN
+    IF OLD.date_oforder IS NOT NULL THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT OLD.date_oforder, COALESCE(
+            (SELECT o.shop_id FROM Orders o WHERE o.order_number = OLD.orders_id),
+            (SELECT w.shop_id FROM Workers w WHERE w.id = OLD.shop_workerid), 0);
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(NEW.receipt_number) k WHERE k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_order() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO sales_changes (day, shop_id)
+    SELECT r.date_oforder, COALESCE(OLD.shop_id, 0)
+    FROM Receipts r WHERE r.orders_id = OLD.order_number AND r.date_oforder IS NOT NULL;
+    INSERT INTO sales_changes (day, shop_id)
+    SELECT k.day, k.shop_id
+    FROM Receipts r, sales_receipt_key(r.receipt_number) k
+    WHERE r.orders_id = NEW.order_number AND k.day IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Состояние триггеров (включены ли analytics-rebuild) сохраняется при повторном
+-- применении миграции; новые триггеры создаются выключенными
+CREATE TEMP TABLE sales_trigger_states AS
+SELECT tgrelid::REGCLASS AS tbl, tgname, tgenabled FROM pg_trigger
+WHERE tgname IN ('receipt_positions_sales', 'receipts_sales', 'orders_sales') AND tgparentid = 0;
+
+DROP TRIGGER IF EXISTS receipt_positions_sales ON Receipt_positions;
+CREATE TRIGGER receipt_positions_sales
+    AFTER INSERT OR UPDATE OR DELETE ON Receipt_positions
+    FOR EACH ROW EXECUTE FUNCTION sales_enqueue_position();
+
+DROP TRIGGER IF EXISTS receipts_sales ON Receipts;
+CREATE TRIGGER receipts_sales
+    AFTER UPDATE OF date_oforder, shop_workerid, orders_id, payment_method OR DELETE ON Receipts
+    FOR EACH ROW EXECUTE FUNCTION sales_enqueue_receipt();
+
+DROP TRIGGER IF EXISTS orders_sales ON Orders;
+CREATE TRIGGER orders_sales
+    AFTER UPDATE OF shop_id ON Orders
+    FOR EACH ROW EXECUTE FUNCTION sales_enqueue_order();
+
+ALTER TABLE Receipt_positions DISABLE TRIGGER receipt_positions_sales;
+ALTER TABLE Receipts DISABLE TRIGGER receipts_sales;
+ALTER TABLE Orders DISABLE TRIGGER orders_sales;
+
+DO $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN SELECT * FROM sales_trigger_states WHERE tgenabled <> 'D' LOOP
+        EXECUTE format('ALTER TABLE %s %s TRIGGER %I', r.tbl,
+                       CASE r.tgenabled WHEN 'A' THEN 'ENABLE ALWAYS'
+                                        WHEN 'R' THEN 'ENABLE REPLICA' ELSE 'ENABLE' END,
+                       r.tgname);
+    END LOOP;
+END $$;
+
+DROP TABLE sales_trigger_states;
+
+INSERT INTO schema_migrations (version) VALUES ('004_sales_analytics') ON CONFLICT DO NOTHING;
@@ -0,0 +1,40 @@
+-- Уведомления об изменениях заказов для ленты /staff/orders/events (feed.py).
+-- Триггеры включены как ALWAYS, чтобы заказы, пришедшие по репликации,
+-- тоже попадали в ленту узла.
+
+CREATE OR REPLACE FUNCTION notify_order_change() RETURNS trigger AS $$
+DECLARE
+    payload JSON;
+BEGIN
+    IF TG_TABLE_NAME = 'orders' THEN
+        IF TG_OP = 'DELETE' THEN
+            payload := json_build_object('op', TG_OP, 'order_number', OLD.order_number,
+                                         'shop_id', OLD.shop_id, 'status', OLD.status);
+        ELSE
+            payload := json_build_object('op', TG_OP, 'order_number', NEW.order_number,
+                                         'shop_id', NEW.shop_id, 'status', NEW.status);
+        END IF;
+    ELSE
+        -- Изменение чека (оплата, возврат) относится к его заказу
+        payload := json_build_object('op', 'RECEIPT_' || TG_OP,
+                                     'order_number', COALESCE(NEW.orders_id, OLD.orders_id),
+                                     'payment_method', COALESCE(NEW.payment_method, OLD.payment_method));
+    END IF;
+    PERFORM pg_notify('order_changes', payload::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_notify ON Orders;
+CREATE TRIGGER orders_notify
+    AFTER INSERT OR UPDATE OR DELETE ON Orders
+    FOR EACH ROW EXECUTE FUNCTION notify_order_change();
+ALTER TABLE Orders ENABLE ALWAYS TRIGGER orders_notify;
+
+DROP TRIGGER IF EXISTS receipts_notify ON Receipts;
+CREATE TRIGGER receipts_notify
+    AFTER UPDATE OF payment_method, total_price ON Receipts
+    FOR EACH ROW EXECUTE FUNCTION notify_order_change();
+ALTER TABLE Receipts ENABLE ALWAYS TRIGGER receipts_notify;
+
+INSERT INTO schema_migrations (version) VALUES ('005_order_notify') ON CONFLICT DO NOTHING;
@@ -0,0 +1,7 @@
+-- Счётчики версий для оптимистичной блокировки заказов и чеков
+-- (version_id_col в models.Order / models.Receipt).
+
+ALTER TABLE Orders ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+ALTER TABLE Receipts ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+
+INSERT INTO schema_migrations (version) VALUES ('006_row_versions') ON CONFLICT DO NOTHING;
@@ -0,0 +1,281 @@
+-- Помесячное секционирование заказов, чеков и их позиций (partitions.py).
+-- Таблицы пересоздаются как секционированные по дате, данные, serial-последовательности,
+-- триггеры, права и членство в публикациях переносятся. Повторный запуск ничего не меняет.
+--
+-- Ограничения секционирования в PostgreSQL:
+--  * первичный ключ включает ключ секционирования: (order_number, date_of_order),
+--    (receipt_number, date_oforder), (id, order_date), (id, receipt_date);
+--    уникальность номеров заказов и чеков обеспечивает генератор номеров (ids.py);
+--  * позиции хранят дату родителя (order_date / receipt_date) и ссылаются на него
+--    составным ключом с ON UPDATE CASCADE: при смене даты заказа позиции
+--    переезжают в его секцию;
+--  * у чека своя дата, поэтому ссылка чека на заказ (orders_id) остаётся без
+--    внешнего ключа и без ограничения уникальности — только индекс.
+--
+-- Публикации переводятся на publish_via_partition_root, поэтому подписчики видят
+-- изменения как изменения исходных таблиц. После применения на издателе подписки
+-- на других узлах нужно обновить (вне транзакции):
+--   ALTER SUBSCRIPTION <подписка> REFRESH PUBLICATION WITH (copy_data = false);
+
+-- Секции parent_pYYYYMM для месяцев из [date_from, date_to); возвращает число созданных
+CREATE OR REPLACE FUNCTION create_month_partitions(parent REGCLASS, date_from DATE, date_to DATE)
+RETURNS INT AS $$
+DECLARE
+    base TEXT := (SELECT relname FROM pg_class WHERE oid = parent);
+    month_start DATE := date_trunc('month', date_from);
+    part_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month_start < date_to LOOP
+        part_name := format('%s_p%s', base, to_char(month_start, 'YYYYMM'));
+        IF to_regclass(part_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                           part_name, parent, month_start, (month_start + INTERVAL '1 month')::DATE);
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Режим срабатывания триггера ('O' — обычный, 'A' — ALWAYS, 'R' — REPLICA, 'D' — выключен)
+CREATE OR REPLACE FUNCTION set_trigger_state(tbl REGCLASS, trigger_name TEXT, state "char")
+RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('ALTER TABLE %s %s TRIGGER %I', tbl,
+                   CASE state WHEN 'A' THEN 'ENABLE ALWAYS' WHEN 'R' THEN 'ENABLE REPLICA'
+                              WHEN 'D' THEN 'DISABLE' ELSE 'ENABLE' END,
+                   trigger_name);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Замена таблицы tbl секционированной по key с первичным ключом pk.
+-- Старая таблица остаётся как tbl_legacy и удаляется после переноса всех четырёх.
+CREATE OR REPLACE FUNCTION partition_by_month(tbl TEXT, key TEXT, pk TEXT)
+RETURNS VOID AS $$
+DECLARE
+    legacy TEXT := tbl || '_legacy';
+    first_day DATE;
+    r RECORD;
+BEGIN
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', tbl, legacy);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING STORAGE) '
+                   'PARTITION BY RANGE (%I)', tbl, legacy, key);
+    EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s)', tbl, pk);
+    -- Строки вне созданных месяцев (например, импорт старых заказов) попадают сюда
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', tbl || '_default', tbl);
+
+    EXECUTE format('SELECT min(%I) FROM %I', key, legacy) INTO first_day;
+    PERFORM create_month_partitions(tbl::REGCLASS, COALESCE(first_day, current_date),
+                                    (date_trunc('month', current_date) + INTERVAL '4 months')::DATE);
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', tbl, legacy);
+
+    -- Последовательности serial-столбцов не должны удалиться вместе со старой таблицей
+    FOR r IN
+        SELECT a.attname, pg_get_serial_sequence(legacy, a.attname) AS seq
+        FROM pg_attribute a
+        WHERE a.attrelid = legacy::REGCLASS AND a.attnum > 0 AND NOT a.attisdropped
+    LOOP
+        IF r.seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', r.seq, tbl, r.attname);
+        END IF;
+    END LOOP;
+
+    -- Триггеры переносятся с тем же режимом срабатывания
+    FOR r IN
+        SELECT t.tgname, t.tgenabled, pg_get_triggerdef(t.oid) AS definition
+        FROM pg_trigger t
+        WHERE t.tgrelid = legacy::REGCLASS AND NOT t.tgisinternal
+    LOOP
+        EXECUTE replace(r.definition, format(' ON public.%s ', legacy), format(' ON public.%s ', tbl));
+        PERFORM set_trigger_state(tbl::REGCLASS, r.tgname, r.tgenabled);
+    END LOOP;
+
+    FOR r IN
+        SELECT grantee, privilege_type
+        FROM information_schema.role_table_grants
+        WHERE table_schema = 'public' AND table_name = legacy AND grantee <> current_user
+    LOOP
+        EXECUTE format('GRANT %s ON %I TO %s', r.privilege_type, tbl,
+                       CASE r.grantee WHEN 'PUBLIC' THEN 'PUBLIC' ELSE quote_ident(r.grantee) END);
+    END LOOP;
+
+    -- Публикации: изменения секций публикуются от имени корневой таблицы
+    FOR r IN
+        SELECT p.pubname
+        FROM pg_publication p
+        JOIN pg_publication_rel pr ON pr.prpubid = p.oid
+        WHERE pr.prrelid = legacy::REGCLASS
+    LOOP
+        EXECUTE format('ALTER PUBLICATION %I DROP TABLE %I', r.pubname, legacy);
+        EXECUTE format('ALTER PUBLICATION %I ADD TABLE %I', r.pubname, tbl);
+        EXECUTE format('ALTER PUBLICATION %I SET (publish_via_partition_root = true)', r.pubname);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'orders'::REGCLASS) = 'p' THEN
+        RETURN;
+    END IF;
+
+    -- Ключ секционирования не может быть NULL
+    UPDATE Orders o SET date_of_order = COALESCE(
+        (SELECT r.date_oforder FROM Receipts r WHERE r.orders_id = o.order_number), current_date)
+    WHERE o.date_of_order IS NULL;
+    ALTER TABLE Orders ALTER COLUMN date_of_order SET NOT NULL;
+
+    UPDATE Receipts r SET date_oforder = COALESCE(
+        (SELECT o.date_of_order FROM Orders o WHERE o.order_number = r.orders_id), r.created_at::DATE)
+    WHERE r.date_oforder IS NULL;
+    ALTER TABLE Receipts ALTER COLUMN date_oforder SET NOT NULL;
+
+    ALTER TABLE Ordered_goods ADD COLUMN order_date DATE;
+    UPDATE Ordered_goods g SET order_date = o.date_of_order
+    FROM Orders o WHERE o.order_number = g.order_id;
+    ALTER TABLE Ordered_goods ALTER COLUMN order_date SET NOT NULL;
+
+    ALTER TABLE Receipt_positions ADD COLUMN receipt_date DATE;
+    UPDATE Receipt_positions p SET receipt_date = r.date_oforder
+    FROM Receipts r WHERE r.receipt_number = p.receipt_id;
+    ALTER TABLE Receipt_positions ALTER COLUMN receipt_date SET NOT NULL;
+
+    PERFORM partition_by_month('orders', 'date_of_order', 'order_number, date_of_order');
+    PERFORM partition_by_month('receipts', 'date_oforder', 'receipt_number, date_oforder');
+    PERFORM partition_by_month('ordered_goods', 'order_date', 'id, order_date');
+    PERFORM partition_by_month('receipt_positions', 'receipt_date', 'id, receipt_date');
+
+    -- Вместе со старыми таблицами удаляются их индексы и внешние ключи
+    DROP TABLE receipt_positions_legacy, ordered_goods_legacy, receipts_legacy, orders_legacy;
+
+    ALTER TABLE Orders ADD FOREIGN KEY (client_id) REFERENCES Clients(id);
+    ALTER TABLE Orders ADD FOREIGN KEY (shop_id) REFERENCES Shops(id);
+    ALTER TABLE Receipts ADD FOREIGN KEY (shop_workerid) REFERENCES Workers(id);
+    ALTER TABLE Receipts ADD FOREIGN KEY (client_id) REFERENCES Clients(id);
+    ALTER TABLE Ordered_goods ADD FOREIGN KEY (order_id, order_date)
+        REFERENCES Orders(order_number, date_of_order) ON UPDATE CASCADE;
+    ALTER TABLE Ordered_goods ADD FOREIGN KEY (invoice_id) REFERENCES Invoices(invoicenumber);
+    ALTER TABLE Receipt_positions ADD FOREIGN KEY (receipt_id, receipt_date)
+        REFERENCES Receipts(receipt_number, date_oforder) ON UPDATE CASCADE;
+    ALTER TABLE Receipt_positions ADD FOREIGN KEY (invoice_id) REFERENCES Invoices(invoicenumber);
+END $$;
+
+-- Индексы из 001/004 на секционированных таблицах (создаются в каждой секции)
+CREATE INDEX IF NOT EXISTS orders_date_number_idx
+    ON Orders (date_of_order DESC, order_number DESC);
+CREATE INDEX IF NOT EXISTS orders_shop_status_date_idx
+    ON Orders (shop_id, status, date_of_order DESC, order_number DESC);
+CREATE INDEX IF NOT EXISTS orders_status_date_idx
+    ON Orders (status, date_of_order DESC, order_number DESC);
+CREATE INDEX IF NOT EXISTS orders_client_date_idx
+    ON Orders (client_id, date_of_order DESC);
+CREATE INDEX IF NOT EXISTS ordered_goods_order_id_idx
+    ON Ordered_goods (order_id);
+CREATE INDEX IF NOT EXISTS ordered_goods_invoice_id_idx
+    ON Ordered_goods (invoice_id);
+CREATE INDEX IF NOT EXISTS receipt_positions_receipt_id_idx
+    ON Receipt_positions (receipt_id);
+CREATE INDEX IF NOT EXISTS receipt_positions_invoice_id_idx
+    ON Receipt_positions (invoice_id);
+CREATE INDEX IF NOT EXISTS receipts_client_id_idx
+    ON Receipts (client_id);
+CREATE INDEX IF NOT EXISTS receipts_orders_id_idx
+    ON Receipts (orders_id);
+CREATE INDEX IF NOT EXISTS receipts_date_idx
+    ON Receipts (date_oforder);
+
+-- В секционированной таблице TG_TABLE_NAME — имя секции, поэтому таблица
+-- определяется по корню иерархии
+CREATE OR REPLACE FUNCTION notify_order_change() RETURNS trigger AS $$
+DECLARE
+    payload JSON;
+BEGIN
+    IF pg_partition_root(TG_RELID) = 'orders'::REGCLASS THEN
+        IF TG_OP = 'DELETE' THEN
+            payload := json_build_object('op', TG_OP, 'order_number', OLD.order_number,
+                                         'shop_id', OLD.shop_id, 'status', OLD.status);
+        ELSE
+            payload := json_build_object('op', TG_OP, 'order_number', NEW.order_number,
+                                         'shop_id', NEW.shop_id, 'status', NEW.status);
+        END IF;
+    ELSE
+        -- Изменение чека (оплата, возврат) относится к его заказу
+        payload := json_build_object('op', 'RECEIPT_' || TG_OP,
+                                     'order_number', COALESCE(NEW.orders_id, OLD.orders_id),
+                                     'payment_method', COALESCE(NEW.payment_method, OLD.payment_method));
+    END IF;
+    PERFORM pg_notify('order_changes', payload::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- UPDATE, меняющий дату, переносит строку в другую секцию и вызывает триггеры
+-- DELETE и INSERT вместо UPDATE: очередь пересчёта продаж должна их тоже видеть
+CREATE OR REPLACE FUNCTION sales_enqueue_receipt() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.date_oforder IS NOT NULL THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT OLD.date_oforder, COALESCE(
+            (SELECT o.shop_id FROM Orders o WHERE o.order_number = OLD.orders_id),
+            (SELECT w.shop_id FROM Workers w WHERE w.id = OLD.shop_workerid), 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(NEW.receipt_number) k WHERE k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_order() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT r.date_oforder, COALESCE(OLD.shop_id, 0)
+        FROM Receipts r WHERE r.orders_id = OLD.order_number;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id
+        FROM Receipts r, sales_receipt_key(r.receipt_number) k
+        WHERE r.orders_id = NEW.order_number AND k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    state "char";
+BEGIN
+    SELECT tgenabled INTO state FROM pg_trigger
+    WHERE tgrelid = 'receipts'::REGCLASS AND tgname = 'receipts_sales';
+    DROP TRIGGER IF EXISTS receipts_sales ON Receipts;
+    CREATE TRIGGER receipts_sales
+        AFTER INSERT OR UPDATE OF date_oforder, shop_workerid, orders_id, payment_method OR DELETE
+        ON Receipts
+        FOR EACH ROW EXECUTE FUNCTION sales_enqueue_receipt();
+    PERFORM set_trigger_state('receipts'::REGCLASS, 'receipts_sales', COALESCE(state, 'D'));
+
+    SELECT tgenabled INTO state FROM pg_trigger
+    WHERE tgrelid = 'orders'::REGCLASS AND tgname = 'orders_sales';
+    DROP TRIGGER IF EXISTS orders_sales ON Orders;
+    CREATE TRIGGER orders_sales
+        AFTER INSERT OR UPDATE OF shop_id OR DELETE ON Orders
+        FOR EACH ROW EXECUTE FUNCTION sales_enqueue_order();
+    PERFORM set_trigger_state('orders'::REGCLASS, 'orders_sales', COALESCE(state, 'D'));
+END $$;
+
+-- Выгруженные в архив месяцы (partitions.archive_month)
+CREATE TABLE IF NOT EXISTS archived_partitions (
+    table_name VARCHAR NOT NULL,
+    month DATE NOT NULL,
+    path VARCHAR NOT NULL,
+    row_count BIGINT NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, month)
+);
+
+INSERT INTO schema_migrations (version) VALUES ('007_partition_orders') ON CONFLICT DO NOTHING;
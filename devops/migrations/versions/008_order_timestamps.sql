@@ -0,0 +1,27 @@
+-- Время последнего изменения заказа и чека: Last-Modified страниц заказа
+-- (order_cache.py). Триггер обычный (не ALWAYS): при применении репликации
+-- он не срабатывает, и на подписчике остаётся время изменения с издателя.
+
+ALTER TABLE Orders ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+ALTER TABLE Receipts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW IS DISTINCT FROM OLD THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_touch ON Orders;
+CREATE TRIGGER orders_touch
+    BEFORE UPDATE ON Orders
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS receipts_touch ON Receipts;
+CREATE TRIGGER receipts_touch
+    BEFORE UPDATE ON Receipts
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+INSERT INTO schema_migrations (version) VALUES ('008_order_timestamps') ON CONFLICT DO NOTHING;
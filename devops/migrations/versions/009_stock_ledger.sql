@@ -0,0 +1,131 @@
+-- Остатки товаров по магазинам (stock.py): поступило по накладным минус
+-- заказано в неотменённых заказах. Счётчики меняются триггерами в той же
+-- транзакции, что и накладная или позиция заказа; flask stock-reconcile
+-- пересчитывает их по истории и показывает расхождения.
+--
+-- Позиции чека повторяют позиции заказа, поэтому расход считается только по
+-- Ordered_goods. Магазин и товар позиции берутся из её накладной.
+-- Триггеры включены как ALWAYS: накладные приходят на узлы магазинов по
+-- репликации, а заказы магазинов — на узел administration.
+
+ALTER TABLE Invoices ADD COLUMN IF NOT EXISTS quantity INT;
+-- Количество в старых накладных восстанавливается по цене товара
+UPDATE Invoices i SET quantity = GREATEST(round(i.total_price / g.price), 0)
+FROM List_of_goods g
+WHERE g.id = i.goodid AND i.quantity IS NULL AND g.price > 0;
+
+CREATE TABLE IF NOT EXISTS stock_balances (
+    shop_id INT NOT NULL,
+    good_id INT NOT NULL,
+    received BIGINT NOT NULL DEFAULT 0,
+    ordered BIGINT NOT NULL DEFAULT 0,
+    available BIGINT GENERATED ALWAYS AS (received - ordered) STORED,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (shop_id, good_id)
+);
+
+CREATE OR REPLACE FUNCTION stock_apply(p_shop INT, p_good INT, d_received BIGINT, d_ordered BIGINT)
+RETURNS void AS $$
+BEGIN
+    IF p_shop IS NULL OR p_good IS NULL OR (d_received = 0 AND d_ordered = 0) THEN
+        RETURN;
+    END IF;
+    INSERT INTO stock_balances AS b (shop_id, good_id, received, ordered)
+    VALUES (p_shop, p_good, d_received, d_ordered)
+    ON CONFLICT (shop_id, good_id) DO UPDATE
+    SET received = b.received + EXCLUDED.received,
+        ordered = b.ordered + EXCLUDED.ordered,
+        updated_at = now();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Учитывается только накладная, дошедшая до магазина (receipt_date заполнена)
+CREATE OR REPLACE FUNCTION stock_on_invoice() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.receipt_date IS NOT NULL THEN
+        PERFORM stock_apply(OLD.shop_id, OLD.goodid, -COALESCE(OLD.quantity, 0), 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.receipt_date IS NOT NULL THEN
+        PERFORM stock_apply(NEW.shop_id, NEW.goodid, COALESCE(NEW.quantity, 0), 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stock_on_ordered_goods() RETURNS trigger AS $$
+BEGIN
+    -- Позиции отменённого заказа остаток не занимают (см. stock_on_order_status)
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM stock_apply(i.shop_id, i.goodid, 0, -OLD.quantity)
+        FROM Invoices i
+        WHERE i.invoicenumber = OLD.invoice_id
+          AND NOT EXISTS (SELECT 1 FROM Orders o
+                          WHERE o.order_number = OLD.order_id AND o.status = 'Отменен');
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM stock_apply(i.shop_id, i.goodid, 0, NEW.quantity)
+        FROM Invoices i
+        WHERE i.invoicenumber = NEW.invoice_id
+          AND NOT EXISTS (SELECT 1 FROM Orders o
+                          WHERE o.order_number = NEW.order_id AND o.status = 'Отменен');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отмена заказа возвращает его позиции в остаток, снятие отмены — снова занимает
+CREATE OR REPLACE FUNCTION stock_on_order_status() RETURNS trigger AS $$
+DECLARE
+    direction INT;
+BEGIN
+    IF (COALESCE(OLD.status, '') = 'Отменен') = (COALESCE(NEW.status, '') = 'Отменен') THEN
+        RETURN NULL;
+    END IF;
+    direction := CASE WHEN NEW.status = 'Отменен' THEN -1 ELSE 1 END;
+    PERFORM stock_apply(i.shop_id, i.goodid, 0, direction * sum(og.quantity))
+    FROM Ordered_goods og
+    JOIN Invoices i ON i.invoicenumber = og.invoice_id
+    WHERE og.order_id = NEW.order_number
+    GROUP BY i.shop_id, i.goodid
+    ORDER BY i.shop_id, i.goodid;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS invoices_stock ON Invoices;
+CREATE TRIGGER invoices_stock
+    AFTER INSERT OR UPDATE OF receipt_date, quantity, shop_id, goodid OR DELETE ON Invoices
+    FOR EACH ROW EXECUTE FUNCTION stock_on_invoice();
+ALTER TABLE Invoices ENABLE ALWAYS TRIGGER invoices_stock;
+
+DROP TRIGGER IF EXISTS ordered_goods_stock ON Ordered_goods;
+CREATE TRIGGER ordered_goods_stock
+    AFTER INSERT OR UPDATE OF quantity, invoice_id OR DELETE ON Ordered_goods
+    FOR EACH ROW EXECUTE FUNCTION stock_on_ordered_goods();
+ALTER TABLE Ordered_goods ENABLE ALWAYS TRIGGER ordered_goods_stock;
+
+DROP TRIGGER IF EXISTS orders_stock ON Orders;
+CREATE TRIGGER orders_stock
+    AFTER UPDATE OF status ON Orders
+    FOR EACH ROW EXECUTE FUNCTION stock_on_order_status();
+ALTER TABLE Orders ENABLE ALWAYS TRIGGER orders_stock;
+
+-- Начальные остатки по уже накопленной истории
+INSERT INTO stock_balances (shop_id, good_id, received, ordered)
+SELECT shop_id, good_id, sum(received), sum(ordered)
+FROM (
+    SELECT shop_id, goodid AS good_id, COALESCE(quantity, 0) AS received, 0 AS ordered
+    FROM Invoices
+    WHERE receipt_date IS NOT NULL
+    UNION ALL
+    SELECT i.shop_id, i.goodid, 0, og.quantity
+    FROM Ordered_goods og
+    JOIN Invoices i ON i.invoicenumber = og.invoice_id
+    JOIN Orders o ON o.order_number = og.order_id AND o.date_of_order = og.order_date
+    WHERE o.status IS DISTINCT FROM 'Отменен'
+) movements
+WHERE shop_id IS NOT NULL AND good_id IS NOT NULL
+GROUP BY shop_id, good_id
+ON CONFLICT (shop_id, good_id) DO NOTHING;
+
+INSERT INTO schema_migrations (version) VALUES ('009_stock_ledger') ON CONFLICT DO NOTHING;
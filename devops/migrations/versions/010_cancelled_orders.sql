@@ -0,0 +1,7 @@
+-- Отменённые заказы в порядке отмены для purge-orders (purge.py): пачка
+-- выбирается по индексу, а не сканированием всех секций заказов.
+
+CREATE INDEX IF NOT EXISTS orders_cancelled_idx
+    ON Orders (updated_at) WHERE status = 'Отменен';
+
+INSERT INTO schema_migrations (version) VALUES ('010_cancelled_orders') ON CONFLICT DO NOTHING;
@@ -0,0 +1,15 @@
+-- Ключи идемпотентности: повтор запроса с тем же ключом возвращает сохранённый
+-- ответ вместо повторной записи. Таблица локальна для узла (не входит в публикации):
+-- повтор приходит на тот же узел, что и исходный запрос.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(64) NOT NULL,       -- endpoint или источник пакетной загрузки
+    key VARCHAR(128) NOT NULL,
+    fingerprint BYTEA,                -- отпечаток запроса: тот же ключ с другими данными — ошибка
+    response JSONB,                   -- NULL, пока исходный запрос не завершён
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx ON idempotency_keys (expires_at);
+
+INSERT INTO schema_migrations (version) VALUES ('011_idempotency_keys') ON CONFLICT DO NOTHING;
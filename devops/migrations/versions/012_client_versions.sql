@@ -0,0 +1,15 @@
+-- Версия таблицы клиентов в reference_versions (миграция 003) для кэша поиска
+-- клиентов (search.py): изменения из других процессов, import-orders и
+-- репликации clients_from_shop* сбрасывают кэш всех процессов узла.
+-- Триггер построчный и ALWAYS: при применении репликации срабатывают только
+-- построчные триггеры.
+
+DROP TRIGGER IF EXISTS clients_reference_version ON Clients;
+CREATE TRIGGER clients_reference_version
+    AFTER INSERT OR UPDATE OR DELETE ON Clients
+    FOR EACH ROW EXECUTE FUNCTION bump_reference_version();
+ALTER TABLE Clients ENABLE ALWAYS TRIGGER clients_reference_version;
+
+INSERT INTO reference_versions (table_name) VALUES ('clients') ON CONFLICT DO NOTHING;
+
+INSERT INTO schema_migrations (version) VALUES ('012_client_versions') ON CONFLICT DO NOTHING;
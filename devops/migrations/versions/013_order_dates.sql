@@ -0,0 +1,228 @@
+-- Справочник «номер заказа → дата заказа и чек» для секционированных таблиц (миграция 007).
+-- По одному номеру заказа или чека секцию не определить, и такой поиск проверяет
+-- индекс каждой месячной секции. Запросы приложения и триггеры берут дату из
+-- несекционированной order_dates, и планировщик оставляет одну секцию.
+-- Заодно возвращаются гарантии, потерянные при секционировании: первичный ключ
+-- order_dates не даёт повторить номер заказа на узле, UNIQUE — номер чека, а
+-- у заказа не больше одного чека.
+-- Триггеры включены как ALWAYS: заказы, пришедшие по репликации, тоже попадают
+-- в справочник (повтор номера с другого узла станет ошибкой применения).
+
+CREATE TABLE IF NOT EXISTS order_dates (
+    order_number VARCHAR PRIMARY KEY,
+    date_of_order DATE NOT NULL,
+    receipt_number VARCHAR UNIQUE,
+    receipt_date DATE
+);
+
+-- Удаление записей архивированного месяца (partitions.archive_month)
+CREATE INDEX IF NOT EXISTS order_dates_date_idx ON order_dates (date_of_order);
+
+-- Смена даты переносит строку в другую секцию: срабатывают DELETE и затем INSERT.
+-- Поэтому DELETE оставляет запись, пока заказ есть в какой-либо секции, а INSERT
+-- занимает существующий номер, только если прежней строки заказа больше нет.
+CREATE OR REPLACE FUNCTION order_dates_on_order() RETURNS trigger AS $$
+DECLARE
+    n INT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM order_dates d
+        WHERE d.order_number = OLD.order_number
+          AND NOT EXISTS (SELECT 1 FROM Orders o WHERE o.order_number = OLD.order_number);
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE order_dates SET order_number = NEW.order_number, date_of_order = NEW.date_of_order
+        WHERE order_number = OLD.order_number;
+        RETURN NULL;
+    END IF;
+    INSERT INTO order_dates AS d (order_number, date_of_order)
+    VALUES (NEW.order_number, NEW.date_of_order)
+    ON CONFLICT (order_number) DO UPDATE SET date_of_order = EXCLUDED.date_of_order
+    WHERE NOT EXISTS (SELECT 1 FROM Orders o
+                      WHERE o.order_number = d.order_number AND o.date_of_order = d.date_of_order);
+    GET DIAGNOSTICS n = ROW_COUNT;
+    IF n = 0 THEN
+        RAISE EXCEPTION 'Заказ % уже существует', NEW.order_number USING ERRCODE = 'unique_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION order_dates_on_receipt() RETURNS trigger AS $$
+DECLARE
+    n INT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- Чек, перенесённый в другую секцию, остаётся привязанным к заказу
+        UPDATE order_dates d SET receipt_number = NULL, receipt_date = NULL
+        WHERE d.order_number = OLD.orders_id AND d.receipt_number = OLD.receipt_number
+          AND NOT EXISTS (SELECT 1 FROM Receipts r
+                          WHERE r.receipt_number = OLD.receipt_number AND r.orders_id = OLD.orders_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.orders_id IS NOT NULL THEN
+        UPDATE order_dates d SET receipt_number = NEW.receipt_number, receipt_date = NEW.date_oforder
+        WHERE d.order_number = NEW.orders_id
+          AND (d.receipt_number IS NULL OR d.receipt_number = NEW.receipt_number
+               OR NOT EXISTS (SELECT 1 FROM Receipts r
+                              WHERE r.receipt_number = d.receipt_number AND r.date_oforder = d.receipt_date));
+        GET DIAGNOSTICS n = ROW_COUNT;
+        IF n = 0 AND EXISTS (SELECT 1 FROM order_dates WHERE order_number = NEW.orders_id) THEN
+            RAISE EXCEPTION 'У заказа % уже есть чек', NEW.orders_id USING ERRCODE = 'unique_violation';
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполнение по уже существующим заказам и чекам (миграция, bench-seed с
+-- выключенными триггерами); возвращает число добавленных заказов
+CREATE OR REPLACE FUNCTION order_dates_fill() RETURNS BIGINT AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    INSERT INTO order_dates (order_number, date_of_order)
+    SELECT DISTINCT ON (order_number) order_number, date_of_order
+    FROM Orders
+    ORDER BY order_number, date_of_order
+    ON CONFLICT (order_number) DO NOTHING;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    UPDATE order_dates d SET receipt_number = r.receipt_number, receipt_date = r.date_oforder
+    FROM (
+        SELECT DISTINCT ON (orders_id) orders_id, receipt_number, date_oforder
+        FROM Receipts
+        WHERE orders_id IS NOT NULL
+        ORDER BY orders_id, date_oforder, receipt_number
+    ) r
+    WHERE d.order_number = r.orders_id AND d.receipt_number IS NULL
+      AND NOT EXISTS (SELECT 1 FROM order_dates x WHERE x.receipt_number = r.receipt_number);
+    RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_dates ON Orders;
+CREATE TRIGGER orders_dates
+    AFTER INSERT OR UPDATE OF order_number, date_of_order OR DELETE ON Orders
+    FOR EACH ROW EXECUTE FUNCTION order_dates_on_order();
+SELECT set_trigger_state('orders'::REGCLASS, 'orders_dates', 'A');
+
+DROP TRIGGER IF EXISTS receipts_dates ON Receipts;
+CREATE TRIGGER receipts_dates
+    AFTER INSERT OR UPDATE OF receipt_number, date_oforder, orders_id OR DELETE ON Receipts
+    FOR EACH ROW EXECUTE FUNCTION order_dates_on_receipt();
+SELECT set_trigger_state('receipts'::REGCLASS, 'receipts_dates', 'A');
+
+SELECT order_dates_fill();
+
+-- Триггеры остатков (009) и агрегатов продаж (004, 007): поиск заказа и чека с датой,
+-- чтобы каждая строка проверяла одну секцию
+
+CREATE OR REPLACE FUNCTION stock_on_ordered_goods() RETURNS trigger AS $$
+BEGIN
+    -- Позиции отменённого заказа остаток не занимают (см. stock_on_order_status)
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM stock_apply(i.shop_id, i.goodid, 0, -OLD.quantity)
+        FROM Invoices i
+        WHERE i.invoicenumber = OLD.invoice_id
+          AND NOT EXISTS (SELECT 1 FROM Orders o
+                          WHERE o.order_number = OLD.order_id AND o.date_of_order = OLD.order_date
+                            AND o.status = 'Отменен');
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM stock_apply(i.shop_id, i.goodid, 0, NEW.quantity)
+        FROM Invoices i
+        WHERE i.invoicenumber = NEW.invoice_id
+          AND NOT EXISTS (SELECT 1 FROM Orders o
+                          WHERE o.order_number = NEW.order_id AND o.date_of_order = NEW.order_date
+                            AND o.status = 'Отменен');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stock_on_order_status() RETURNS trigger AS $$
+DECLARE
+    direction INT;
+BEGIN
+    IF (COALESCE(OLD.status, '') = 'Отменен') = (COALESCE(NEW.status, '') = 'Отменен') THEN
+        RETURN NULL;
+    END IF;
+    direction := CASE WHEN NEW.status = 'Отменен' THEN -1 ELSE 1 END;
+    PERFORM stock_apply(i.shop_id, i.goodid, 0, direction * sum(og.quantity))
+    FROM Ordered_goods og
+    JOIN Invoices i ON i.invoicenumber = og.invoice_id
+    WHERE og.order_id = NEW.order_number AND og.order_date = NEW.date_of_order
+    GROUP BY i.shop_id, i.goodid
+    ORDER BY i.shop_id, i.goodid;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_receipt_key(p_receipt VARCHAR, p_date DATE,
+                                             OUT day DATE, OUT shop_id INT) AS $$
+    SELECT r.date_oforder, COALESCE(o.shop_id, w.shop_id, 0)
+    FROM Receipts r
+    LEFT JOIN order_dates d ON d.order_number = r.orders_id
+    LEFT JOIN Orders o ON o.order_number = d.order_number AND o.date_of_order = d.date_of_order
+    LEFT JOIN Workers w ON w.id = r.shop_workerid
+    WHERE r.receipt_number = p_receipt AND r.date_oforder = p_date;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_position() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(OLD.receipt_id, OLD.receipt_date) k
+        WHERE k.day IS NOT NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(NEW.receipt_id, NEW.receipt_date) k
+        WHERE k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_receipt() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.date_oforder IS NOT NULL THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT OLD.date_oforder, COALESCE(
+            (SELECT o.shop_id FROM order_dates d
+             JOIN Orders o ON o.order_number = d.order_number AND o.date_of_order = d.date_of_order
+             WHERE d.order_number = OLD.orders_id),
+            (SELECT w.shop_id FROM Workers w WHERE w.id = OLD.shop_workerid), 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id FROM sales_receipt_key(NEW.receipt_number, NEW.date_oforder) k
+        WHERE k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sales_enqueue_order() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT d.receipt_date, COALESCE(OLD.shop_id, 0)
+        FROM order_dates d
+        WHERE d.order_number = OLD.order_number AND d.receipt_date IS NOT NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT k.day, k.shop_id
+        FROM order_dates d, sales_receipt_key(d.receipt_number, d.receipt_date) k
+        WHERE d.order_number = NEW.order_number AND d.receipt_number IS NOT NULL
+          AND k.day IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS sales_receipt_key(VARCHAR);
+
+INSERT INTO schema_migrations (version) VALUES ('013_order_dates') ON CONFLICT DO NOTHING;
@@ -0,0 +1,12 @@
+-- Время последнего изменения клиента: страница заказа показывает его имя и
+-- контакты, и Last-Modified (order_cache.py) должен учитывать и их.
+-- Триггер обычный, как в миграции 008: на подписчике остаётся время с издателя.
+
+ALTER TABLE Clients ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+DROP TRIGGER IF EXISTS clients_touch ON Clients;
+CREATE TRIGGER clients_touch
+    BEFORE UPDATE ON Clients
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+INSERT INTO schema_migrations (version) VALUES ('014_client_timestamps') ON CONFLICT DO NOTHING;
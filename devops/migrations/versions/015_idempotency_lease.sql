@@ -0,0 +1,7 @@
+-- Аренда незавершённого ключа идемпотентности (idempotency.py): ключ без ответа,
+-- занятый дольше IDEMPOTENCY_LEASE_SECONDS назад, может занять новый запрос, и
+-- повторы не получают 409 всё время хранения ключа.
+
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP;
+
+INSERT INTO schema_migrations (version) VALUES ('015_idempotency_lease') ON CONFLICT DO NOTHING;
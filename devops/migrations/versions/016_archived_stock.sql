@@ -0,0 +1,13 @@
+-- Расход остатков архивированных месяцев (partitions.archive_month): удаление
+-- секции не вызывает триггеров, и stock_balances по-прежнему учитывает заказы
+-- архивного месяца. Сверка остатков (stock.py) берёт их отсюда, а не из
+-- отсутствующих секций.
+CREATE TABLE IF NOT EXISTS archived_stock (
+    month DATE NOT NULL,
+    shop_id INT NOT NULL,
+    good_id INT NOT NULL,
+    ordered BIGINT NOT NULL,
+    PRIMARY KEY (month, shop_id, good_id)
+);
+
+INSERT INTO schema_migrations (version) VALUES ('016_archived_stock') ON CONFLICT DO NOTHING;
@@ -0,0 +1,33 @@
+-- Счётчик версии справочника разбит на слоты по процессу сервера: построчный
+-- триггер clients_reference_version (миграция 012) обновлял одну строку
+-- reference_versions, и её блокировка до COMMIT выстраивала в очередь все
+-- транзакции, меняющие клиентов. Теперь транзакция обновляет слот своего
+-- процесса, а версия справочника — сумма слотов (reference.py).
+-- Триггер остаётся построчным: при применении репликации срабатывают только
+-- построчные триггеры. Последовательность не подходит: nextval виден до COMMIT,
+-- и кэш мог бы сохранить старые строки под новой версией.
+
+ALTER TABLE reference_versions ADD COLUMN IF NOT EXISTS slot INT NOT NULL DEFAULT 0;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_index i
+                   JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY (i.indkey)
+                   WHERE i.indrelid = 'reference_versions'::REGCLASS AND i.indisprimary
+                     AND a.attname = 'slot') THEN
+        ALTER TABLE reference_versions DROP CONSTRAINT reference_versions_pkey;
+        ALTER TABLE reference_versions ADD PRIMARY KEY (table_name, slot);
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO reference_versions (table_name, slot, version)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1)
+    ON CONFLICT (table_name, slot) DO UPDATE
+        SET version = reference_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO schema_migrations (version) VALUES ('017_reference_version_slots') ON CONFLICT DO NOTHING;
@@ -0,0 +1,212 @@
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db
+from reference import reference_cache
+
+# Продажа относится к магазину заказа, иначе к магазину кассира (0 — неизвестен).
+# Чеки возвратов (отменённые заказы) в агрегаты не входят. Заказ чека ищется
+# по дате из order_dates, позиции — по дате чека: одна секция на строку.
+SALES_SOURCE = '''
+    FROM unnest(CAST(:days AS DATE[]), CAST(:shops AS INT[])) AS p(day, shop_id)
+    JOIN receipts r ON r.date_oforder = p.day
+    JOIN receipt_positions rp ON rp.receipt_id = r.receipt_number AND rp.receipt_date = r.date_oforder
+    JOIN invoices i ON i.invoicenumber = rp.invoice_id
+    JOIN list_of_goods g ON g.id = i.goodid
+    LEFT JOIN order_dates od ON od.order_number = r.orders_id
+    LEFT JOIN orders o ON o.order_number = od.order_number AND o.date_of_order = od.date_of_order
+    LEFT JOIN workers w ON w.id = r.shop_workerid
+    WHERE COALESCE(o.shop_id, w.shop_id, 0) = p.shop_id
+      AND r.payment_method IS DISTINCT FROM 'Возврат'
+'''
+
+SALES_MEASURES = '''
+    COALESCE(o.shop_id, w.shop_id, 0), COALESCE(r.shop_workerid, 0), g.id, g.category_id,
+    SUM(rp.quantity),
+    SUM(COALESCE(rp.subtotal, rp.price_per_unit * rp.quantity, 0)),
+    COUNT(DISTINCT r.receipt_number)
+'''
+
+# Пачки пересчитываются последовательно, даже если refresh запущен параллельно
+LOCK_REFRESH = text("SELECT pg_advisory_xact_lock(hashtext('sales_analytics'))")
+
+TAKE_CHANGES = text('''
+    WITH batch AS (
+        DELETE FROM sales_changes
+        WHERE id IN (SELECT id FROM sales_changes ORDER BY id
+                     LIMIT :limit FOR UPDATE SKIP LOCKED)
+        RETURNING day, shop_id
+    )
+    SELECT DISTINCT day, shop_id FROM batch
+''')
+
+CLEAR_DAILY = text('''
+    DELETE FROM sales_daily d
+    USING unnest(CAST(:days AS DATE[]), CAST(:shops AS INT[])) AS p(day, shop_id)
+    WHERE d.day = p.day AND d.shop_id = p.shop_id
+''')
+
+CLEAR_HOURLY = text('''
+    DELETE FROM sales_hourly h
+    USING unnest(CAST(:days AS DATE[]), CAST(:shops AS INT[])) AS p(day, shop_id)
+    WHERE h.hour >= p.day AND h.hour < p.day + 1 AND h.shop_id = p.shop_id
+''')
+
+FILL_DAILY = text(f'''
+    INSERT INTO sales_daily
+        (day, shop_id, worker_id, good_id, category_id, quantity, revenue, receipts)
+    SELECT r.date_oforder, {SALES_MEASURES}
+    {SALES_SOURCE}
+    GROUP BY 1, 2, 3, 4, 5
+''')
+
+FILL_HOURLY = text(f'''
+    INSERT INTO sales_hourly
+        (hour, shop_id, worker_id, good_id, category_id, quantity, revenue, receipts)
+    SELECT r.date_oforder + make_time(EXTRACT(HOUR FROM r.created_at)::INT, 0, 0),
+           {SALES_MEASURES}
+    {SALES_SOURCE}
+    GROUP BY 1, 2, 3, 4, 5
+''')
+
+TRIGGERS = (
+    ('receipt_positions', 'receipt_positions_sales'),
+    ('receipts', 'receipts_sales'),
+    ('orders', 'orders_sales'),
+)
+
+
+def refresh(batch_size=500):
+    """Пересчёт агрегатов для накопившихся в очереди пар (день, магазин).
+
+    Каждая пачка пересчитывается в своей транзакции только по чекам
+    затронутых дней и магазинов, поэтому стоимость не зависит от объёма истории.
+    """
+    refreshed = 0
+    while True:
+        db.session.execute(LOCK_REFRESH)
+        pairs = db.session.execute(TAKE_CHANGES, {'limit': batch_size}).all()
+        if not pairs:
+            db.session.commit()
+            return refreshed
+        params = {'days': [p.day for p in pairs], 'shops': [p.shop_id for p in pairs]}
+        for statement in (CLEAR_DAILY, CLEAR_HOURLY, FILL_DAILY, FILL_HOURLY):
+            db.session.execute(statement, params)
+        db.session.commit()
+        refreshed += len(pairs)
+
+
+def rebuild(batch_size=500):
+    """Включение триггеров очереди и полный пересчёт агрегатов"""
+    # Полный проход по чекам не укладывается в statement_timeout запросов приложения
+    db.session.execute(text('SET LOCAL statement_timeout = 0'))
+    for table, trigger in TRIGGERS:
+        # ALWAYS — чтобы изменения, пришедшие по репликации, тоже попадали в очередь
+        db.session.execute(text(f'ALTER TABLE {table} ENABLE ALWAYS TRIGGER {trigger}'))
+    db.session.execute(text('TRUNCATE sales_daily, sales_hourly, sales_changes'))
+    db.session.execute(text('''
+        INSERT INTO sales_changes (day, shop_id)
+        SELECT DISTINCT r.date_oforder, COALESCE(o.shop_id, w.shop_id, 0)
+        FROM receipts r
+        LEFT JOIN order_dates od ON od.order_number = r.orders_id
+        LEFT JOIN orders o ON o.order_number = od.order_number AND o.date_of_order = od.date_of_order
+        LEFT JOIN workers w ON w.id = r.shop_workerid
+        WHERE r.date_oforder IS NOT NULL
+    '''))
+    db.session.commit()
+    return refresh(batch_size)
+
+
+GROUPS = {
+    'shop': ('shop_id', 'shops', 'name'),
+    'worker': ('worker_id', 'workers', 'name'),
+    'good': ('good_id', 'list_of_goods', 'name'),
+    'category': ('category_id', 'nsi_category_of_goods', 'category_of_goods'),
+}
+
+GRANULARITIES = {
+    'day': ('sales_daily', 'day'),
+    'hour': ('sales_hourly', 'hour'),
+}
+
+
+def sales_report(group=None, granularity='day', date_from=None, date_to=None, shop_id=None):
+    """Продажи из агрегатов: по периодам и, опционально, по разрезу group"""
+    table, period = GRANULARITIES[granularity]
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=30)
+
+    columns = [period]
+    if group:
+        columns.append(GROUPS[group][0])
+    conditions = [f'{period} >= :date_from', f'{period} < :date_to']
+    params = {'date_from': date_from, 'date_to': date_to + timedelta(days=1)}
+    if shop_id is not None:
+        conditions.append('shop_id = :shop_id')
+        params['shop_id'] = shop_id
+
+    key = ', '.join(columns)
+    rows = db.session.execute(text(f'''
+        SELECT {key}, SUM(quantity) AS quantity, SUM(revenue) AS revenue,
+               SUM(receipts) AS receipts
+        FROM {table}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {key}
+        ORDER BY {period}, revenue DESC
+    '''), params).mappings().all()
+
+    names = {}
+    if group:
+        _, ref_table, name_attr = GROUPS[group]
+        names = {r.id: getattr(r, name_attr) for r in reference_cache.get(ref_table)}
+
+    report = []
+    for row in rows:
+        item = {
+            'period': row[period].isoformat(),
+            'quantity': int(row['quantity']),
+            'revenue': float(row['revenue']),
+            'receipts': int(row['receipts'])
+        }
+        if group:
+            group_id = row[GROUPS[group][0]]
+            item[group] = {'id': group_id, 'name': names.get(group_id)}
+        report.append(item)
+    return report
+
+
+def parse_report_args(args):
+    """Параметры отчёта из строки запроса"""
+    group = args.get('group') or None
+    granularity = args.get('granularity', 'day')
+    if group not in (None, *GROUPS) or granularity not in GRANULARITIES:
+        raise ValueError('Некорректный разрез или шаг отчёта')
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
+    shop_id = args.get('shop')
+    return {
+        'group': group,
+        'granularity': granularity,
+        'date_from': datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None,
+        'date_to': datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None,
+        'shop_id': int(shop_id) if shop_id and shop_id != 'all' else None,
+    }
+
+
+@click.command('analytics-refresh')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def analytics_refresh_command(batch_size):
+    """Инкрементально пересчитать агрегаты продаж по очереди изменений"""
+    click.echo(f'Пересчитано пар (день, магазин): {refresh(batch_size)}')
+
+
+@click.command('analytics-rebuild')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def analytics_rebuild_command(batch_size):
+    """Включить сбор изменений на этом узле и пересчитать агрегаты с нуля"""
+    click.echo(f'Пересчитано пар (день, магазин): {rebuild(batch_size)}')
@@ -1,38 +1,115 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify,
+                   Response, stream_with_context, abort, make_response, current_app)
 from models import (db, Order, Receipt, Client, Shop, OrderedGoods, 
                     Invoice, ListOfGoods, Worker, ReceiptPosition)
 from config import Config
+from pagination import paginate_orders, DEFAULT_PAGE_SIZE
+from migrate import migrate_command, check_plans_command
+from search import init_search, search_clients, search_goods
+from reference import init_reference, get_shops, get_workers
+from ids import init_ids, generate_order_number, generate_receipt_number, stress_ids_command
+from orders import (filter_orders, parse_items, build_line_items, write_line_items, replace_line_items,
+                    check_version, cancel_order, delete_orders, OrderConflict, CONFLICT_MESSAGE,
+                    ORDER_STATUSES, EDITABLE_STATUSES, STAFF_CANCELLABLE_STATUSES, CANCELLED,
+                    get_order_or_404,
+                    stress_edits_command)
+from bulk import ingest, request_rows, import_orders_command
+from metrics import init_metrics
+from export import export_orders, export_orders_command, FORMATS as EXPORT_FORMATS
+from feed import init_feed, order_feed, sse_busy, sse_stream
+from analytics import (sales_report, parse_report_args, GROUPS,
+                       analytics_refresh_command, analytics_rebuild_command)
+from replication import init_replication, replication_monitor, replication_check_command
+from federation import init_federation, federated_search, KINDS as SEARCH_KINDS
+from partitions import partitions_maintain_command, partitions_archive_command
+from bench import bench_seed_command, bench_run_command
+from planner import replenish_plan_command, replenish_bench_command
+from purge import purge_orders_command
+from stock import availability, check_stock, OutOfStock, shortage_message, stock_reconcile_command
+from order_cache import (init_order_cache, order_stamp, not_modified, conditional, cached_fragment,
+                         CUSTOMER_REFERENCES, STAFF_REFERENCES)
+from idempotency import init_idempotency, idempotent, request_key, idempotency_expire_command
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime, date
 from decimal import Decimal
-import random
-import string
+import os
 
-app = Flask(__name__)
-app.config.from_object(Config)
+# Маршруты и обработчики ошибок собираются при импорте модуля и регистрируются
+# в create_app, поэтому у каждого созданного приложения (тесты, bench-run с другой
+# конфигурацией) они свои, а имена эндпоинтов для url_for() остаются прежними
+_routes = []
+_error_handlers = []
 
-db.init_app(app)
 
-def generate_order_number():
-    """Генерация уникального номера заказа"""
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    random_suffix = ''.join(random.choices(string.digits, k=4))
-    return f'ORD-{timestamp}-{random_suffix}'
+def route(rule, **options):
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
 
-def generate_receipt_number():
-    """Генерация уникального номера чека"""
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f'RCP-{timestamp}-{random_suffix}'
 
+def errorhandler(code):
+    def decorator(handler):
+        _error_handlers.append((code, handler))
+        return handler
+    return decorator
 
-@app.route('/')
+
+def register_routes(app):
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for code, handler in _error_handlers:
+        app.register_error_handler(code, handler)
+
+
+def create_app(config_object=Config):
+    """Фабрика приложения: конфигурация, расширения, маршруты и CLI-команды"""
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    
+    db.init_app(app)
+    init_search(app)
+    init_reference(app)
+    init_ids(app)
+    init_metrics(app)
+    init_feed(app)
+    init_replication(app)
+    init_federation(app)
+    init_order_cache(app)
+    init_idempotency(app)
+    register_routes(app)
+    
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(check_plans_command)
+    app.cli.add_command(import_orders_command)
+    app.cli.add_command(stress_ids_command)
+    app.cli.add_command(analytics_refresh_command)
+    app.cli.add_command(analytics_rebuild_command)
+    app.cli.add_command(export_orders_command)
+    app.cli.add_command(stress_edits_command)
+    app.cli.add_command(replication_check_command)
+    app.cli.add_command(partitions_maintain_command)
+    app.cli.add_command(partitions_archive_command)
+    app.cli.add_command(bench_seed_command)
+    app.cli.add_command(bench_run_command)
+    app.cli.add_command(stock_reconcile_command)
+    app.cli.add_command(replenish_plan_command)
+    app.cli.add_command(replenish_bench_command)
+    app.cli.add_command(purge_orders_command)
+    app.cli.add_command(idempotency_expire_command)
+    
+    return app
+
+
+@route('/')
 def index():
     return render_template('base.html')
 
 
 # ============ ИНТЕРФЕЙС КЛИЕНТА ============
 
-@app.route('/customer')
+@route('/customer')
 def customer_orders():
     """Список заказов для клиентов"""
     # Можно добавить фильтрацию по email или phone для конкретного клиента
@@ -51,26 +128,50 @@ def customer_orders():
     return render_template('customer_orders.html', orders=orders, search_email=email)
 
 
-@app.route('/customer/order/<order_number>')
+@route('/customer/order/<order_number>')
 def customer_view_order(order_number):
     """Просмотр заказа клиентом"""
-    order = Order.query.get_or_404(order_number)
-    ordered_items = order.ordered_goods.all()
-    return render_template('edit_order.html', 
-                         order=order, 
-                         ordered_items=ordered_items,
-                         user_type='customer',
-                         editable=False)
+    # Неизменившийся заказ — 304 после одного запроса версий
+    stamp = order_stamp(order_number, CUSTOMER_REFERENCES)
+    if stamp is None:
+        abort(404)
+    response = not_modified(stamp)
+    if response is not None:
+        return response
+    
+    order = get_order_or_404(order_number)
+    order_html = cached_fragment(order, stamp, lambda: render_template(
+        'order_details.html',
+        order=order,
+        ordered_items=order.ordered_goods.all(),
+        user_type='customer',
+        editable=False))
+    return conditional(make_response(render_template('edit_order.html',
+                                                     order=order,
+                                                     order_html=order_html,
+                                                     user_type='customer',
+                                                     editable=False)), stamp)
+
+
+def render_edit_conflict(order, user_type, **context):
+    """Форма с актуальными данными заказа и статусом 409 после конфликта версий"""
+    return render_template('edit_order.html',
+                         order=order,
+                         ordered_items=order.ordered_goods.all(),
+                         shops=get_shops(),
+                         user_type=user_type,
+                         editable=True,
+                         **context), 409
 
 
-@app.route('/customer/order/<order_number>/edit', methods=['GET', 'POST'])
+@route('/customer/order/<order_number>/edit', methods=['GET', 'POST'])
+@idempotent
 def customer_edit_order(order_number):
     """Редактирование заказа клиентом (ограниченные права)"""
-    order = Order.query.get_or_404(order_number)
+    order = get_order_or_404(order_number)
     
     # Клиент может редактировать только заказы в определенных статусах
-    editable_statuses = ['Pending', 'Новый', 'Ожидает подтверждения']
-    if order.status not in editable_statuses:
+    if order.status not in EDITABLE_STATUSES:
         flash('Вы можете редактировать только заказы в статусе "Ожидает подтверждения"', 'warning')
         return redirect(url_for('customer_orders'))
     
@@ -78,13 +179,19 @@ def customer_edit_order(order_number):
         # Клиент может изменить только адрес доставки через магазин
         new_shop_id = request.form.get('shop_id')
         if new_shop_id:
-            order.shop_id = int(new_shop_id)
-            order.date_of_order = date.today()
-            db.session.commit()
-            flash('Заказ успешно обновлен!', 'success')
+            try:
+                check_version(order, request.form.get('version'))
+                order.shop_id = int(new_shop_id)
+                order.date_of_order = date.today()
+                db.session.commit()
+                flash('Заказ успешно обновлен!', 'success')
+            except (OrderConflict, StaleDataError):
+                db.session.rollback()
+                flash(CONFLICT_MESSAGE, 'danger')
+                return render_edit_conflict(order, user_type='customer')
         return redirect(url_for('customer_orders'))
     
-    shops = Shop.query.all()
+    shops = get_shops()
     ordered_items = order.ordered_goods.all()
     return render_template('edit_order.html', 
                          order=order,
@@ -94,19 +201,18 @@ def customer_edit_order(order_number):
                          editable=True)
 
 
-@app.route('/customer/order/<order_number>/cancel', methods=['POST'])
+@route('/customer/order/<order_number>/cancel', methods=['POST'])
+@idempotent
 def customer_cancel_order(order_number):
     """Отмена заказа клиентом"""
-    order = Order.query.get_or_404(order_number)
+    get_order_or_404(order_number)
     
-    cancellable_statuses = ['Pending', 'Новый', 'Ожидает подтверждения']
-    if order.status in cancellable_statuses:
-        order.status = 'Отменен'
-        if order.receipt:
-            order.receipt.payment_method = 'Возврат'
+    # Статус проверяется и меняется одним UPDATE: из двух одновременных отмен проходит одна
+    if cancel_order(order_number, EDITABLE_STATUSES):
         db.session.commit()
         flash('Заказ отменен', 'info')
     else:
+        db.session.rollback()
         flash('Невозможно отменить заказ в текущем статусе', 'warning')
     
     return redirect(url_for('customer_orders'))
@@ -114,7 +220,7 @@ def customer_cancel_order(order_number):
 
 # ============ ИНТЕРФЕЙС СОТРУДНИКА ============
 
-@app.route('/staff')
+@route('/staff')
 def staff_orders():
     """Список заказов для сотрудников"""
     status_filter = request.args.get('status', 'all')
@@ -122,32 +228,18 @@ def staff_orders():
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
     
-    query = Order.query
-    
-    # Фильтр по статусу
-    if status_filter != 'all':
-        query = query.filter_by(status=status_filter)
-    
-    # Фильтр по магазину
-    if shop_filter != 'all':
-        query = query.filter_by(shop_id=int(shop_filter))
+    page = paginate_orders(filter_orders(request.args),
+                           cursor=request.args.get('cursor'),
+                           limit=request.args.get('limit', DEFAULT_PAGE_SIZE))
     
-    # Фильтр по дате
-    if date_from:
-        query = query.filter(Order.date_of_order >= datetime.strptime(date_from, '%Y-%m-%d').date())
-    if date_to:
-        query = query.filter(Order.date_of_order <= datetime.strptime(date_to, '%Y-%m-%d').date())
-    
-    orders = query.order_by(Order.date_of_order.desc()).all()
-    
-    # Получаем уникальные статусы и магазины для фильтров
-    all_statuses = db.session.query(Order.status).distinct().all()
-    statuses = [s[0] for s in all_statuses if s[0]]
-    shops = Shop.query.all()
+    # Статусы для фильтра — фиксированный список, без DISTINCT по всей таблице заказов
+    shops = get_shops()
     
     return render_template('staff_orders.html', 
-                         orders=orders,
-                         statuses=statuses,
+                         orders=page['orders'],
+                         next_cursor=page['next_cursor'],
+                         total_estimate=page['total_estimate'],
+                         statuses=ORDER_STATUSES,
                          shops=shops,
                          status_filter=status_filter,
                          shop_filter=shop_filter,
@@ -155,7 +247,44 @@ def staff_orders():
                          date_to=date_to)
 
 
-@app.route('/staff/order/create', methods=['GET', 'POST'])
+@route('/staff/orders/export')
+def staff_export_orders():
+    """Потоковая выгрузка заказов (CSV или JSON Lines) с фильтрами списка"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash('Неподдерживаемый формат выгрузки', 'warning')
+        return redirect(url_for('staff_orders'))
+    
+    _, mimetype, extension = EXPORT_FORMATS[fmt]
+    compress = request.accept_encodings['gzip'] > 0
+    
+    archived = request.args.get('archived') == '1'
+    response = Response(stream_with_context(export_orders(request.args, fmt, compress, archived)),
+                        mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=orders.{extension}'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@route('/staff/orders/events')
+def staff_order_events():
+    """Лента изменений заказов (Server-Sent Events) вместо перезагрузки списка"""
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    events = order_feed.subscribe()
+    if events is None:
+        return Response(sse_busy(current_app.config['ORDER_FEED_BUSY_RETRY_MS']),
+                        mimetype='text/event-stream', headers=headers)
+    
+    shop_filter = request.args.get('shop', 'all')
+    shop_id = int(shop_filter) if shop_filter != 'all' else None
+    
+    return Response(sse_stream(events, shop_id),
+                    mimetype='text/event-stream', headers=headers)
+
+
+@route('/staff/order/create', methods=['GET', 'POST'])
+@idempotent
 def staff_create_order():
     """Создание нового заказа сотрудником"""
     if request.method == 'POST':
@@ -174,26 +303,39 @@ def staff_create_order():
                 db.session.add(client)
                 db.session.flush()
             
+            # Состав заказа: цены и итог считаются на сервере
+            shop_id = int(request.form['shop_id']) if request.form.get('shop_id') else None
+            items = parse_items(request.form)
+            lines, total_price = build_line_items(shop_id, items)
+            if not lines:
+                total_price = Decimal(request.form['total_price'])
+            
+            # Остатки магазина: при STOCK_ENFORCE строки блокируются до коммита
+            shortages = check_stock(shop_id, items, lock=current_app.config['STOCK_ENFORCE'])
+            if shortages:
+                if current_app.config['STOCK_ENFORCE']:
+                    raise OutOfStock(shortages)
+                flash(shortage_message(shortages), 'warning')
+            
             # Создаем заказ
             order_number = generate_order_number()
             order = Order(
                 order_number=order_number,
                 client_id=client.id,
-                shop_id=int(request.form['shop_id']) if request.form.get('shop_id') else None,
+                shop_id=shop_id,
                 date_of_order=date.today(),
-                total_price=Decimal(request.form['total_price']),
+                total_price=total_price,
                 status=request.form.get('status', 'Новый')
             )
             
             db.session.add(order)
-            db.session.flush()
             
             # Создаем чек
             receipt_number = generate_receipt_number()
             receipt = Receipt(
                 receipt_number=receipt_number,
                 date_oforder=date.today(),
-                total_price=Decimal(request.form['total_price']),
+                total_price=total_price,
                 payment_method=request.form.get('payment_method', 'Не оплачен'),
                 client_id=client.id,
                 orders_id=order_number,
@@ -201,6 +343,10 @@ def staff_create_order():
             )
             
             db.session.add(receipt)
+            db.session.flush()
+            
+            # Позиции заказа и чека
+            write_line_items(order, receipt, lines)
             db.session.commit()
             
             flash(f'Заказ {order_number} успешно создан!', 'success')
@@ -212,33 +358,52 @@ def staff_create_order():
             return redirect(url_for('staff_create_order'))
     
     # GET запрос - показываем форму
-    shops = Shop.query.all()
-    workers = Worker.query.all()
-    clients = Client.query.all()
+    shops = get_shops()
+    workers = get_workers()
     
     return render_template('create_order.html',
                          shops=shops,
                          workers=workers,
-                         clients=clients,
                          user_type='staff')
 
 
-@app.route('/staff/order/<order_number>/edit', methods=['GET', 'POST'])
+@route('/staff/order/<order_number>/edit', methods=['GET', 'POST'])
+@idempotent
 def staff_edit_order(order_number):
     """Редактирование заказа сотрудником (полные права)"""
-    order = Order.query.get_or_404(order_number)
+    stamp = None
+    if request.method == 'GET':
+        stamp = order_stamp(order_number, STAFF_REFERENCES)
+        if stamp is None:
+            abort(404)
+        response = not_modified(stamp)
+        if response is not None:
+            return response
+    
+    order = get_order_or_404(order_number)
     
     if request.method == 'POST':
         try:
+            check_version(order, request.form.get('version'))
+            
             # Обновление основной информации заказа
             order.shop_id = int(request.form['shop_id']) if request.form.get('shop_id') else None
             order.status = request.form['status']
-            order.total_price = Decimal(request.form['total_price'])
+            # Версия растёт при любом сохранении, даже если изменились только позиции
+            flag_modified(order, 'status')
+            
+            # Если форма содержит состав заказа, итог пересчитывается по позициям
+            if 'good_id' in request.form:
+                lines, total_price = build_line_items(order.shop_id, parse_items(request.form))
+                replace_line_items(order, order.receipt, lines)
+            else:
+                total_price = Decimal(request.form['total_price'])
+            order.total_price = total_price
             
             # Обновление чека
             if order.receipt:
                 order.receipt.payment_method = request.form['payment_method']
-                order.receipt.total_price = Decimal(request.form['total_price'])
+                order.receipt.total_price = total_price
                 if request.form.get('worker_id'):
                     order.receipt.shop_workerid = int(request.form['worker_id'])
             
@@ -246,40 +411,48 @@ def staff_edit_order(order_number):
             flash('Заказ успешно обновлен!', 'success')
             return redirect(url_for('staff_orders'))
             
+        except (OrderConflict, StaleDataError):
+            db.session.rollback()
+            flash(CONFLICT_MESSAGE, 'danger')
+            return render_edit_conflict(order, user_type='staff', workers=get_workers())
         except Exception as e:
             db.session.rollback()
             flash(f'Ошибка при обновлении заказа: {str(e)}', 'danger')
     
-    shops = Shop.query.all()
-    workers = Worker.query.all()
+    shops = get_shops()
+    workers = get_workers()
     ordered_items = order.ordered_goods.all()
     
-    return render_template('edit_order.html',
-                         order=order,
-                         ordered_items=ordered_items,
-                         shops=shops,
-                         workers=workers,
-                         user_type='staff',
-                         editable=True)
-
-
-@app.route('/staff/order/<order_number>/delete', methods=['POST'])
+    response = make_response(render_template('edit_order.html',
+                                              order=order,
+                                              ordered_items=ordered_items,
+                                              shops=shops,
+                                              workers=workers,
+                                              user_type='staff',
+                                              editable=True))
+    return conditional(response, stamp) if stamp else response
+
+
+@route('/staff/order/<order_number>/delete', methods=['POST'])
+@idempotent
 def staff_delete_order(order_number):
-    """Удаление заказа сотрудником"""
+    """Удаление заказа сотрудником: сначала отмена, для отменённого — удаление.
+
+    Выданный заказ не удаляется: отмена вернула бы оплату и остаток.
+    """
+    order = get_order_or_404(order_number)
     try:
-        order = Order.query.get_or_404(order_number)
-        
-        # Удаляем связанный чек
-        if order.receipt:
-            db.session.delete(order.receipt)
-        
-        # Удаляем позиции заказа
-        for item in order.ordered_goods:
-            db.session.delete(item)
-        
-        db.session.delete(order)
-        db.session.commit()
-        flash('Заказ удален', 'info')
+        if order.status != CANCELLED:
+            # Мягкое удаление: отменённый заказ удалит purge-orders после срока хранения
+            if cancel_order(order_number, STAFF_CANCELLABLE_STATUSES):
+                flash('Заказ отменен и будет удален после срока хранения', 'info')
+            else:
+                flash(f'Заказ в статусе «{order.status}» нельзя удалить', 'warning')
+            db.session.commit()
+        else:
+            delete_orders([order_number])
+            db.session.commit()
+            flash('Заказ удален', 'info')
     except Exception as e:
         db.session.rollback()
         flash(f'Ошибка при удалении заказа: {str(e)}', 'danger')
@@ -287,59 +460,158 @@ def staff_delete_order(order_number):
     return redirect(url_for('staff_orders'))
 
 
+@route('/staff/reports')
+def staff_reports():
+    """Отчёт о продажах по агрегатам"""
+    try:
+        params = parse_report_args(request.args)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        params = parse_report_args({})
+    
+    report = sales_report(**params)
+    
+    return render_template('reports.html',
+                         report=report,
+                         groups=list(GROUPS),
+                         shops=get_shops(),
+                         group=params['group'],
+                         granularity=params['granularity'],
+                         shop_filter=request.args.get('shop', 'all'),
+                         date_from=request.args.get('date_from', ''),
+                         date_to=request.args.get('date_to', ''))
+
+
 # ============ API для получения данных ============
 
-@app.route('/api/clients/search')
+@route('/api/clients/search')
 def api_search_clients():
     """API для поиска клиентов"""
     query = request.args.get('q', '')
-    if query:
-        clients = Client.query.filter(
-            (Client.name.ilike(f'%{query}%')) | 
-            (Client.email.ilike(f'%{query}%')) |
-            (Client.phone_number.ilike(f'%{query}%'))
-        ).limit(10).all()
-        
-        return jsonify([{
-            'id': c.id,
-            'name': c.name,
-            'email': c.email,
-            'phone': c.phone_number
-        } for c in clients])
-    return jsonify([])
-
-
-@app.route('/api/goods/search')
+    return jsonify(search_clients(query))
+
+
+@route('/api/goods/search')
 def api_search_goods():
     """API для поиска товаров"""
     query = request.args.get('q', '')
-    if query:
-        goods = ListOfGoods.query.filter(
-            ListOfGoods.name.ilike(f'%{query}%')
-        ).limit(10).all()
-        
-        return jsonify([{
-            'id': g.id,
-            'name': g.name,
-            'price': float(g.price) if g.price else 0
-        } for g in goods])
-    return jsonify([])
+    return jsonify(search_goods(query))
+
+
+@route('/api/stock')
+def api_stock():
+    """API остатков: /api/stock?shop_id=1&good_id=1&good_id=2"""
+    try:
+        shop_id = int(request.args['shop_id'])
+        good_ids = [int(g) for g in request.args.getlist('good_id')]
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Нужны shop_id и good_id'}), 400
+    available = availability(shop_id, good_ids)
+    return jsonify({
+        'shop_id': shop_id,
+        'goods': [{'good_id': g, 'available': q} for g, q in available.items()],
+    })
+
+
+@route('/api/orders')
+def api_orders():
+    """API постраничного списка заказов (keyset-курсор)"""
+    page = paginate_orders(filter_orders(request.args),
+                           cursor=request.args.get('cursor'),
+                           limit=request.args.get('limit', DEFAULT_PAGE_SIZE))
+    
+    return jsonify({
+        'orders': [{
+            'order_number': o.order_number,
+            'date_of_order': o.date_of_order.isoformat() if o.date_of_order else None,
+            'status': o.status,
+            'total_price': float(o.total_price) if o.total_price else 0,
+            'client': o.client.name if o.client else None,
+            'shop': o.shop.name if o.shop else None,
+            'receipt_number': o.receipt.receipt_number if o.receipt else None
+        } for o in page['orders']],
+        'next_cursor': page['next_cursor'],
+        'total_estimate': page['total_estimate']
+    })
+
+
+@route('/api/orders/bulk', methods=['POST'])
+def api_bulk_orders():
+    """API пакетной загрузки заказов (JSON, JSON Lines, CSV).
+    
+    Idempotency-Key задаёт ключи строк без собственного idempotency_key:
+    повтор того же тела с тем же заголовком не создаёт дублей.
+    """
+    try:
+        key = request_key()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        rows = request_rows(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    
+    report = ingest(rows, key_prefix=key)
+    return jsonify(report)
+
+
+@route('/api/reports/sales')
+def api_sales_report():
+    """API отчёта о продажах (group=shop|worker|good|category, granularity=day|hour)"""
+    try:
+        params = parse_report_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(sales_report(**params))
+
+
+# ============ АДМИНИСТРИРОВАНИЕ ============
+
+@route('/admin/replication')
+def admin_replication():
+    """Отставание и ошибки логической репликации на всех узлах"""
+    return jsonify(replication_monitor.poll())
+
+
+@route('/admin/orders/search')
+def admin_search_orders():
+    """Поиск заказов клиента по всем магазинам (email, телефон или номер заказа)"""
+    if not federated_search.nodes:
+        return jsonify({'error': 'Федеративный поиск не настроен на этом узле'}), 404
+    
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('by') or None
+    if not query or kind not in (None, *SEARCH_KINDS):
+        return jsonify({'error': 'Укажите q и, при необходимости, by=email|phone|order'}), 400
+    
+    limit = request.args.get('limit', '50')
+    if not limit.isdigit() or int(limit) <= 0:
+        return jsonify({'error': 'limit должен быть положительным целым числом'}), 400
+    return jsonify(federated_search.search(query, kind, min(int(limit), 200)))
 
 
 # ============ Обработка ошибок ============
 
-@app.errorhandler(404)
+@errorhandler(404)
 def not_found(error):
     flash('Страница не найдена', 'warning')
     return redirect(url_for('index'))
 
 
-@app.errorhandler(500)
+@errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     flash('Внутренняя ошибка сервера', 'danger')
     return redirect(url_for('index'))
 
 
+# Точка входа WSGI — app:app
+app = create_app()
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Сервер разработки; в production используется gunicorn (gunicorn.conf.py).
+    # Порт 5000 занят Postgres узла administration в docker-compose.
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0',
+            port=int(os.getenv('APP_PORT', 8000)))
@@ -0,0 +1,451 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from migrate import apply_migrations
+from models import db
+from stock import reconcile
+
+# Таблицы, триггеры которых выключаются на время загрузки: иначе каждая строка
+# порождает уведомление ленты, запись в очереди пересчёта продаж и обновление остатков
+SEED_TABLES = ('orders', 'receipts', 'ordered_goods', 'receipt_positions')
+
+FIRST_NAMES = ['Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Андрей',
+               'Ольга', 'Иван', 'Наталья', 'Михаил', 'Татьяна', 'Павел', 'Юлия']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев']
+GOODS_KINDS = ['Вино красное', 'Вино белое', 'Вино розовое', 'Игристое', 'Коньяк',
+               'Виски', 'Сок', 'Вода минеральная', 'Сыр', 'Шоколад']
+GOODS_ORIGINS = ['Кубань', 'Крым', 'Тоскана', 'Риоха', 'Бордо', 'Мозель', 'Шампань',
+                 'Кахетия', 'Мендоса', 'Долина Напа']
+STATUSES = ['Новый', 'Ожидает подтверждения', 'Подтвержден', 'Доставлен', 'Отменен']
+PAYMENT_METHODS = ['Наличные', 'Карта', 'СБП']
+
+
+def _array(values):
+    return 'ARRAY[' + ', '.join("'" + v.replace("'", "''") + "'" for v in values) + ']'
+
+
+def _pick(values_sql, count):
+    """Случайный элемент массива (random() вычисляется для каждой строки)"""
+    return f'({values_sql})[1 + floor(random() * {count})::INT]'
+
+
+SEED_GOODS = text(f'''
+    INSERT INTO list_of_goods (name, category_id, unit_id, volume_or_weight, price)
+    SELECT {_pick(_array(GOODS_KINDS), len(GOODS_KINDS))} || ' ' ||
+           {_pick(_array(GOODS_ORIGINS), len(GOODS_ORIGINS))} || ' №' || g,
+           (CAST(:categories AS INT[]))[1 + floor(random() * cardinality(CAST(:categories AS INT[])))::INT],
+           (CAST(:units AS INT[]))[1 + floor(random() * cardinality(CAST(:units AS INT[])))::INT],
+           (ARRAY[330, 500, 750, 1000, 1500])[1 + floor(random() * 5)::INT],
+           round((100 + random() * 9900)::NUMERIC, 2)
+    FROM generate_series(1, :count) g
+''')
+
+# Накладная на каждый товар в каждый магазин: номер BENCH-INV-<магазин>-<товар>;
+# количество с запасом, чтобы создание заказов в прогоне не упиралось в остатки
+SEED_INVOICES = text('''
+    INSERT INTO invoices (invoicenumber, total_price, dispatch_date, receipt_date,
+                          supply_id, goodid, shop_id, status, quantity)
+    SELECT 'BENCH-INV-' || s.id || '-' || g.id, g.price * 1000000, current_date - 30, current_date - 28,
+           :supply_id, g.id, s.id, 'delivered', 1000000
+    FROM list_of_goods g CROSS JOIN shops s
+    ON CONFLICT DO NOTHING
+''')
+
+SEED_CLIENTS = text(f'''
+    INSERT INTO clients (name, phone_number, email, date_of_birth)
+    SELECT {_pick(_array(LAST_NAMES), len(LAST_NAMES))} || ' ' ||
+           {_pick(_array(FIRST_NAMES), len(FIRST_NAMES))} || ' ' || g,
+           '+7800' || lpad(g::TEXT, 7, '0'),
+           'client' || g || '@bench.example',
+           DATE '1950-01-01' + floor(random() * 20000)::INT
+    FROM generate_series(1, :count) g
+    ON CONFLICT DO NOTHING
+''')
+
+# Пачка заказов с чеками и позициями одним запросом; позиции ссылаются на накладную
+# магазина заказа, итог заказа и чека — сумма позиций
+SEED_ORDERS = text(f'''
+    WITH src AS (
+        SELECT 'BENCH-O-' || lpad(g::TEXT, 9, '0') AS order_number,
+               'BENCH-R-' || lpad(g::TEXT, 9, '0') AS receipt_number,
+               (CAST(:clients AS INT[]))[1 + floor(random() * :client_count)::INT] AS client_id,
+               (CAST(:shops AS INT[]))[1 + floor(random() * :shop_count)::INT] AS shop_id,
+               (CAST(:workers AS INT[]))[1 + floor(random() * :worker_count)::INT] AS worker_id,
+               current_date - floor(random() * :days)::INT AS day,
+               {_pick(_array(STATUSES), len(STATUSES))} AS status,
+               {_pick(_array(PAYMENT_METHODS), len(PAYMENT_METHODS))} AS payment_method,
+               1 + floor(random() * :max_items)::INT AS item_count
+        FROM generate_series(:start, :stop) g
+    ), items AS (
+        SELECT s.order_number, s.receipt_number, s.day,
+               'BENCH-INV-' || s.shop_id || '-' || p.good_id AS invoice_id,
+               COALESCE(lg.price, 100) AS price, p.quantity
+        FROM src s
+        CROSS JOIN LATERAL generate_series(1, s.item_count) n
+        CROSS JOIN LATERAL (
+            SELECT n, (CAST(:goods AS INT[]))[1 + floor(random() * :good_count)::INT] AS good_id,
+                   1 + floor(random() * 5)::INT AS quantity
+        ) p
+        JOIN list_of_goods lg ON lg.id = p.good_id
+    ), totals AS (
+        SELECT order_number, sum(price * quantity) AS total FROM items GROUP BY order_number
+    ), new_orders AS (
+        INSERT INTO orders (order_number, client_id, shop_id, date_of_order, total_price, status)
+        SELECT s.order_number, s.client_id, s.shop_id, s.day, t.total, s.status
+        FROM src s JOIN totals t USING (order_number)
+    ), new_receipts AS (
+        INSERT INTO receipts (receipt_number, date_oforder, total_price, payment_method,
+                              shop_workerid, client_id, orders_id, created_at)
+        SELECT s.receipt_number, s.day, t.total, s.payment_method, s.worker_id, s.client_id,
+               s.order_number, s.day + make_interval(secs => 32400 + floor(random() * 43200))
+        FROM src s JOIN totals t USING (order_number)
+    ), new_goods AS (
+        INSERT INTO ordered_goods (quantity, price_per_unit, subtotal, order_id, order_date, invoice_id)
+        SELECT quantity, price, price * quantity, order_number, day, invoice_id FROM items
+    )
+    INSERT INTO receipt_positions (quantity, price_per_unit, subtotal, receipt_id, receipt_date, invoice_id)
+    SELECT quantity, price, price * quantity, receipt_number, day, invoice_id FROM items
+''')
+
+
+def _ids(table):
+    return list(db.session.execute(text(f'SELECT id FROM {table} ORDER BY id')).scalars())
+
+
+def init_schema():
+    """Схема и справочники на пустой базе: init.sql, миграции и admin/insert.sql"""
+    if db.session.execute(text("SELECT to_regclass('orders')")).scalar() is not None:
+        return False
+    db.session.commit()
+    base = os.path.join(current_app.config['MIGRATIONS_DIR'], '..')
+    with db.engine.begin() as conn:
+        with open(os.path.join(base, 'init.sql'), encoding='utf-8') as f:
+            conn.execution_options(no_parameters=True).exec_driver_sql(f.read())
+    apply_migrations()
+    with db.engine.begin() as conn:
+        with open(os.path.join(base, 'admin', 'insert.sql'), encoding='utf-8') as f:
+            conn.execution_options(no_parameters=True).exec_driver_sql(f.read())
+    return True
+
+
+def seed(orders, clients, goods, days, max_items, chunk, random_seed, echo=print):
+    """Загрузка тестового объёма; повторный запуск с теми же параметрами даёт те же данные"""
+    if db.session.execute(text("SELECT 1 FROM order_dates WHERE order_number = 'BENCH-O-000000001'")).first():
+        raise click.ClickException('Тестовые заказы уже загружены')
+
+    conn = db.session.connection()
+    conn.execute(text('SET LOCAL statement_timeout = 0'))
+    conn.execute(text('SELECT setseed(:seed)'), {'seed': random_seed})
+
+    conn.execute(SEED_GOODS, {'count': goods, 'categories': _ids('nsi_category_of_goods'),
+                              'units': _ids('nsi_unit_of_measure')})
+    supply_id = db.session.execute(text('SELECT min(serial_id) FROM supplies_from_warehouse')).scalar()
+    conn.execute(SEED_INVOICES, {'supply_id': supply_id})
+    conn.execute(SEED_CLIENTS, {'count': clients})
+    for table in SEED_TABLES:
+        conn.execute(text('SELECT create_month_partitions(CAST(:table AS regclass), '
+                          'current_date - CAST(:days AS INT), current_date + 1)'), {'table': table, 'days': days})
+    db.session.commit()
+    echo(f'Товаров: {goods}, клиентов: {clients}')
+
+    triggers = db.session.execute(text('''
+        SELECT tgrelid::regclass::TEXT AS tbl, tgname, tgenabled FROM pg_trigger
+        WHERE tgrelid = ANY(CAST(:tables AS regclass[])) AND NOT tgisinternal AND tgparentid = 0
+    '''), {'tables': list(SEED_TABLES)}).all()
+    params = {
+        'clients': _ids('clients'),
+        'shops': _ids('shops'),
+        'workers': _ids('workers'),
+        'goods': _ids('list_of_goods'),
+        'days': days,
+        'max_items': max_items,
+    }
+    params.update(client_count=len(params['clients']), shop_count=len(params['shops']),
+                  worker_count=len(params['workers']), good_count=len(params['goods']))
+    try:
+        for t in triggers:
+            db.session.execute(text(f'ALTER TABLE {t.tbl} DISABLE TRIGGER {t.tgname}'))
+        db.session.commit()
+        for start in range(1, orders + 1, chunk):
+            stop = min(start + chunk - 1, orders)
+            conn = db.session.connection()
+            conn.execute(text('SET LOCAL statement_timeout = 0'))
+            conn.execute(SEED_ORDERS, dict(params, start=start, stop=stop))
+            db.session.commit()
+            echo(f'Заказов: {stop}/{orders}')
+    finally:
+        db.session.rollback()
+        for t in triggers:
+            db.session.execute(text('SELECT set_trigger_state(CAST(:tbl AS regclass), :name, :state)'),
+                               {'tbl': t.tbl, 'name': t.tgname, 'state': t.tgenabled})
+        db.session.commit()
+
+    # Триггеры остатков и order_dates были выключены вместе с остальными
+    conn = db.session.connection()
+    conn.execute(text('SET LOCAL statement_timeout = 0'))
+    conn.execute(text('SELECT order_dates_fill()'))
+    db.session.commit()
+    reconcile(fix=True)
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('SET statement_timeout = 0')
+        conn.exec_driver_sql('ANALYZE')
+
+
+# ============ Нагрузка на маршруты ============
+
+def load_samples(size=1000):
+    """Значения для запросов: клиенты, товары, магазины и сотрудники из базы"""
+    clients = db.session.execute(text(
+        'SELECT email, name, phone_number FROM clients TABLESAMPLE SYSTEM (10) LIMIT :size'
+    ), {'size': size}).all() or db.session.execute(text(
+        'SELECT email, name, phone_number FROM clients LIMIT :size'), {'size': size}).all()
+    goods = db.session.execute(text('''
+        SELECT g.id, g.name, i.shop_id FROM list_of_goods g
+        JOIN invoices i ON i.goodid = g.id AND i.receipt_date IS NOT NULL
+        LIMIT :size
+    '''), {'size': size}).all()
+    return {
+        'clients': [tuple(c) for c in clients],
+        'goods': [tuple(g) for g in goods],
+        'shops': _ids('shops'),
+        'workers': _ids('workers'),
+    }
+
+
+def _staff_orders(rng, s):
+    args = {}
+    if rng.random() < 0.5:
+        args['status'] = rng.choice(STATUSES)
+    if rng.random() < 0.5:
+        args['shop'] = rng.choice(s['shops'])
+    return 'GET', '/staff?' + urllib.parse.urlencode(args), None
+
+
+def _customer_orders(rng, s):
+    return 'GET', '/customer?' + urllib.parse.urlencode({'email': rng.choice(s['clients'])[0]}), None
+
+
+def _create_order(rng, s):
+    good_id, _, shop_id = rng.choice(s['goods'])
+    email, name, phone = rng.choice(s['clients'])
+    return 'POST', '/staff/order/create', {
+        'client_email': email, 'client_name': name, 'client_phone': phone,
+        'shop_id': shop_id, 'worker_id': rng.choice(s['workers']),
+        'good_id': good_id, 'quantity': rng.randint(1, 3),
+        'total_price': 0, 'payment_method': 'Карта',
+    }
+
+
+def _clients_search(rng, s):
+    email, name, phone = rng.choice(s['clients'])
+    query = rng.choice([name.split()[0][:4], phone[:8], email[:6]])
+    return 'GET', '/api/clients/search?' + urllib.parse.urlencode({'q': query}), None
+
+
+def _goods_search(rng, s):
+    name = rng.choice(s['goods'])[1]
+    return 'GET', '/api/goods/search?' + urllib.parse.urlencode({'q': name.split()[-2][:5]}), None
+
+
+def _api_orders(rng, s):
+    return 'GET', '/api/orders?limit=50', None
+
+
+# Сценарий: (вес в смеси запросов, построитель запроса)
+SCENARIOS = {
+    'staff_orders': (25, _staff_orders),
+    'customer_orders': (20, _customer_orders),
+    'create_order': (5, _create_order),
+    'clients_search': (25, _clients_search),
+    'goods_search': (15, _goods_search),
+    'api_orders': (10, _api_orders),
+}
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Driver:
+    """Выполнение запросов к приложению: в процессе (test client) или по HTTP"""
+
+    def __init__(self, app, url=None):
+        self.app = app
+        self.url = url.rstrip('/') if url else None
+        self._local = threading.local()
+
+    def request(self, method, path, form):
+        """(статус, заголовок Server-Timing); ответ читается целиком"""
+        if self.url is None:
+            if not hasattr(self._local, 'client'):
+                self._local.client = self.app.test_client()
+            response = self._local.client.open(path, method=method, data=form)
+            response.get_data()
+            return response.status_code, response.headers.get('Server-Timing', '')
+
+        if not hasattr(self._local, 'opener'):
+            self._local.opener = urllib.request.build_opener(_NoRedirect)
+        data = urllib.parse.urlencode(form).encode() if form else None
+        req = urllib.request.Request(self.url + path, data=data, method=method)
+        try:
+            with self._local.opener.open(req, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get('Server-Timing', '')
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run(driver, samples, scenarios, total, concurrency, random_seed):
+    """Смесь запросов по весам сценариев; возвращает сводку по сценариям"""
+    rng = random.Random(random_seed)
+    names = list(scenarios)
+    weights = [SCENARIOS[n][0] for n in names]
+    plan = [(name, SCENARIOS[name][1](rng, samples))
+            for name in rng.choices(names, weights=weights, k=total)]
+
+    def execute(item):
+        name, (method, path, form) = item
+        started = time.perf_counter()
+        status, timing = driver.request(method, path, form)
+        elapsed = time.perf_counter() - started
+        match = QUERIES_RE.search(timing)
+        return name, elapsed, status, int(match.group(1)) if match else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(execute, plan))
+    wall = time.perf_counter() - started
+
+    by_scenario = defaultdict(list)
+    for name, elapsed, status, queries in results:
+        by_scenario[name].append((elapsed, status, queries))
+    summary = {}
+    for name, rows in sorted(by_scenario.items()):
+        latencies = [r[0] * 1000 for r in rows]
+        queries = [r[2] for r in rows if r[2] is not None]
+        summary[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for r in rows if r[1] >= 400),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'throughput_rps': round(len(rows) / wall, 1),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return {'total_rps': round(total / wall, 1), 'wall_seconds': round(wall, 2),
+            'scenarios': summary}
+
+
+def compare(current, baseline, tolerance):
+    """Регрессии относительно базового прогона.
+
+    Число запросов к БД детерминировано и не должно расти; задержка p95 и доля
+    ошибок сравниваются с допуском tolerance (доля от базового значения).
+    """
+    problems = []
+    for name, base in baseline['scenarios'].items():
+        now = current['scenarios'].get(name)
+        if now is None:
+            continue
+        if (base['queries_per_request'] is not None and now['queries_per_request'] is not None
+                and now['queries_per_request'] > base['queries_per_request'] + 0.5):
+            problems.append(f'{name}: запросов к БД {now["queries_per_request"]} '
+                            f'(было {base["queries_per_request"]})')
+        if now['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            problems.append(f'{name}: p95 {now["p95_ms"]} мс (было {base["p95_ms"]} мс)')
+        base_errors = base['errors'] / base['requests']
+        now_errors = now['errors'] / now['requests']
+        if now_errors > base_errors + 0.01:
+            problems.append(f'{name}: ошибок {now_errors:.1%} (было {base_errors:.1%})')
+    return problems
+
+
+@click.command('bench-seed')
+@click.option('--orders', default=1_000_000, show_default=True)
+@click.option('--clients', default=100_000, show_default=True)
+@click.option('--goods', default=2000, show_default=True)
+@click.option('--days', default=730, show_default=True, help='Глубина истории заказов')
+@click.option('--max-items', default=5, show_default=True, help='Максимум позиций в заказе')
+@click.option('--chunk', default=50_000, show_default=True, help='Заказов на транзакцию')
+@click.option('--seed', 'random_seed', default=0.42, show_default=True, help='setseed() для повторяемости')
+@click.option('--init', 'init', is_flag=True, help='Создать схему и справочники на пустой базе')
+@with_appcontext
+def bench_seed_command(orders, clients, goods, days, max_items, chunk, random_seed, init):
+    """Загрузить тестовый объём данных для бенчмарка"""
+    if init and init_schema():
+        click.echo('Схема создана: init.sql, миграции, admin/insert.sql')
+    started = time.perf_counter()
+    seed(orders, clients, goods, days, max_items, chunk, random_seed, echo=click.echo)
+    click.echo(f'Готово за {time.perf_counter() - started:.0f} с')
+
+
+@click.command('bench-run')
+@click.option('--url', default=None, help='Адрес запущенного приложения; без него — в процессе')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--requests', 'total', default=2000, show_default=True)
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(sorted(SCENARIOS)),
+              help='Только выбранные сценарии (можно несколько раз)')
+@click.option('--seed', 'random_seed', default=42, show_default=True)
+@click.option('--save-baseline', type=click.Path(dir_okay=False), help='Сохранить результат как базовый')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Сравнить с базовым')
+@click.option('--tolerance', default=0.25, show_default=True, help='Допустимый рост p95')
+@with_appcontext
+def bench_run_command(url, concurrency, total, scenarios, random_seed, save_baseline,
+                      baseline, tolerance):
+    """Нагрузить маршруты приложения и сравнить с базовым прогоном"""
+    app = current_app._get_current_object()
+    samples = load_samples()
+    db.session.commit()
+    if not samples['clients'] or not samples['goods']:
+        raise click.ClickException('В базе нет клиентов или товаров: сначала flask bench-seed')
+
+    result = run(Driver(app, url), samples, scenarios or list(SCENARIOS), total, concurrency,
+                 random_seed)
+    result.update(mode='http' if url else 'in-process', concurrency=concurrency,
+                  requests=total, started_at=datetime.now().isoformat(timespec='seconds'))
+
+    click.echo(f'{"сценарий":<16} {"запр.":>6} {"ошиб.":>6} {"p50":>8} {"p95":>8} {"p99":>8} '
+               f'{"rps":>7} {"SQL/запр.":>9}')
+    for name, s in result['scenarios'].items():
+        click.echo(f'{name:<16} {s["requests"]:>6} {s["errors"]:>6} {s["p50_ms"]:>8} '
+                   f'{s["p95_ms"]:>8} {s["p99_ms"]:>8} {s["throughput_rps"]:>7} '
+                   f'{s["queries_per_request"] if s["queries_per_request"] is not None else "-":>9}')
+    click.echo(f'Всего: {result["total_rps"]} запросов/с за {result["wall_seconds"]} с')
+
+    if save_baseline:
+        with open(save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            problems = compare(result, json.load(f), tolerance)
+        for problem in problems:
+            click.echo(f'РЕГРЕССИЯ {problem}', err=True)
+        if problems:
+            raise SystemExit(1)
@@ -0,0 +1,316 @@
+import csv
+import hashlib
+import io
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from ids import generate_order_number, generate_receipt_number
+from idempotency import BULK_SCOPE, MAX_KEY_LENGTH, claim_rows
+from models import db, Order, Receipt, Client, OrderedGoods, ReceiptPosition
+
+
+class BadRow(ValueError):
+    """Строка, которую не удалось прочитать; читатель отдаёт её вместо объекта заказа"""
+
+
+def _optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def row_fingerprint(row):
+    """Отпечаток разобранной строки для ключа идемпотентности (без самого ключа)"""
+    fields = sorted((name, value) for name, value in row.items() if name != 'idempotency_key')
+    # 3.5 и 3.50 — одна и та же цена
+    payload = json.dumps(fields, ensure_ascii=False,
+                         default=lambda v: str(v.normalize() if isinstance(v, Decimal) else v))
+    return hashlib.sha256(payload.encode()).digest()[:16]
+
+
+def parse_row(raw):
+    """Проверка и приведение одной входной строки заказа"""
+    row = {}
+    for field in ('client_email', 'client_name', 'client_phone'):
+        value = (raw.get(field) or '').strip()
+        if not value:
+            raise ValueError(f'не заполнено поле {field}')
+        row[field] = value
+
+    items = raw.get('items') or []
+    if isinstance(items, str):
+        items = json.loads(items)
+    try:
+        row['items'] = [{
+            'invoice_id': str(item['invoice_id']),
+            'quantity': int(item['quantity']),
+            'price_per_unit': Decimal(str(item['price_per_unit']))
+        } for item in items]
+        if row['items']:
+            total = sum(i['price_per_unit'] * i['quantity'] for i in row['items'])
+        else:
+            total = Decimal(str(raw['total_price']))
+    except KeyError as e:
+        raise ValueError(f'не заполнено поле {e.args[0]}')
+    except InvalidOperation:
+        raise ValueError('некорректная сумма')
+    if any(i['quantity'] <= 0 for i in row['items']):
+        raise ValueError('количество должно быть положительным')
+    row['total_price'] = total
+
+    row['shop_id'] = _optional_int(raw.get('shop_id'))
+    row['worker_id'] = _optional_int(raw.get('worker_id'))
+    row['date_of_order'] = (date.fromisoformat(raw['date_of_order'])
+                            if raw.get('date_of_order') else None)
+    row['status'] = raw.get('status') or 'Новый'
+    row['payment_method'] = raw.get('payment_method') or 'Не оплачен'
+    row['idempotency_key'] = str(raw.get('idempotency_key') or '').strip() or None
+    if row['idempotency_key'] and len(row['idempotency_key']) > MAX_KEY_LENGTH:
+        raise ValueError(f'ключ идемпотентности длиннее {MAX_KEY_LENGTH} символов')
+    # Дата по умолчанию в отпечаток не входит: повтор на следующий день — та же строка
+    row['fingerprint'] = row_fingerprint(row)
+    if row['date_of_order'] is None:
+        row['date_of_order'] = date.today()
+    return row
+
+
+def read_csv(stream):
+    """Строки CSV с заголовком; items — JSON-массив в отдельной колонке"""
+    return csv.DictReader(stream)
+
+
+def read_json_lines(stream):
+    """JSON Lines: один объект заказа на строку; нечитаемая строка — BadRow"""
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield BadRow(f'некорректный JSON: {e.msg} (позиция {e.pos})')
+
+
+def read_json(stream):
+    """JSON-массив объектов заказов"""
+    return json.load(stream)
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_json_lines,
+    'json': read_json,
+}
+
+
+def resolve_clients(rows):
+    """id клиентов для строк пачки: поиск по email/телефону и вставка недостающих"""
+    emails = {r['client_email'] for r in rows}
+    phones = {r['client_phone'] for r in rows}
+
+    def lookup():
+        found = db.session.execute(
+            select(Client.id, Client.email, Client.phone_number).where(
+                or_(Client.email.in_(emails), Client.phone_number.in_(phones))
+            )
+        ).all()
+        return ({email: id_ for id_, email, _ in found},
+                {phone: id_ for id_, _, phone in found})
+
+    by_email, by_phone = lookup()
+
+    missing = {}
+    for r in rows:
+        if r['client_email'] not in by_email and r['client_phone'] not in by_phone:
+            missing.setdefault(r['client_email'], {
+                'name': r['client_name'],
+                'email': r['client_email'],
+                'phone_number': r['client_phone']
+            })
+
+    if missing:
+        stmt = pg_insert(Client.__table__).values(list(missing.values()))
+        stmt = stmt.on_conflict_do_nothing().returning(
+            Client.__table__.c.id, Client.__table__.c.email, Client.__table__.c.phone_number)
+        inserted = db.session.execute(stmt).all()
+        # Клиентов, вставленных параллельно другим процессом, перечитываем
+        if len(inserted) < len(missing):
+            by_email, by_phone = lookup()
+        else:
+            for id_, email, phone in inserted:
+                by_email[email] = id_
+                by_phone[phone] = id_
+
+    return {
+        r['client_email']: by_email.get(r['client_email']) or by_phone.get(r['client_phone'])
+        for r in rows
+    }
+
+
+def skip_replayed(rows):
+    """Строки, которые нужно вставить; повторы уже принятых ключей получают прежний номер.
+
+    Ключи фиксируются вместе с пачкой, поэтому повторная отправка пачки (или её
+    части) после обрыва связи не создаёт дублей. Ключ, уже принятый с другими
+    данными строки, — ошибка (ValueError): пачка разбирается построчно, и
+    ошибку получает только эта строка.
+    """
+    claims = {}
+    for r in rows:
+        r['replayed'] = False
+        r['order_number'] = generate_order_number()
+        if r['idempotency_key']:
+            claims.setdefault(r['idempotency_key'], (r['order_number'], r['fingerprint']))
+    accepted = claim_rows(BULK_SCOPE, claims)
+
+    fresh = []
+    for r in rows:
+        key = r['idempotency_key']
+        if key and (key in accepted or claims[key][0] != r['order_number']):
+            # Ключ принят раньше или повторяется в той же пачке
+            number, digest = accepted.get(key, claims[key])
+            if digest is not None and digest != r['fingerprint']:
+                raise ValueError(f'ключ идемпотентности {key} уже использован с другими данными')
+            r['order_number'] = number
+            r['replayed'] = True
+        else:
+            fresh.append(r)
+    return fresh
+
+
+def insert_chunk(rows):
+    """Вставка пачки заказов многострочными INSERT без фиксации транзакции"""
+    rows = skip_replayed(rows)
+    if not rows:
+        return
+    client_ids = resolve_clients(rows)
+
+    orders, receipts, ordered_goods, positions = [], [], [], []
+    for r in rows:
+        client_id = client_ids[r['client_email']]
+        if client_id is None:
+            raise ValueError(f'не удалось определить клиента {r["client_email"]}')
+        order_number = r['order_number']
+        receipt_number = generate_receipt_number()
+        orders.append({
+            'order_number': order_number,
+            'client_id': client_id,
+            'shop_id': r['shop_id'],
+            'date_of_order': r['date_of_order'],
+            'total_price': r['total_price'],
+            'status': r['status']
+        })
+        receipts.append({
+            'receipt_number': receipt_number,
+            'date_oforder': r['date_of_order'],
+            'total_price': r['total_price'],
+            'payment_method': r['payment_method'],
+            'client_id': client_id,
+            'orders_id': order_number,
+            'shop_workerid': r['worker_id']
+        })
+        for item in r['items']:
+            line = {
+                'quantity': item['quantity'],
+                'price_per_unit': item['price_per_unit'],
+                'subtotal': item['price_per_unit'] * item['quantity'],
+                'invoice_id': item['invoice_id']
+            }
+            ordered_goods.append(dict(line, order_id=order_number, order_date=r['date_of_order']))
+            positions.append(dict(line, receipt_id=receipt_number, receipt_date=r['date_of_order']))
+
+    db.session.execute(insert(Order.__table__), orders)
+    db.session.execute(insert(Receipt.__table__), receipts)
+    if ordered_goods:
+        db.session.execute(insert(OrderedGoods.__table__), ordered_goods)
+        db.session.execute(insert(ReceiptPosition.__table__), positions)
+
+
+def _accepted(report, row):
+    report['replayed' if row['replayed'] else 'created'].append(row['order_number'])
+
+
+def ingest(raw_rows, chunk_size=None, key_prefix=None):
+    """Загрузка заказов пачками: одна транзакция на пачку, ошибки — по строкам.
+
+    Строка без собственного idempotency_key при заданном key_prefix получает
+    ключ «префикс:номер строки», так что повтор всей загрузки безопасен.
+    """
+    chunk_size = chunk_size or current_app.config['BULK_CHUNK_SIZE']
+    report = {'created': [], 'replayed': [], 'errors': []}
+    numbered = enumerate(raw_rows, start=1)
+
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+
+        valid = []
+        for line_no, raw in chunk:
+            try:
+                if isinstance(raw, BadRow):
+                    raise raw
+                row = parse_row(raw)
+                if key_prefix and not row['idempotency_key']:
+                    row['idempotency_key'] = f'{key_prefix}:{line_no}'
+                valid.append((line_no, row))
+            except (ValueError, TypeError, AttributeError) as e:
+                report['errors'].append({'row': line_no, 'error': str(e)})
+        if not valid:
+            continue
+
+        try:
+            insert_chunk([row for _, row in valid])
+            db.session.commit()
+            for _, row in valid:
+                _accepted(report, row)
+        except (SQLAlchemyError, ValueError):
+            db.session.rollback()
+            # Пачка не прошла целиком: изолируем ошибочные строки через savepoint
+            for line_no, row in valid:
+                try:
+                    with db.session.begin_nested():
+                        insert_chunk([row])
+                    _accepted(report, row)
+                except (SQLAlchemyError, ValueError) as e:
+                    report['errors'].append({'row': line_no, 'error': str(e).splitlines()[0]})
+            db.session.commit()
+
+    return report
+
+
+@click.command('import-orders')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(READERS)), default='csv',
+              show_default=True)
+@click.option('--chunk-size', type=int, default=None,
+              help='Размер пачки (по умолчанию BULK_CHUNK_SIZE)')
+@click.option('--key-prefix', default=None,
+              help='Префикс ключей идемпотентности строк: повторный запуск не создаёт дублей')
+@with_appcontext
+def import_orders_command(source, fmt, chunk_size, key_prefix):
+    """Потоковая загрузка заказов из CSV/JSON Lines/JSON (- для stdin)"""
+    report = ingest(READERS[fmt](source), chunk_size, key_prefix)
+    click.echo(f'Создано заказов: {len(report["created"])}')
+    if report['replayed']:
+        click.echo(f'Уже загружено ранее: {len(report["replayed"])}')
+    for error in report['errors']:
+        click.echo(f'Строка {error["row"]}: {error["error"]}', err=True)
+
+
+def request_rows(req):
+    """Итератор строк из тела HTTP-запроса в зависимости от Content-Type"""
+    mimetype = req.mimetype
+    if mimetype == 'application/json':
+        return req.get_json()
+    stream = io.TextIOWrapper(req.stream, encoding='utf-8')
+    if mimetype == 'text/csv':
+        return read_csv(stream)
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return read_json_lines(stream)
+    raise ValueError(f'неподдерживаемый формат {mimetype}')
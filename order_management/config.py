@@ -43,12 +43,165 @@ class Config:
         }
     }
     
+    # Адреса узлов можно переопределить, например SHOP1_DB_HOST=shop1 SHOP1_DB_PORT=5432
+    # при запуске приложения в сети docker-compose
+    for _node, _cfg in DATABASE_CONFIGS.items():
+        _cfg['host'] = os.getenv(f'{_node.upper()}_DB_HOST', _cfg['host'])
+        _cfg['port'] = int(os.getenv(f'{_node.upper()}_DB_PORT', _cfg['port']))
+    del _node, _cfg
+    
     # Формирование строки подключения
     db_config = DATABASE_CONFIGS[NODE]
     SQLALCHEMY_DATABASE_URI = (
-        f"postgresql://{db_config['user']}:{db_config['password']}"
+        f"postgresql+psycopg://{db_config['user']}:{db_config['password']}"
         f"@{db_config['host']}:{db_config['port']}/{db_config['database']}"
     )
+    # Явная строка подключения вместо узла из DATABASE_CONFIGS (например,
+    # одиночный локальный Postgres для бенчмарка без docker-compose)
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', SQLALCHEMY_DATABASE_URI)
+    
+    # Пул соединений (на процесс) и таймауты; pool_pre_ping отбрасывает
+    # соединения, разорванные перезапуском Postgres, до выдачи их запросу
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+    # Потоков в воркере gunicorn (gunicorn.conf.py: по умолчанию равно пулу)
+    APP_THREADS = int(os.getenv('APP_THREADS', DB_POOL_SIZE))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+        'pool_use_lifo': True,
+        'connect_args': {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            'options': f"-c statement_timeout={os.getenv('DB_STATEMENT_TIMEOUT_MS', 5000)}"
+        }
+    }
+    
+    # Запись справочных данных (rpc_pub) идёт на узел administration,
+    # чтение — из локальной реплики (см. routing.RoutingSession)
+    SQLALCHEMY_BINDS = {}
+    if NODE != 'administration':
+        master_config = DATABASE_CONFIGS['administration']
+        SQLALCHEMY_BINDS['master'] = {
+            'url': (
+                f"postgresql+psycopg://{master_config['user']}:{master_config['password']}"
+                f"@{master_config['host']}:{master_config['port']}/{master_config['database']}"
+            ),
+            'pool_size': int(os.getenv('MASTER_POOL_SIZE', 2)),
+            'max_overflow': int(os.getenv('MASTER_MAX_OVERFLOW', 2)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+            'connect_args': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+                'options': f"-c statement_timeout={os.getenv('MASTER_STATEMENT_TIMEOUT_MS', 10000)}"
+            }
+        }
+    
+    # Федеративный поиск заказов (по умолчанию — на узле administration): узлы
+    # магазинов, опрашиваемые параллельно, таймаут одного узла и пул к каждому
+    FEDERATION_NODES = [n for n in os.getenv(
+        'FEDERATION_NODES', 'shop1,shop2' if NODE == 'administration' else '').split(',') if n]
+    FEDERATION_TIMEOUT_MS = int(os.getenv('FEDERATION_TIMEOUT_MS', 2000))
+    _node = _cfg = None
+    for _node in FEDERATION_NODES:
+        _cfg = DATABASE_CONFIGS[_node]
+        SQLALCHEMY_BINDS[f'node_{_node}'] = {
+            'url': (
+                f"postgresql+psycopg://{_cfg['user']}:{_cfg['password']}"
+                f"@{_cfg['host']}:{_cfg['port']}/{_cfg['database']}"
+            ),
+            'pool_size': int(os.getenv('FEDERATION_POOL_SIZE', 2)),
+            'max_overflow': int(os.getenv('FEDERATION_MAX_OVERFLOW', 2)),
+            'pool_timeout': FEDERATION_TIMEOUT_MS / 1000,
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+            'connect_args': {
+                'connect_timeout': max(FEDERATION_TIMEOUT_MS // 1000, 2),
+                'options': f'-c statement_timeout={FEDERATION_TIMEOUT_MS}'
+            }
+        }
+    del _node, _cfg
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Кэш результатов поиска клиентов и товаров
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 2048))
+    SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 60))
+    
+    # Кэш отрисованных страниц просмотра заказа клиентом
+    ORDER_FRAGMENT_CACHE_SIZE = int(os.getenv('ORDER_FRAGMENT_CACHE_SIZE', 4096))
+    ORDER_FRAGMENT_CACHE_TTL = int(os.getenv('ORDER_FRAGMENT_CACHE_TTL', 600))
+    
+    # Как часто (в секундах) сверять версии справочников с reference_versions
+    REFERENCE_CHECK_INTERVAL = int(os.getenv('REFERENCE_CHECK_INTERVAL', 5))
+    
+    # Генератор номеров заказов и чеков (класс, вызываемый как PREFIX, NODE, INSTANCE_ID)
+    ID_GENERATOR = os.getenv('ID_GENERATOR', 'ids.TimeOrderedIdGenerator')
+    # Экземпляр приложения в номерах: реплики одного узла в разных контейнерах
+    # различаются им, а не pid; по умолчанию — хэш имени хоста (id контейнера)
+    INSTANCE_ID = os.getenv('INSTANCE_ID')
+    
+    # Размер пачки (заказов на транзакцию) при пакетной загрузке
+    BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 1000))
+    
+    # Очистка отменённых заказов (purge-orders): срок хранения, размер пачки,
+    # пауза между пачками и допустимое отставание подписчиков публикаций узла
+    PURGE_RETENTION_DAYS = int(os.getenv('PURGE_RETENTION_DAYS', 90))
+    PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', 500))
+    PURGE_PAUSE_MS = int(os.getenv('PURGE_PAUSE_MS', 200))
+    PURGE_MAX_LAG_BYTES = int(os.getenv('PURGE_MAX_LAG_BYTES', 16 * 1024 ** 2))
+    PURGE_MAX_WAIT = int(os.getenv('PURGE_MAX_WAIT', 300))
+    
+    # Проверка остатков при создании заказа: 0 — только предупреждение, 1 — отказ
+    STOCK_ENFORCE = os.getenv('STOCK_ENFORCE', '0') == '1'
+    
+    # Ключи идемпотентности (заголовок Idempotency-Key или поле idempotency_key):
+    # сколько часов хранится ответ, через сколько секунд ключ без ответа может занять
+    # повтор и размер пачки при удалении просроченных ключей
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24))
+    IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 60))
+    IDEMPOTENCY_PURGE_BATCH = int(os.getenv('IDEMPOTENCY_PURGE_BATCH', 5000))
+    
+    # Метрики запросов (/metrics) и порог повторов одного SQL для предупреждения о N+1
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+    
+    # Профилирование по запросу (?_profile=1) — только для отладки
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+    
+    # Лента изменений заказов: канал LISTEN/NOTIFY и предел SSE-клиентов на процесс
+    ORDER_FEED_CHANNEL = os.getenv('ORDER_FEED_CHANNEL', 'order_changes')
+    # SSE-клиент держит поток воркера всё время подключения: под ленту gunicorn
+    # добавляет столько потоков сверх APP_THREADS (gunicorn.conf.py), и запросам
+    # к заказам они не мешают. Клиентам сверх предела — повтор через BUSY_RETRY_MS
+    ORDER_FEED_MAX_CLIENTS = int(os.getenv('ORDER_FEED_MAX_CLIENTS', 20))
+    ORDER_FEED_BUSY_RETRY_MS = int(os.getenv('ORDER_FEED_BUSY_RETRY_MS', 30000))
+    
+    # Мониторинг репликации (/admin/replication): таймаут опроса узла, допустимое
+    # отставание подписок и объём WAL, удерживаемого слотами; тревога о росте WAL
+    # поднимается, если при текущей скорости запас кончится раньше чем через HORIZON секунд
+    REPLICATION_POLL_TIMEOUT = int(os.getenv('REPLICATION_POLL_TIMEOUT', 3))
+    REPLICATION_LAG_ALERT_SECONDS = int(os.getenv('REPLICATION_LAG_ALERT_SECONDS', 60))
+    REPLICATION_LAG_ALERT_BYTES = int(os.getenv('REPLICATION_LAG_ALERT_BYTES', 64 * 1024 ** 2))
+    REPLICATION_WAL_ALERT_BYTES = int(os.getenv('REPLICATION_WAL_ALERT_BYTES', 1024 ** 3))
+    REPLICATION_WAL_ALERT_HORIZON = int(os.getenv('REPLICATION_WAL_ALERT_HORIZON', 3600))
+    
+    # Секционирование заказов по месяцам: на сколько месяцев вперёд создавать секции,
+    # сколько полных месяцев хранить в базе и куда выгружать старые (Parquet).
+    # 14 месяцев покрывают сезонную базу плана пополнения (planner: год и --window недель)
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+    ARCHIVE_KEEP_MONTHS = int(os.getenv('ARCHIVE_KEEP_MONTHS', 14))
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'archive'))
+    # Сколько архивирование ждёт блокировку родительских таблиц для DETACH: при
+    # отказе месяц остаётся в базе до следующего запуска, а запросы не стоят в очереди
+    ARCHIVE_LOCK_TIMEOUT_MS = int(os.getenv('ARCHIVE_LOCK_TIMEOUT_MS', 3000))
+    
+    # Каталог версионированных миграций (devops/migrations/versions)
+    MIGRATIONS_DIR = os.getenv('MIGRATIONS_DIR', os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'devops', 'migrations', 'versions'))
+    
     SECRET_KEY = 'your-secret-key-here-change-in-production'
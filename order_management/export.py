@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import zlib
+from itertools import chain, groupby
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, Order, OrderDate, Receipt, Client, OrderedGoods, Invoice, ListOfGoods
+from orders import filter_orders
+from partitions import archive_rows
+
+# Строк, читаемых с серверного курсора за раз, и байт в одном куске ответа
+YIELD_PER = 1000
+CHUNK_BYTES = 64 * 1024
+
+ORDER_FIELDS = ['order_number', 'date_of_order', 'status', 'shop_id', 'total_price',
+                'client_id', 'client_name', 'client_email', 'client_phone',
+                'receipt_number', 'receipt_date', 'payment_method', 'worker_id']
+ITEM_FIELDS = ['item_id', 'quantity', 'price_per_unit', 'subtotal',
+               'invoice_id', 'good_id', 'good_name']
+
+
+def export_statement(query):
+    """Заказы с клиентом, чеком и позициями: одна строка на позицию заказа"""
+    statement = (
+        select(
+            Order.order_number, Order.date_of_order, Order.status, Order.shop_id,
+            Order.total_price, Order.client_id,
+            Client.name.label('client_name'), Client.email.label('client_email'),
+            Client.phone_number.label('client_phone'),
+            Receipt.receipt_number, Receipt.date_oforder.label('receipt_date'),
+            Receipt.payment_method, Receipt.shop_workerid.label('worker_id'),
+            OrderedGoods.id.label('item_id'), OrderedGoods.quantity,
+            OrderedGoods.price_per_unit, OrderedGoods.subtotal, OrderedGoods.invoice_id,
+            ListOfGoods.id.label('good_id'), ListOfGoods.name.label('good_name'),
+        )
+        .select_from(Order)
+        .join(Client, Client.id == Order.client_id)
+        .outerjoin(OrderDate, OrderDate.order_number == Order.order_number)
+        .outerjoin(Receipt, (Receipt.receipt_number == OrderDate.receipt_number)
+                   & (Receipt.date_oforder == OrderDate.receipt_date))
+        .outerjoin(OrderedGoods, (OrderedGoods.order_id == Order.order_number)
+                   & (OrderedGoods.order_date == Order.date_of_order))
+        .outerjoin(Invoice, Invoice.invoicenumber == OrderedGoods.invoice_id)
+        .outerjoin(ListOfGoods, ListOfGoods.id == Invoice.goodid)
+        .order_by(Order.date_of_order.desc(), Order.order_number.desc(), OrderedGoods.id)
+    )
+    if query.whereclause is not None:
+        statement = statement.where(query.whereclause)
+    return statement
+
+
+def stream_rows(query):
+    """Строки выгрузки с серверного курсора: память не зависит от объёма"""
+    result = db.session.execute(
+        export_statement(query),
+        execution_options={'stream_results': True, 'yield_per': YIELD_PER}
+    )
+    for row in result.mappings():
+        yield row
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _json(value):
+    if value is None or isinstance(value, (int, str)):
+        return value
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def csv_lines(rows):
+    """CSV: одна строка на позицию заказа (заказ без позиций — одна строка)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+    # Заголовок отдаётся сразу, чтобы клиент начал получать данные без задержки
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow([_text(row[f]) for f in ORDER_FIELDS + ITEM_FIELDS])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def json_lines(rows):
+    """JSON Lines: один объект на заказ с вложенным списком позиций"""
+    chunk = []
+    size = 0
+    # Первый заказ отдаётся сразу, дальше — кусками по CHUNK_BYTES
+    limit = 0
+    for _, group in groupby(rows, key=lambda r: r['order_number']):
+        group = list(group)
+        order = {f: _json(group[0][f]) for f in ORDER_FIELDS}
+        order['items'] = [{f: _json(r[f]) for f in ITEM_FIELDS}
+                          for r in group if r['item_id'] is not None]
+        line = json.dumps(order, ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= limit:
+            yield ''.join(chunk)
+            chunk, size, limit = [], 0, CHUNK_BYTES
+    yield ''.join(chunk)
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv', 'csv'),
+    'jsonl': (json_lines, 'application/x-ndjson', 'jsonl'),
+}
+
+
+def gzip_stream(chunks):
+    """Сжатие gzip на лету, кусок за куском"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_orders(args, fmt, compress=False, archived=False):
+    """Генератор байтов выгрузки заказов с фильтрами staff_orders().
+
+    archived=True добавляет после заказов из базы заказы из архива (они старше).
+    """
+    writer = FORMATS[fmt][0]
+    rows = stream_rows(filter_orders(args))
+    if archived:
+        rows = chain(rows, archive_rows(args))
+    chunks = writer(rows)
+    if compress:
+        return gzip_stream(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+
+@click.command('export-orders')
+@click.argument('output', type=click.File('wb'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv',
+              show_default=True)
+@click.option('--status', default='all')
+@click.option('--shop', default='all')
+@click.option('--date-from', default='')
+@click.option('--date-to', default='')
+@click.option('--gzip', 'compress', is_flag=True, help='Сжимать вывод gzip')
+@click.option('--archived', is_flag=True, help='Включить заказы из архива (Parquet)')
+@with_appcontext
+def export_orders_command(output, fmt, status, shop, date_from, date_to, compress, archived):
+    """Потоковая выгрузка заказов с чеками и позициями (- для stdout)"""
+    args = {'status': status, 'shop': shop, 'date_from': date_from, 'date_to': date_to}
+    for data in export_orders(args, fmt, compress, archived):
+        output.write(data)
@@ -0,0 +1,158 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from sqlalchemy import or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Client, Order
+from orders import order_key
+from search import (PHONE_RE, email_expr, escape_like, normalize_email, normalize_phone,
+                    phone_digits_expr)
+
+KINDS = ('email', 'phone', 'order')
+
+
+class FederatedSearch:
+    """Поиск заказов сразу по всем узлам магазинов.
+
+    Каждый узел опрашивается в своём потоке через пул соединений своего bind
+    (node_<имя>), поэтому общее время близко ко времени самого медленного узла.
+    Узел, не ответивший за timeout, попадает в отчёт как недоступный, а
+    результаты остальных возвращаются.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.timeout = 2.0
+        self._executor = None
+
+    def configure(self, nodes, timeout, threads=1):
+        self.nodes = list(nodes)
+        self.timeout = timeout
+        # По потоку на узел для каждого потока запросов воркера: одновременные
+        # поиски не ждут друг друга в очереди пула и не упираются в timeout.
+        # Потоки создаются при первом поиске, т.е. уже в воркере после fork
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.nodes) * threads, 1),
+                                            thread_name_prefix='federation')
+
+    def search(self, query, kind=None, limit=50):
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+            raise ValueError(f'Некорректный limit: {limit!r}')
+        query = query.strip()
+        kind = kind or classify(query)
+        statement = search_statement(query, kind, limit)
+        # Движки берутся в потоке запроса: db.engines требует контекста приложения
+        engines = {node: db.engines[f'node_{node}'] for node in self.nodes}
+        started = time.perf_counter()
+        futures = {self._executor.submit(_query_node, engine, statement): node
+                   for node, engine in engines.items()}
+        done, _ = wait(futures, timeout=self.timeout)
+
+        nodes = {}
+        rows = []
+        for future, node in futures.items():
+            if future not in done:
+                # Запрос на узле прервёт statement_timeout; поток вернёт соединение в пул
+                nodes[node] = {'status': 'timeout'}
+                continue
+            try:
+                node_rows, elapsed = future.result()
+            except SQLAlchemyError as e:
+                error = getattr(e, 'orig', None) or e
+                nodes[node] = {'status': 'error', 'error': str(error).strip().splitlines()[0]}
+                continue
+            nodes[node] = {'status': 'ok', 'ms': round(elapsed * 1000, 1), 'rows': len(node_rows)}
+            rows.extend(dict(row, node=node) for row in node_rows)
+
+        return {
+            'query': query,
+            'kind': kind,
+            'results': merge(rows, limit),
+            'nodes': nodes,
+            'partial': any(n['status'] != 'ok' for n in nodes.values()),
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+federated_search = FederatedSearch()
+
+
+def classify(query):
+    """Тип запроса: email, телефон или номер заказа"""
+    if '@' in query:
+        return 'email'
+    if PHONE_RE.match(query) and not query.upper().startswith('ORD'):
+        return 'phone'
+    return 'order'
+
+
+def search_statement(query, kind, limit):
+    """Клиенты с их заказами (клиент без заказов — одна строка с пустым заказом)"""
+    statement = select(
+        Client.id.label('client_id'), Client.name.label('client_name'),
+        Client.email.label('client_email'), Client.phone_number.label('client_phone'),
+        Order.order_number, Order.date_of_order, Order.status, Order.shop_id,
+        Order.total_price,
+    )
+    if kind == 'order':
+        statement = (statement.select_from(Order)
+                     .join(Client, Client.id == Order.client_id)
+                     .where(order_key(query)))
+    else:
+        if kind == 'email':
+            criteria = email_expr().like(escape_like(normalize_email(query)) + '%', escape='\\')
+        elif kind == 'phone':
+            digits = normalize_phone(query)
+            prefixes = [digits] if digits.startswith('7') else [digits, '7' + digits]
+            criteria = or_(*(phone_digits_expr().like(escape_like(p) + '%', escape='\\')
+                             for p in prefixes))
+        else:
+            raise ValueError(f'Неизвестный тип поиска: {kind}')
+        statement = (statement.select_from(Client)
+                     .outerjoin(Order, Order.client_id == Client.id)
+                     .where(criteria))
+    return (statement
+            .order_by(Order.date_of_order.desc().nulls_last(), Order.order_number.desc())
+            .limit(limit))
+
+
+def _query_node(engine, statement):
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        rows = conn.execute(statement).mappings().all()
+    return rows, time.perf_counter() - started
+
+
+def _json(value):
+    if value is None or isinstance(value, (int, str)):
+        return value
+    return value.isoformat() if hasattr(value, 'isoformat') else float(value)
+
+
+def merge(rows, limit):
+    """Объединение ответов узлов: новые заказы первыми, без повторов.
+
+    Заказ, реплицированный на несколько узлов, выдаётся один раз со списком узлов.
+    """
+    merged = {}
+    for row in rows:
+        key = row['order_number'] or ('client', row['client_email'])
+        if key in merged:
+            merged[key]['nodes'].append(row['node'])
+            continue
+        item = {k: _json(v) for k, v in row.items() if k != 'node'}
+        item['nodes'] = [row['node']]
+        merged[key] = item
+    results = sorted(merged.values(),
+                     key=lambda r: (r['date_of_order'] or '', r['order_number'] or ''),
+                     reverse=True)
+    for item in results:
+        item['nodes'].sort()
+    return results[:limit]
+
+
+def init_federation(app):
+    """Узлы федеративного поиска; у каждого свой bind node_<имя> (см. Config)"""
+    federated_search.configure(app.config['FEDERATION_NODES'],
+                               app.config['FEDERATION_TIMEOUT_MS'] / 1000,
+                               app.config['APP_THREADS'])
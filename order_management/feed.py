@@ -0,0 +1,121 @@
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+import psycopg
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """Один LISTEN-подписчик на процесс, раздающий уведомления клиентам SSE.
+
+    Поток-слушатель запускается при первой подписке (т.е. уже в воркере,
+    после fork) и переподключается к базе при обрыве соединения.
+    """
+
+    def __init__(self, channel='order_changes', max_clients=50, queue_size=100):
+        self.channel = channel
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._conninfo = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def configure(self, conninfo, channel, max_clients):
+        self._conninfo = conninfo
+        self.channel = channel
+        self.max_clients = max_clients
+
+    def subscribe(self):
+        """Очередь событий для нового клиента или None, если клиентов слишком много"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            events = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.add(events)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, name='order-feed',
+                                                daemon=True)
+                self._thread.start()
+            return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def _publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Медленный клиент пропускает события, остальные не ждут его
+                pass
+
+    def _listen(self):
+        delay = 1
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                with psycopg.connect(self._conninfo, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {self.channel}')
+                    delay = 1
+                    while True:
+                        for notify in conn.notifies(timeout=5):
+                            self._publish(json.loads(notify.payload))
+                        with self._lock:
+                            if not self._subscribers:
+                                self._thread = None
+                                return
+            except psycopg.Error as e:
+                logger.warning('Лента заказов: потеряно соединение (%s), повтор через %d с', e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+
+order_feed = ChangeFeed()
+
+
+def init_feed(app):
+    """Параметры ленты; подключение — к базе текущего узла"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql')
+    order_feed.configure(
+        url.render_as_string(hide_password=False),
+        app.config['ORDER_FEED_CHANNEL'],
+        app.config['ORDER_FEED_MAX_CLIENTS'],
+    )
+
+
+def sse_stream(events, shop_id=None, heartbeat=15):
+    """Поток Server-Sent Events из очереди подписчика"""
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if shop_id is not None and event.get('shop_id') not in (None, shop_id):
+                continue
+            yield f'event: order\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+    finally:
+        order_feed.unsubscribe(events)
+
+
+def sse_busy(retry_ms):
+    """Ответ клиенту сверх предела: поток закрывается сразу, и EventSource
+    переподключается через retry_ms (разброс — чтобы вкладки не пришли разом).
+    Ответ не 200 браузер считает окончательной ошибкой и больше не переподключается.
+    """
+    yield f'retry: {retry_ms + random.randint(0, retry_ms)}\n\n'
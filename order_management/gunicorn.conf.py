@@ -0,0 +1,42 @@
+# Конфигурация gunicorn для production: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.getenv('APP_BIND', '0.0.0.0:8000')
+
+# Потоки одного воркера не должны превышать его пул соединений
+pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+max_overflow = int(os.getenv('DB_MAX_OVERFLOW', 5))
+worker_class = 'gthread'
+# Потоки под SSE-клиентов ленты заказов (config.ORDER_FEED_MAX_CLIENTS) — сверх
+# потоков запросов: они ждут уведомлений и соединений пула не держат
+threads = int(os.getenv('APP_THREADS', pool_size)) + int(os.getenv('ORDER_FEED_MAX_CLIENTS', 20))
+
+# Воркеров — по CPU, но не больше, чем позволяет бюджет соединений узла Postgres
+connection_budget = int(os.getenv('DB_CONNECTION_BUDGET', 80))
+workers = int(os.getenv('APP_WORKERS', max(1, min(
+    multiprocessing.cpu_count() * 2 + 1,
+    connection_budget // (pool_size + max_overflow)
+))))
+
+# Код и шаблоны загружаются один раз в мастере и разделяются воркерами после fork
+preload_app = True
+
+# Корректный перезапуск: воркеры дорабатывают начатые запросы (в т.ч. запись заказов)
+graceful_timeout = int(os.getenv('APP_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.getenv('APP_TIMEOUT', 60))
+keepalive = 5
+max_requests = int(os.getenv('APP_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Соединения пула не должны переходить из мастера в воркеры"""
+    from app import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
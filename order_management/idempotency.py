@@ -0,0 +1,277 @@
+import hashlib
+import json
+import uuid
+from functools import wraps
+
+import click
+from flask import current_app, request, session, flash, redirect, jsonify
+from flask.cli import with_appcontext
+from sqlalchemy import event, text
+
+from models import db
+
+# Ключ приходит заголовком (API) или скрытым полем формы (браузер не задаёт заголовки)
+KEY_HEADER = 'Idempotency-Key'
+KEY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 128
+
+# Область ключей строк пакетной загрузки (bulk.py): общая для API и import-orders
+BULK_SCOPE = 'bulk'
+
+# Ключ без ответа старше аренды считается брошенным и не возвращается
+LOOKUP = text('''
+    SELECT fingerprint, response FROM idempotency_keys
+    WHERE scope = :scope AND key = :key AND expires_at > LOCALTIMESTAMP
+      AND (response IS NOT NULL
+           OR claimed_at > LOCALTIMESTAMP - make_interval(secs => CAST(:lease AS INT)))
+''')
+
+# Просроченный или брошенный ключ занимается заново; при живом ключе конкурентная
+# вставка ждёт фиксации исходной транзакции и ничего не возвращает
+CLAIM = text('''
+    INSERT INTO idempotency_keys AS k (scope, key, fingerprint, response, claimed_at, expires_at)
+    VALUES (:scope, :key, :fingerprint, NULL, LOCALTIMESTAMP,
+            LOCALTIMESTAMP + make_interval(hours => CAST(:ttl AS INT)))
+    ON CONFLICT (scope, key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = NULL,
+        claimed_at = EXCLUDED.claimed_at, expires_at = EXCLUDED.expires_at
+    WHERE k.expires_at <= LOCALTIMESTAMP
+       OR (k.response IS NULL
+           AND k.claimed_at <= LOCALTIMESTAMP - make_interval(secs => CAST(:lease AS INT)))
+    RETURNING 1
+''')
+
+STORE = text('''
+    UPDATE idempotency_keys SET response = CAST(:response AS JSONB)
+    WHERE scope = :scope AND key = :key
+''')
+
+# Ответ, записываемый в транзакции запроса при её фиксации: повтор не выполнит
+# запрос второй раз, даже если полный ответ сохранить не удалось
+COMPLETED = json.dumps({'status': 200, 'body': {'result': 'запрос с этим ключом уже выполнен'}},
+                       ensure_ascii=False)
+
+# Ключ, занятый запросом в текущей сессии, и признак зафиксированной записи
+CLAIM_INFO = 'idempotency_claim'
+COMMITTED_INFO = 'idempotency_committed'
+
+# Ключи строк пакета сразу с результатом — номером заказа строки — и отпечатком строки
+CLAIM_ROWS = text('''
+    INSERT INTO idempotency_keys AS k (scope, key, fingerprint, response, expires_at)
+    SELECT :scope, t.key, t.fingerprint, jsonb_build_object('order_number', t.order_number),
+           LOCALTIMESTAMP + make_interval(hours => CAST(:ttl AS INT))
+    FROM unnest(CAST(:keys AS VARCHAR[]), CAST(:numbers AS VARCHAR[]),
+                CAST(:fingerprints AS BYTEA[])) AS t(key, order_number, fingerprint)
+    ON CONFLICT (scope, key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = EXCLUDED.response,
+        expires_at = EXCLUDED.expires_at
+    WHERE k.expires_at <= LOCALTIMESTAMP
+    RETURNING key
+''')
+
+LOOKUP_ROWS = text('''
+    SELECT key, response->>'order_number', fingerprint FROM idempotency_keys
+    WHERE scope = :scope AND key = ANY(CAST(:keys AS VARCHAR[]))
+''')
+
+EXPIRE_BATCH = text('''
+    DELETE FROM idempotency_keys
+    WHERE (scope, key) IN (
+        SELECT scope, key FROM idempotency_keys
+        WHERE expires_at <= LOCALTIMESTAMP
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+''')
+
+
+def request_key():
+    """Ключ идемпотентности запроса или None"""
+    key = (request.headers.get(KEY_HEADER) or request.form.get(KEY_FIELD) or '').strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'ключ идемпотентности длиннее {MAX_KEY_LENGTH} символов')
+    return key or None
+
+
+def fingerprint():
+    """Отпечаток запроса: путь и поля формы без самого ключа"""
+    fields = sorted((name, value) for name, value in request.form.items(multi=True)
+                    if name != KEY_FIELD)
+    payload = json.dumps([request.path, fields], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).digest()[:16]
+
+
+def _ttl():
+    return current_app.config['IDEMPOTENCY_TTL_HOURS']
+
+
+def _lease():
+    return current_app.config['IDEMPOTENCY_LEASE_SECONDS']
+
+
+def claim(scope, key, digest):
+    """Закрепить ключ за текущей транзакцией.
+
+    Возвращает None, если ключ новый (просрочен или брошен), иначе сохранённую
+    строку (fingerprint, response). Ключ фиксируется той же транзакцией, что и
+    запись запроса, и откатывается вместе с ней.
+    """
+    params = {'scope': scope, 'key': key, 'lease': _lease()}
+    saved = db.session.execute(LOOKUP, params).first()
+    if saved is not None:
+        return saved
+    claimed = db.session.execute(CLAIM, dict(params, fingerprint=digest, ttl=_ttl())).first()
+    if claimed is not None:
+        return None
+    # Параллельный запрос с тем же ключом успел зафиксироваться
+    return db.session.execute(LOOKUP, params).first()
+
+
+def replay(saved, digest):
+    """Ответ на повтор запроса по сохранённой строке ключа"""
+    stored_fingerprint, response = saved
+    if stored_fingerprint is not None and bytes(stored_fingerprint) != digest:
+        return jsonify({'error': 'ключ идемпотентности уже использован с другими данными'}), 422
+    if response is None:
+        # Исходный запрос ещё выполняется: ключ занят и моложе аренды
+        return jsonify({'error': 'запрос с этим ключом ещё выполняется'}), 409, {'Retry-After': '1'}
+    for category, message in response.get('flashes', ()):
+        flash(message, category)
+    if 'location' in response:
+        result = redirect(response['location'], code=response['status'])
+    else:
+        result = jsonify(response['body'])
+        result.status_code = response['status']
+    result.headers['Idempotent-Replayed'] = 'true'
+    return result
+
+
+def _store_completed(session):
+    """Перед фиксацией транзакции запроса: ключ получает ответ COMPLETED"""
+    claim = session.info.get(CLAIM_INFO)
+    if claim is not None and not session.info.get(COMMITTED_INFO):
+        scope, key = claim
+        session.execute(STORE, {'scope': scope, 'key': key, 'response': COMPLETED})
+
+
+def _mark_committed(session):
+    if CLAIM_INFO in session.info:
+        session.info[COMMITTED_INFO] = True
+
+
+def _remember(scope, key, response, flashes):
+    """Сохранить ответ: перенаправление или JSON.
+
+    Остальные ответы не воспроизводятся: если запрос ничего не зафиксировал,
+    ключ откатывается и повтор выполнит запрос заново, иначе повтор получит
+    COMPLETED, записанный при фиксации.
+    """
+    # Дальнейшие фиксации — уже не запись запроса
+    db.session.info.pop(CLAIM_INFO, None)
+    committed = db.session.info.pop(COMMITTED_INFO, False)
+    if response.status_code in (301, 302, 303):
+        stored = {'status': response.status_code, 'location': response.location,
+                  'flashes': [list(f) for f in flashes]}
+    elif response.is_json and response.status_code < 400:
+        stored = {'status': response.status_code, 'body': response.get_json()}
+    else:
+        if not committed:
+            db.session.rollback()
+        return
+    # Если запрос откатил свою транзакцию, ключа уже нет и обновлять нечего
+    db.session.execute(STORE, {'scope': scope, 'key': key,
+                               'response': json.dumps(stored, ensure_ascii=False)})
+    db.session.commit()
+
+
+def idempotent(view):
+    """POST с ключом идемпотентности выполняется один раз, повтор получает тот же ответ.
+
+    Повтор стоит одного чтения по первичному ключу idempotency_keys. Запросы без
+    ключа обрабатываются как обычно. Фиксация записи запроса сразу отмечает ключ
+    выполненным (_store_completed), полный ответ сохраняется после.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'POST':
+            return view(*args, **kwargs)
+        try:
+            key = request_key()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if key is None:
+            return view(*args, **kwargs)
+
+        scope = request.endpoint
+        digest = fingerprint()
+        saved = claim(scope, key, digest)
+        if saved is not None:
+            db.session.rollback()
+            return replay(saved, digest)
+
+        shown = len(session.get('_flashes', ()))
+        db.session.info[CLAIM_INFO] = (scope, key)
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.info.pop(CLAIM_INFO, None)
+            db.session.info.pop(COMMITTED_INFO, None)
+            raise
+        _remember(scope, key, response, session.get('_flashes', [])[shown:])
+        return response
+    return wrapper
+
+
+def claim_rows(scope, rows):
+    """Ключи строк пакета {ключ: (номер нового заказа, отпечаток строки)} без фиксации.
+
+    Возвращает {ключ: (номер заказа, отпечаток)} для ключей, уже принятых раньше:
+    такие строки не вставляются повторно, а отпечаток отличает повтор от другой
+    строки с тем же ключом.
+    """
+    if not rows:
+        return {}
+    keys = list(rows)
+    claimed = set(db.session.execute(CLAIM_ROWS, {
+        'scope': scope, 'keys': keys, 'numbers': [rows[k][0] for k in keys],
+        'fingerprints': [rows[k][1] for k in keys], 'ttl': _ttl(),
+    }).scalars())
+    seen = [k for k in keys if k not in claimed]
+    if not seen:
+        return {}
+    return {key: (number, bytes(digest) if digest is not None else None)
+            for key, number, digest in db.session.execute(
+                LOOKUP_ROWS, {'scope': scope, 'keys': seen})}
+
+
+def expire_keys(batch_size):
+    """Удаление просроченных ключей пачками; возвращает число удалённых"""
+    total = 0
+    while True:
+        deleted = db.session.execute(EXPIRE_BATCH, {'limit': batch_size}).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+@click.command('idempotency-expire')
+@click.option('--batch-size', default=None, type=int,
+              help='Ключей на транзакцию (по умолчанию IDEMPOTENCY_PURGE_BATCH)')
+@with_appcontext
+def idempotency_expire_command(batch_size):
+    """Удалить просроченные ключи идемпотентности"""
+    total = expire_keys(batch_size or current_app.config['IDEMPOTENCY_PURGE_BATCH'])
+    click.echo(f'Удалено ключей: {total}')
+
+
+def init_idempotency(app):
+    """Новый ключ для каждой отрисованной формы: повторная отправка несёт тот же ключ.
+
+    Ключ запроса отмечается выполненным в той же транзакции, что и его запись.
+    """
+    app.context_processor(lambda: {'new_idempotency_key': lambda: uuid.uuid4().hex})
+    if not event.contains(db.session, 'before_commit', _store_completed):
+        event.listen(db.session, 'before_commit', _store_completed)
+        event.listen(db.session, 'after_commit', _mark_committed)
@@ -0,0 +1,114 @@
+import os
+import socket
+import threading
+import zlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.utils import import_string
+
+
+class TimeOrderedIdGenerator:
+    """Монотонные номера вида PREFIX-NODE-<время UTC до мс><счётчик>-<экземпляр>-<pid>.
+
+    Префикс узла разделяет номера магазинов, экземпляр — контейнеры одного
+    узла (у реплик сервиса pid совпадают), pid — процессы одного контейнера,
+    а счётчик — номера внутри одной миллисекунды. Номера одного узла растут
+    со временем, поэтому вставки в первичный ключ идут в конец B-дерева.
+    """
+
+    SEQ_DIGITS = 3
+
+    def __init__(self, prefix, node, instance=None):
+        self.prefix = f'{prefix}-{node.upper()}'
+        self.instance = instance or instance_id()
+        self._lock = threading.Lock()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._last_ms = 0
+        self._seq = 0
+
+    def _tick(self):
+        now_ms = time.time_ns() // 1_000_000
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._seq = 0
+            else:
+                # Та же миллисекунда или часы ушли назад: продолжаем счётчик
+                self._seq += 1
+                if self._seq >= 10 ** self.SEQ_DIGITS:
+                    self._last_ms += 1
+                    self._seq = 0
+            return self._last_ms, self._seq
+
+    def __call__(self):
+        ms, seq = self._tick()
+        stamp = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+        return (f'{self.prefix}-{stamp:%Y%m%d%H%M%S}{ms % 1000:03d}'
+                f'{seq:0{self.SEQ_DIGITS}d}-{self.instance}-{self._pid}')
+
+
+def instance_id():
+    """Идентификатор экземпляра: INSTANCE_ID или хэш имени хоста (id контейнера)"""
+    return os.getenv('INSTANCE_ID') or f'{zlib.crc32(socket.gethostname().encode()):08x}'
+
+
+_generators = {}
+
+
+def init_ids(app):
+    """Генераторы номеров заказов и чеков по Config.ID_GENERATOR"""
+    generator_class = import_string(app.config['ID_GENERATOR'])
+    _generators['order'] = generator_class('ORD', app.config['NODE'], app.config['INSTANCE_ID'])
+    _generators['receipt'] = generator_class('RCP', app.config['NODE'], app.config['INSTANCE_ID'])
+
+
+def generate_order_number():
+    """Генерация уникального номера заказа"""
+    return _generators['order']()
+
+
+def generate_receipt_number():
+    """Генерация уникального номера чека"""
+    return _generators['receipt']()
+
+
+def _stress_worker(args):
+    generator_path, node, instance, count = args
+    generate = import_string(generator_path)('ORD', node, instance)
+    started = time.perf_counter()
+    ids = [generate() for _ in range(count)]
+    return ids, count / (time.perf_counter() - started)
+
+
+@click.command('stress-ids')
+@click.option('--count', default=100000, show_default=True, help='Номеров на процесс')
+@click.option('--processes', default=4, show_default=True)
+@click.option('--min-rate', default=10000, show_default=True,
+              help='Минимальная скорость генерации на процесс, номеров/с')
+@with_appcontext
+def stress_ids_command(count, processes, min_rate):
+    """Проверить генератор номеров на коллизии и скорость"""
+    config = current_app.config
+    args = [(config['ID_GENERATOR'], config['NODE'], config['INSTANCE_ID'], count)] * processes
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(_stress_worker, args))
+
+    all_ids = [i for ids, _ in results for i in ids]
+    collisions = len(all_ids) - len(set(all_ids))
+    unordered = sum(1 for ids, _ in results if ids != sorted(ids))
+    slowest = min(rate for _, rate in results)
+
+    click.echo(f'Номеров: {len(all_ids)}, коллизий: {collisions}, '
+               f'немонотонных процессов: {unordered}, минимальная скорость: {slowest:.0f}/с')
+    if collisions or unordered or slowest < min_rate:
+        raise SystemExit(1)
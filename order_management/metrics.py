@@ -0,0 +1,156 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+
+from models import db
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class EndpointStats:
+    """Накопленные показатели одного эндпоинта"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.duration_sum = 0.0
+        self.duration_buckets = [0] * len(BUCKETS)
+        self.sql_statements = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.n_plus_one = 0
+
+
+class Registry:
+    """Метрики процесса по эндпоинтам (у каждого воркера gunicorn свои)"""
+
+    def __init__(self):
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, duration, sql, n_plus_one):
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests[(method, status)] += 1
+            stats.duration_sum += duration
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stats.duration_buckets[i] += 1
+            stats.sql_statements += sql['statements']
+            stats.sql_time += sql['time']
+            stats.rows += sql['rows']
+            stats.n_plus_one += len(n_plus_one)
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = [
+            '# TYPE http_requests_total counter',
+            '# TYPE http_request_duration_seconds histogram',
+            '# TYPE db_statements_total counter',
+            '# TYPE db_statement_duration_seconds_total counter',
+            '# TYPE db_rows_fetched_total counter',
+            '# TYPE db_n_plus_one_total counter',
+        ]
+        with self._lock:
+            for endpoint, stats in sorted(self._stats.items()):
+                label = f'endpoint="{endpoint}"'
+                total = sum(stats.requests.values())
+                for (method, status), count in sorted(stats.requests.items()):
+                    lines.append(f'http_requests_total{{{label},method="{method}",'
+                                 f'status="{status}"}} {count}')
+                for bound, count in zip(BUCKETS, stats.duration_buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {total}')
+                lines.append(f'http_request_duration_seconds_sum{{{label}}} {stats.duration_sum:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{label}}} {total}')
+                lines.append(f'db_statements_total{{{label}}} {stats.sql_statements}')
+                lines.append(f'db_statement_duration_seconds_total{{{label}}} {stats.sql_time:.6f}')
+                lines.append(f'db_rows_fetched_total{{{label}}} {stats.rows}')
+                lines.append(f'db_n_plus_one_total{{{label}}} {stats.n_plus_one}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _current():
+    return g.get('_sql_metrics') if has_app_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql = _current()
+    if sql is None or not conn.info.get('query_start'):
+        return
+    sql['time'] += time.perf_counter() - conn.info['query_start'].pop()
+    sql['statements'] += 1
+    sql['by_statement'][statement] += 1
+    if cursor.description is not None and cursor.rowcount > 0:
+        sql['rows'] += cursor.rowcount
+
+
+def init_metrics(app):
+    """Инструментирование запросов; при METRICS_ENABLED=False ничего не подключается"""
+    if app.config['METRICS_ENABLED']:
+        threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+        @app.before_request
+        def start_metrics():
+            g._request_start = time.perf_counter()
+            g._sql_metrics = {'statements': 0, 'time': 0.0, 'rows': 0,
+                              'by_statement': Counter()}
+
+        @app.after_request
+        def record_metrics(response):
+            sql = g.pop('_sql_metrics', None)
+            if sql is None:
+                return response
+            duration = time.perf_counter() - g._request_start
+            endpoint = request.endpoint or 'unknown'
+            # Один и тот же запрос много раз за обработку — признак N+1
+            n_plus_one = [s for s, n in sql['by_statement'].items() if n >= threshold]
+            for statement in n_plus_one:
+                app.logger.warning('Возможный N+1 в %s (%d раз): %s', endpoint,
+                                   sql['by_statement'][statement], statement.splitlines()[0])
+            registry.record(endpoint, request.method, response.status_code,
+                            duration, sql, n_plus_one)
+            response.headers['Server-Timing'] = (
+                f'app;dur={duration * 1000:.1f}, db;dur={sql["time"] * 1000:.1f};'
+                f'desc="{sql["statements"]} queries"'
+            )
+            return response
+
+        @app.route('/metrics')
+        def metrics():
+            return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if app.config['PROFILING_ENABLED']:
+        @app.before_request
+        def start_profile():
+            if request.args.get('_profile') == '1':
+                g._profiler = cProfile.Profile()
+                g._profiler.enable()
+
+        @app.after_request
+        def dump_profile(response):
+            profiler = g.pop('_profiler', None)
+            if profiler is None:
+                return response
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(50)
+            return Response(out.getvalue(), mimetype='text/plain')
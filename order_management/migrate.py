@@ -0,0 +1,155 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, Order, Client, ListOfGoods, OrderedGoods, ReceiptPosition
+from orders import order_key
+
+
+def migration_files():
+    """Версионированные миграции в порядке применения"""
+    directory = current_app.config['MIGRATIONS_DIR']
+    names = sorted(n for n in os.listdir(directory) if n.endswith('.sql'))
+    return [(os.path.splitext(n)[0], os.path.join(directory, n)) for n in names]
+
+
+RECORD_VERSION = text('INSERT INTO schema_migrations (version) VALUES (:v) ON CONFLICT DO NOTHING')
+
+
+def _ensure_versions_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        ' version VARCHAR PRIMARY KEY,'
+        ' applied_at TIMESTAMP NOT NULL DEFAULT now())'
+    ))
+
+
+def apply_migrations():
+    """Применение ещё не выполненных миграций на текущем узле.
+
+    Каждая миграция и сама отмечает себя в schema_migrations: узлы, созданные
+    docker-entrypoint-initdb.d, не применяют её повторно.
+    """
+    with db.engine.begin() as conn:
+        _ensure_versions_table(conn)
+        applied = set(conn.execute(text('SELECT version FROM schema_migrations')).scalars())
+
+    done = []
+    for version, path in migration_files():
+        if version in applied:
+            continue
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        # Каждая миграция выполняется в своей транзакции вместе с отметкой о версии
+        with db.engine.begin() as conn:
+            # Перенос данных в миграции может идти дольше таймаута запросов приложения
+            conn.execute(text('SET LOCAL statement_timeout = 0'))
+            # no_parameters: драйвер не должен разбирать '%' в тексте миграции
+            conn.execution_options(no_parameters=True).exec_driver_sql(sql)
+            conn.execute(RECORD_VERSION, {'v': version})
+        done.append(version)
+    return done
+
+
+def mark_applied(upto):
+    """Отметить миграции до upto включительно применёнными, не выполняя их.
+
+    Для узлов, созданных initdb до того, как миграции стали отмечать себя сами.
+    """
+    versions = [version for version, _ in migration_files() if version <= upto]
+    if upto not in versions:
+        raise ValueError(f'Миграция {upto} не найдена')
+    with db.engine.begin() as conn:
+        _ensure_versions_table(conn)
+        for version in versions:
+            conn.execute(RECORD_VERSION, {'v': version})
+    return versions
+
+
+def route_queries():
+    """Типовые запросы маршрутов приложения для проверки планов"""
+    sample_date = db.func.current_date()
+    return {
+        'staff_orders': Order.query
+            .filter_by(shop_id=1, status='Новый')
+            .filter(Order.date_of_order >= sample_date)
+            .order_by(Order.date_of_order.desc(), Order.order_number.desc())
+            .limit(51),
+        'customer_orders': Order.query
+            .filter_by(client_id=1)
+            .order_by(Order.date_of_order.desc()),
+        'order_by_number': Order.query.filter(order_key('ORD-0')),
+        'ordered_goods': OrderedGoods.query.filter_by(order_id='ORD-0', order_date=sample_date),
+        'receipt_positions': ReceiptPosition.query.filter_by(receipt_id='RCP-0',
+                                                             receipt_date=sample_date),
+        'clients_search': Client.query.filter(
+            (Client.name.ilike('%abc%')) |
+            (db.func.lower(Client.email).like('abc%'))
+        ).limit(10),
+        'goods_search': ListOfGoods.query.filter(ListOfGoods.name.ilike('%abc%')).limit(10),
+    }
+
+
+def seq_scans(plan):
+    """Таблицы, которые план читает последовательным сканированием"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def check_plans(min_rows):
+    """Список (маршрут, таблица, строк) для seq scan по таблицам крупнее min_rows"""
+    conn = db.session.connection()
+    problems = []
+    for name, query in route_queries().items():
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        plan = conn.exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        ).scalar()[0]['Plan']
+        for table in seq_scans(plan):
+            rows = conn.execute(
+                text('SELECT reltuples::BIGINT FROM pg_class WHERE relname = :t'), {'t': table}
+            ).scalar() or 0
+            if rows >= min_rows:
+                problems.append((name, table, rows))
+    return problems
+
+
+@click.command('migrate')
+@click.option('--mark-applied', 'upto', default=None,
+              help='Только отметить миграции до этой версии включительно применёнными')
+@with_appcontext
+def migrate_command(upto):
+    """Применить версионированные миграции к узлу Config.NODE"""
+    if upto:
+        try:
+            marked = mark_applied(upto)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Отмечены применёнными: {", ".join(marked)}')
+        return
+    done = apply_migrations()
+    if done:
+        click.echo(f'Применены миграции: {", ".join(done)}')
+    else:
+        click.echo('Новых миграций нет')
+
+
+@click.command('check-plans')
+@click.option('--min-rows', default=10000, show_default=True,
+              help='Порог размера таблицы, с которого seq scan считается ошибкой')
+@with_appcontext
+def check_plans_command(min_rows):
+    """Проверить через EXPLAIN, что запросы маршрутов не сканируют крупные таблицы"""
+    problems = check_plans(min_rows)
+    for name, table, rows in problems:
+        click.echo(f'{name}: Seq Scan по {table} (~{rows} строк)')
+    if problems:
+        raise SystemExit(1)
+    click.echo('Планы запросов в порядке')
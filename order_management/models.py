@@ -1,7 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, date
+from routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Справочник категорий товаров
 class NSICategoryOfGoods(db.Model):
@@ -70,6 +71,8 @@ class Client(db.Model):
     phone_number = db.Column(db.String, unique=True, nullable=False)
     email = db.Column(db.String, unique=True, nullable=False)
     date_of_birth = db.Column(db.Date)
+    # Обновляется триггером при каждом изменении строки (миграция 014)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
     
     orders = db.relationship('Order', backref='client', lazy='dynamic')
 
@@ -108,17 +111,43 @@ class Order(db.Model):
     order_number = db.Column(db.String, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
     shop_id = db.Column(db.Integer, db.ForeignKey('shops.id'))
-    date_of_order = db.Column(db.Date)
+    # Ключ помесячного секционирования (миграция 007), поэтому обязателен и входит
+    # в первичный ключ: UPDATE и DELETE по ключу затрагивают одну секцию
+    date_of_order = db.Column(db.Date, primary_key=True)
     total_price = db.Column(db.Numeric)
     status = db.Column(db.String)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    # Обновляется триггером при каждом изменении строки (миграция 008)
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    
+    # Оптимистичная блокировка: UPDATE ... WHERE version = <прочитанная версия>
+    __mapper_args__ = {'version_id_col': version}
     
     shop = db.relationship('Shop', backref='orders')
-    receipt = db.relationship('Receipt', backref='order', uselist=False)
-    ordered_goods = db.relationship('OrderedGoods', backref='order', lazy='dynamic')
+    # Чек ищется через order_dates: по номеру и дате чека просматривается одна секция
+    receipt = db.relationship(
+        'Receipt', secondary='order_dates', uselist=False, viewonly=True,
+        primaryjoin='and_(Order.order_number == OrderDate.order_number, '
+                    'Order.date_of_order == OrderDate.date_of_order)',
+        secondaryjoin='and_(Receipt.receipt_number == OrderDate.receipt_number, '
+                      'Receipt.date_oforder == OrderDate.receipt_date)')
+    ordered_goods = db.relationship(
+        'OrderedGoods', backref='order', lazy='dynamic',
+        primaryjoin='and_(Order.order_number == foreign(OrderedGoods.order_id), '
+                    'Order.date_of_order == foreign(OrderedGoods.order_date))')
     
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
+# Номер заказа -> дата заказа и его чек (миграция 013); ведётся триггерами
+class OrderDate(db.Model):
+    __tablename__ = 'order_dates'
+    
+    order_number = db.Column(db.String, primary_key=True)
+    date_of_order = db.Column(db.Date, nullable=False)
+    receipt_number = db.Column(db.String, unique=True)
+    receipt_date = db.Column(db.Date)
+
 # Счета
 class Invoice(db.Model):
     __tablename__ = 'invoices'
@@ -131,6 +160,8 @@ class Invoice(db.Model):
     goodid = db.Column(db.Integer, db.ForeignKey('list_of_goods.id'))
     shop_id = db.Column(db.Integer, db.ForeignKey('shops.id'))
     status = db.Column(db.String)
+    # Количество поставленного товара (остатки, миграция 009)
+    quantity = db.Column(db.Integer)
     
     supply = db.relationship('SupplyFromWarehouse', backref='invoices')
     good = db.relationship('ListOfGoods', backref='invoices')
@@ -145,6 +176,8 @@ class OrderedGoods(db.Model):
     price_per_unit = db.Column(db.Numeric)
     subtotal = db.Column(db.Numeric)
     order_id = db.Column(db.String, db.ForeignKey('orders.order_number'), nullable=False)
+    # Дата заказа: позиция хранится в секции своего заказа
+    order_date = db.Column(db.Date, nullable=False)
     invoice_id = db.Column(db.String, db.ForeignKey('invoices.invoicenumber'), nullable=False)
     
     invoice = db.relationship('Invoice', backref='ordered_goods')
@@ -154,16 +187,23 @@ class Receipt(db.Model):
     __tablename__ = 'receipts'
     
     receipt_number = db.Column(db.String, primary_key=True)
-    date_oforder = db.Column(db.Date)
+    date_oforder = db.Column(db.Date, primary_key=True)
     total_price = db.Column(db.Numeric)
     payment_method = db.Column(db.String)
     shop_workerid = db.Column(db.Integer, db.ForeignKey('workers.id'))
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'))
-    orders_id = db.Column(db.String, db.ForeignKey('orders.order_number'), unique=True)
+    orders_id = db.Column(db.String, db.ForeignKey('orders.order_number'))
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    
+    __mapper_args__ = {'version_id_col': version}
     
     worker = db.relationship('Worker', backref='receipts')
     client = db.relationship('Client', backref='receipts')
-    receipt_positions = db.relationship('ReceiptPosition', backref='receipt', lazy='dynamic')
+    receipt_positions = db.relationship(
+        'ReceiptPosition', backref='receipt', lazy='dynamic',
+        primaryjoin='and_(Receipt.receipt_number == foreign(ReceiptPosition.receipt_id), '
+                    'Receipt.date_oforder == foreign(ReceiptPosition.receipt_date))')
     
     def __repr__(self):
         return f'<Receipt {self.receipt_number}>'
@@ -177,6 +217,8 @@ class ReceiptPosition(db.Model):
     price_per_unit = db.Column(db.Numeric)
     subtotal = db.Column(db.Numeric)
     receipt_id = db.Column(db.String, db.ForeignKey('receipts.receipt_number'), nullable=False)
+    # Дата чека: позиция хранится в секции своего чека
+    receipt_date = db.Column(db.Date, nullable=False)
     invoice_id = db.Column(db.String, db.ForeignKey('invoices.invoicenumber'), nullable=False)
     
     invoice = db.relationship('Invoice', backref='receipt_positions')
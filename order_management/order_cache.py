@@ -0,0 +1,136 @@
+from collections import namedtuple
+
+from flask import current_app, request, session
+from markupsafe import Markup
+from sqlalchemy import String, cast, event, func, literal_column, select
+from werkzeug.http import is_resource_modified
+
+from cache import LRUCache
+from models import db, Client, Order, OrderDate, Receipt, OrderedGoods
+from reference import reference_cache
+
+# Справочники, данные которых видны на страницах заказа
+CUSTOMER_REFERENCES = ('list_of_goods', 'workers')
+STAFF_REFERENCES = ('list_of_goods', 'workers', 'shops')
+
+# Отрисованные фрагменты просмотра заказа клиентом: {номер заказа: (etag, html)}
+fragment_cache = LRUCache()
+
+
+class OrderStamp(namedtuple('OrderStamp',
+                            'order_version receipt_version client_version references last_modified')):
+    """Версии заказа, его чека, клиента и показанных справочников"""
+
+    @property
+    def etag(self):
+        return '-'.join([f'o{self.order_version}', f'r{self.receipt_version or 0}',
+                         f'c{self.client_version}',
+                         *(str(v or 0) for v in self.references)])
+
+    def matches(self, order):
+        """Загруженный заказ той же версии, что и отметка"""
+        receipt_version = order.receipt.version if order.receipt else None
+        return order.version == self.order_version and receipt_version == self.receipt_version
+
+
+def _utc(column):
+    """TIMESTAMP в часовом поясе сервера как timestamptz (Last-Modified — в UTC)"""
+    return func.timezone(func.current_setting('TimeZone'), column)
+
+
+def order_stamp(order_number, references=()):
+    """Отметка заказа одним запросом; None, если заказа нет.
+
+    Номер и дата заказа и чека берутся из order_dates, и в Orders и Receipts
+    просматривается по одной секции.
+
+    Версия заказа растёт при любом сохранении, включая замену позиций и отмену,
+    версия чека — при изменении оплаты или сотрудника. Версия клиента — xmin его
+    строки: меняется при любом изменении контактов, показанных на странице.
+    """
+    row = db.session.execute(
+        select(Order.version, _utc(Order.updated_at), Receipt.version, _utc(Receipt.updated_at),
+               cast(literal_column('clients.xmin'), String), _utc(Client.updated_at))
+        .select_from(OrderDate)
+        .join(Order, (Order.order_number == OrderDate.order_number)
+              & (Order.date_of_order == OrderDate.date_of_order))
+        .join(Client, Client.id == Order.client_id)
+        .outerjoin(Receipt, (Receipt.receipt_number == OrderDate.receipt_number)
+                   & (Receipt.date_oforder == OrderDate.receipt_date))
+        .where(OrderDate.order_number == order_number)
+    ).first()
+    if row is None:
+        return None
+    order_version, order_updated, receipt_version, receipt_updated, client_version, client_updated = row
+    return OrderStamp(
+        order_version, receipt_version, client_version,
+        tuple(reference_cache.version(table) for table in references),
+        max(filter(None, (order_updated, receipt_updated, client_updated))),
+    )
+
+
+def conditional(response, stamp):
+    """Заголовки для условного GET; no-cache — браузер переспрашивает при каждом показе"""
+    response.set_etag(stamp.etag)
+    response.last_modified = stamp.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(stamp):
+    """Ответ 304, если у браузера актуальная страница, иначе None"""
+    # Непоказанные flash-сообщения должны попасть на новую страницу
+    if session.get('_flashes'):
+        return None
+    if is_resource_modified(request.environ, etag=stamp.etag, last_modified=stamp.last_modified):
+        return None
+    return conditional(current_app.response_class(status=304), stamp)
+
+
+def cached_fragment(order, stamp, render):
+    """Фрагмент страницы заказа из кэша или отрисованный render().
+
+    Запись годна, пока совпадает etag, поэтому изменения из других процессов и
+    с других узлов (по репликации) тоже учитываются. Фрагмент кэшируется, только
+    если заказ не изменился между отметкой и загрузкой.
+    """
+    cached = fragment_cache.get(order.order_number)
+    if cached is not None and cached[0] == stamp.etag:
+        return cached[1]
+    html = Markup(render())
+    if stamp.matches(order):
+        fragment_cache.set(order.order_number, (stamp.etag, html))
+    return html
+
+
+def _track_changes(session, flush_context, instances):
+    """Запоминаем в сессии заказы, изменённые через ORM"""
+    numbers = session.info.setdefault('order_cache_dirty', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Order):
+            numbers.add(obj.order_number)
+        elif isinstance(obj, Receipt):
+            numbers.add(obj.orders_id)
+        elif isinstance(obj, OrderedGoods):
+            numbers.add(obj.order_id)
+
+
+def _invalidate(session):
+    # Устаревшую запись отсеял бы и etag; удаление сразу освобождает память
+    for number in session.info.pop('order_cache_dirty', ()):
+        fragment_cache.pop(number)
+
+
+def _discard(session):
+    session.info.pop('order_cache_dirty', None)
+
+
+def init_order_cache(app):
+    """Размер кэша фрагментов и сброс записей при изменении заказов"""
+    fragment_cache.maxsize = app.config['ORDER_FRAGMENT_CACHE_SIZE']
+    fragment_cache.ttl = app.config['ORDER_FRAGMENT_CACHE_TTL']
+    if not event.contains(db.session, 'before_flush', _track_changes):
+        event.listen(db.session, 'before_flush', _track_changes)
+        event.listen(db.session, 'after_commit', _invalidate)
+        event.listen(db.session, 'after_rollback', _discard)
@@ -0,0 +1,323 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, delete, insert, select, tuple_, update
+from sqlalchemy.orm.exc import StaleDataError
+
+from ids import generate_order_number
+from models import (db, Order, OrderDate, Receipt, Client, Invoice, ListOfGoods,
+                    OrderedGoods, ReceiptPosition)
+
+# Статусы заказа из формы сотрудника (фильтр списка заказов)
+ORDER_STATUSES = ['Новый', 'Ожидает подтверждения', 'В обработке', 'Готов к выдаче', 'Выдан',
+                  'Отменен']
+
+# Статусы, в которых клиент может изменить или отменить заказ
+EDITABLE_STATUSES = ['Pending', 'Новый', 'Ожидает подтверждения']
+
+# Статусы, в которых сотрудник может удалить (отменить) заказ: товар ещё не выдан,
+# поэтому возврат оплаты и остатка при отмене верен. Выданный заказ не удаляется
+STAFF_CANCELLABLE_STATUSES = EDITABLE_STATUSES + ['В обработке', 'Готов к выдаче']
+
+# Отменённый заказ — мягко удалённый: его физически удаляет purge-orders
+CANCELLED = 'Отменен'
+
+
+CONFLICT_MESSAGE = ('Заказ был изменён другим пользователем. '
+                    'Проверьте актуальные данные и повторите изменения.')
+
+
+class OrderConflict(Exception):
+    """Заказ изменён другим пользователем после открытия формы"""
+
+
+def check_version(obj, submitted):
+    """Сверка версии из формы с текущей версией строки.
+
+    Отсутствующая или нечитаемая версия — тоже конфликт: форма заказа всегда
+    её отправляет, а без неё правка могла бы затереть чужие изменения.
+    """
+    try:
+        version = int(submitted)
+    except (TypeError, ValueError):
+        raise OrderConflict(CONFLICT_MESSAGE)
+    if version != obj.version:
+        raise OrderConflict(CONFLICT_MESSAGE)
+
+
+def order_key(order_number):
+    """Условие на заказ по номеру с датой из order_dates.
+
+    Дата — ключ секционирования: подзапрос вычисляется до чтения Orders, и
+    запрос просматривает одну секцию вместо индекса каждого месяца.
+    """
+    order_date = (select(OrderDate.date_of_order)
+                  .where(OrderDate.order_number == order_number).scalar_subquery())
+    return and_(Order.order_number == order_number, Order.date_of_order == order_date)
+
+
+def receipt_key(order_number):
+    """Условие на чек заказа: номер и дата чека из order_dates"""
+    def link(column):
+        return select(column).where(OrderDate.order_number == order_number).scalar_subquery()
+    return and_(Receipt.receipt_number == link(OrderDate.receipt_number),
+                Receipt.date_oforder == link(OrderDate.receipt_date))
+
+
+def get_order_or_404(order_number):
+    """Заказ по номеру (одна секция) или 404"""
+    return Order.query.filter(order_key(order_number)).first_or_404()
+
+
+def cancel_order(order_number, from_statuses=None):
+    """Отмена одним условным UPDATE: без гонки между проверкой статуса и записью.
+
+    Без from_statuses отменяется заказ в любом статусе, кроме уже отменённого.
+    """
+    if from_statuses is None:
+        allowed = Order.status.is_distinct_from(CANCELLED)
+    else:
+        allowed = Order.status.in_(from_statuses)
+    result = db.session.execute(
+        update(Order)
+        .where(order_key(order_number), allowed)
+        .values(status=CANCELLED, version=Order.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    db.session.execute(
+        update(Receipt)
+        .where(receipt_key(order_number))
+        .values(payment_method='Возврат', version=Receipt.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def delete_orders(order_numbers):
+    """Удаление заказов вместе с чеками и позициями: по одному DELETE на таблицу.
+
+    Сначала удаляются позиции, затем чеки и заказы (внешние ключи без каскада).
+    Позиции заказа удаляются, пока заказ ещё есть: триггер остатков смотрит его
+    статус, и позиции отменённого заказа остаток повторно не возвращают.
+    Ключи берутся из order_dates, и каждый DELETE ищет строки только в секциях
+    нужных дат.
+    """
+    numbers = list(order_numbers)
+    if not numbers:
+        return 0
+    links = db.session.execute(
+        select(OrderDate.order_number, OrderDate.date_of_order,
+               OrderDate.receipt_number, OrderDate.receipt_date)
+        .where(OrderDate.order_number.in_(numbers))
+    ).all()
+    if not links:
+        return 0
+    order_keys = [(link.order_number, link.date_of_order) for link in links]
+    receipt_keys = [(link.receipt_number, link.receipt_date) for link in links
+                    if link.receipt_number is not None]
+    receipts = Receipt.__table__
+    positions = ReceiptPosition.__table__
+    items = OrderedGoods.__table__
+    orders = Order.__table__
+    if receipt_keys:
+        db.session.execute(delete(positions).where(
+            tuple_(positions.c.receipt_id, positions.c.receipt_date).in_(receipt_keys)))
+    db.session.execute(delete(items).where(
+        tuple_(items.c.order_id, items.c.order_date).in_(order_keys)))
+    if receipt_keys:
+        db.session.execute(delete(receipts).where(
+            tuple_(receipts.c.receipt_number, receipts.c.date_oforder).in_(receipt_keys)))
+    return db.session.execute(delete(orders).where(
+        tuple_(orders.c.order_number, orders.c.date_of_order).in_(order_keys))).rowcount
+
+
+def filter_orders(args):
+    """Запрос заказов с фильтрами из параметров запроса"""
+    status_filter = args.get('status', 'all')
+    shop_filter = args.get('shop', 'all')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    
+    query = Order.query
+    
+    # Фильтр по статусу
+    if status_filter != 'all':
+        query = query.filter_by(status=status_filter)
+    
+    # Фильтр по магазину
+    if shop_filter != 'all':
+        query = query.filter_by(shop_id=int(shop_filter))
+    
+    # Фильтр по дате
+    if date_from:
+        query = query.filter(Order.date_of_order >= datetime.strptime(date_from, '%Y-%m-%d').date())
+    if date_to:
+        query = query.filter(Order.date_of_order <= datetime.strptime(date_to, '%Y-%m-%d').date())
+    
+    return query
+
+
+def parse_items(form):
+    """Пары (id товара, количество) из полей good_id/quantity формы"""
+    goods_ids = form.getlist('good_id')
+    quantities = form.getlist('quantity')
+    if len(goods_ids) != len(quantities):
+        raise ValueError('Некорректный состав заказа')
+
+    items = {}
+    for good_id, quantity in zip(goods_ids, quantities):
+        if not good_id:
+            continue
+        quantity = int(quantity)
+        if quantity < 0:
+            raise ValueError('Количество товара не может быть отрицательным')
+        if quantity == 0:
+            # Нулевое количество означает удаление позиции
+            continue
+        # Повторяющиеся строки одного товара объединяются
+        items[int(good_id)] = items.get(int(good_id), 0) + quantity
+    return items
+
+
+def build_line_items(shop_id, items):
+    """Цены и накладные для позиций заказа; итог считается на сервере.
+
+    Два запроса на заказ независимо от числа позиций: цены товаров и
+    последняя полученная магазином накладная по каждому товару. Позиции
+    упорядочены по ключу остатка (магазин накладной, товар) — в том же порядке
+    строки stock_balances блокируют отмена заказа и availability(lock=True).
+    """
+    if not items:
+        return [], Decimal('0')
+
+    prices = dict(db.session.execute(
+        select(ListOfGoods.id, ListOfGoods.price).where(ListOfGoods.id.in_(items))
+    ).all())
+
+    invoice_query = (
+        select(Invoice.goodid, Invoice.invoicenumber, Invoice.shop_id)
+        .where(Invoice.goodid.in_(items), Invoice.receipt_date.isnot(None))
+        .distinct(Invoice.goodid)
+        .order_by(Invoice.goodid, Invoice.receipt_date.desc())
+    )
+    if shop_id is not None:
+        invoice_query = invoice_query.where(Invoice.shop_id == shop_id)
+    invoices = {good_id: (number, shop) for good_id, number, shop
+                in db.session.execute(invoice_query).all()}
+
+    lines = []
+    total = Decimal('0')
+    def balance_key(good_id):
+        # Товар без накладной отклоняется ниже, его место в порядке не важно
+        return invoices.get(good_id, (None, None))[1] or 0, good_id
+
+    for good_id in sorted(items, key=balance_key):
+        quantity = items[good_id]
+        if good_id not in prices:
+            raise ValueError(f'Товар {good_id} не найден')
+        if good_id not in invoices:
+            raise ValueError(f'Нет поступившей накладной на товар {good_id}')
+        price = Decimal(prices[good_id] or 0)
+        subtotal = price * quantity
+        total += subtotal
+        lines.append({
+            'quantity': quantity,
+            'price_per_unit': price,
+            'subtotal': subtotal,
+            'invoice_id': invoices[good_id][0]
+        })
+    return lines, total
+
+
+def write_line_items(order, receipt, lines):
+    """Вставка позиций заказа и чека: по одному executemany на таблицу.
+
+    Позиции получают дату заказа/чека — по ней они попадают в секцию родителя.
+    Порядок строк сохраняется: триггеры остатков блокируют строки stock_balances
+    в порядке вставки, и позиции из build_line_items (по магазину и товару) не
+    дают взаимной блокировки с отменой и проверкой остатков.
+    """
+    if not lines:
+        return
+    db.session.execute(insert(OrderedGoods.__table__),
+                       [dict(line, order_id=order.order_number, order_date=order.date_of_order)
+                        for line in lines])
+    if receipt is not None:
+        db.session.execute(insert(ReceiptPosition.__table__),
+                           [dict(line, receipt_id=receipt.receipt_number,
+                                 receipt_date=receipt.date_oforder)
+                            for line in lines])
+
+
+def replace_line_items(order, receipt, lines):
+    """Замена состава заказа: удаление старых позиций одним DELETE и вставка новых"""
+    items = OrderedGoods.__table__
+    positions = ReceiptPosition.__table__
+    db.session.execute(delete(items).where(items.c.order_id == order.order_number,
+                                           items.c.order_date == order.date_of_order))
+    if receipt is not None:
+        db.session.execute(delete(positions).where(positions.c.receipt_id == receipt.receipt_number,
+                                                   positions.c.receipt_date == receipt.date_oforder))
+    write_line_items(order, receipt, lines)
+
+
+@click.command('stress-edits')
+@click.option('--threads', default=16, show_default=True)
+@click.option('--iterations', default=25, show_default=True, help='Изменений на поток')
+@with_appcontext
+def stress_edits_command(threads, iterations):
+    """Проверить под параллельной нагрузкой, что изменения заказа не теряются"""
+    app = current_app._get_current_object()
+    client = Client.query.first()
+    if client is None:
+        raise click.ClickException('Нужен хотя бы один клиент в базе')
+
+    edited, cancelled = generate_order_number(), generate_order_number()
+    today = date.today()
+    for number in (edited, cancelled):
+        db.session.add(Order(order_number=number, client_id=client.id, date_of_order=today,
+                             total_price=Decimal('0'), status='Новый'))
+    db.session.commit()
+
+    def increment():
+        retries = 0
+        with app.app_context():
+            for _ in range(iterations):
+                while True:
+                    order = db.session.get(Order, (edited, today))
+                    order.total_price += 1
+                    try:
+                        db.session.commit()
+                        break
+                    except StaleDataError:
+                        db.session.rollback()
+                        retries += 1
+        return retries
+
+    def cancel():
+        with app.app_context():
+            done = cancel_order(cancelled, EDITABLE_STATUSES)
+            db.session.commit()
+            return done
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        retries = sum(pool.map(lambda _: increment(), range(threads)))
+        cancels = sum(pool.map(lambda _: cancel(), range(threads)))
+
+    total = db.session.get(Order, (edited, today), populate_existing=True).total_price
+    db.session.execute(delete(Order).where(Order.order_number.in_([edited, cancelled]),
+                                          Order.date_of_order == today))
+    db.session.commit()
+
+    expected = threads * iterations
+    click.echo(f'Итог: {total} (ожидалось {expected}), повторов из-за конфликтов: {retries}, '
+               f'успешных отмен: {cancels} (ожидалась 1)')
+    if total != expected or cancels != 1:
+        raise SystemExit(1)
+
@@ -0,0 +1,83 @@
+import base64
+from datetime import date
+
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Order
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(order):
+    """Курсор последней строки страницы: (date_of_order, order_number); пустая дата — NULL"""
+    order_date = order.date_of_order.isoformat() if order.date_of_order else ''
+    raw = f'{order_date}|{order.order_number}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Разбор курсора; некорректный курсор означает первую страницу"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        order_date, order_number = raw.split('|', 1)
+        return (date.fromisoformat(order_date) if order_date else None), order_number
+    except (ValueError, UnicodeError):
+        return None
+
+
+def estimate_count(query):
+    """Оценка числа строк по плану запроса (без полного COUNT(*))"""
+    statement = query.order_by(None).statement
+    compiled = statement.compile(dialect=db.engine.dialect)
+    result = db.session.connection().exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+    ).scalar()
+    return int(result[0]['Plan']['Plan Rows'])
+
+
+def paginate_orders(query, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Страница заказов по ключу (date_of_order, order_number) с подгрузкой связей"""
+    try:
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        limit = DEFAULT_PAGE_SIZE
+
+    page_query = query.options(
+        joinedload(Order.client),
+        joinedload(Order.shop),
+        joinedload(Order.receipt),
+    )
+
+    position = decode_cursor(cursor) if cursor else None
+    if position and position[0] is None:
+        # Заказы без даты (до миграции 007) идут первыми, как в индексе с DESC (NULLS FIRST)
+        page_query = page_query.filter(or_(
+            and_(Order.date_of_order.is_(None), Order.order_number < position[1]),
+            Order.date_of_order.isnot(None),
+        ))
+    elif position:
+        page_query = page_query.filter(
+            tuple_(Order.date_of_order, Order.order_number) < position
+        )
+
+    rows = page_query.order_by(
+        Order.date_of_order.desc().nulls_first(), Order.order_number.desc()
+    ).limit(limit + 1).all()
+
+    has_next = len(rows) > limit
+    orders = rows[:limit]
+    next_cursor = encode_cursor(orders[-1]) if has_next else None
+
+    # Если первая страница неполная, точное число уже известно
+    if not position and not has_next:
+        total_estimate = len(orders)
+    else:
+        total_estimate = estimate_count(query)
+
+    return {
+        'orders': orders,
+        'next_cursor': next_cursor,
+        'total_estimate': total_estimate,
+    }
@@ -0,0 +1,341 @@
+import os
+import re
+from collections import defaultdict
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, text
+
+from models import db, Client, Invoice, ListOfGoods
+from stock import ARCHIVE_MOVEMENTS
+
+# Секционированные по месяцам таблицы (миграция 007) и их ключи. Позиции идут
+# раньше родителей: секцию заказа или чека можно отсоединить, только когда
+# на её строки больше не ссылаются позиции
+PARTITIONED = {
+    'ordered_goods': 'order_date',
+    'receipt_positions': 'receipt_date',
+    'orders': 'date_of_order',
+    'receipts': 'date_oforder',
+}
+
+# Строк, читаемых с серверного курсора за раз при выгрузке секции
+ARCHIVE_BATCH = 10000
+
+
+def month_start(day, shift=0):
+    """Первое число месяца day, сдвинутого на shift месяцев"""
+    months = day.year * 12 + day.month - 1 + shift
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partitions(table):
+    """Месячные секции таблицы: {первое число месяца: имя секции}"""
+    names = db.session.execute(text('''
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+    '''), {'table': table}).scalars()
+    result = {}
+    for name in names:
+        match = re.fullmatch(rf'{table}_p(\d{{4}})(\d{{2}})', name)
+        if match:
+            result[date(int(match[1]), int(match[2]), 1)] = name
+    return result
+
+
+def ensure_partitions(months_ahead):
+    """Секции с текущего месяца на months_ahead месяцев вперёд"""
+    until = month_start(date.today(), months_ahead + 1)
+    created = 0
+    for table in PARTITIONED:
+        created += db.session.execute(
+            text('SELECT create_month_partitions(CAST(:table AS regclass), current_date, :until)'),
+            {'table': table, 'until': until}
+        ).scalar()
+    db.session.commit()
+    return created
+
+
+def default_rows():
+    """Строки в секциях DEFAULT — с датами, для которых нет месячной секции"""
+    return {table: db.session.execute(text(f'SELECT count(*) FROM {table}_default')).scalar()
+            for table in PARTITIONED}
+
+
+def freeze_month(month):
+    """VACUUM FREEZE секций закрытого месяца.
+
+    Старые секции больше не меняются, поэтому после заморозки автоочистка
+    пропускает их страницы и работает только со свежими секциями.
+    """
+    names = [partitions(table).get(month) for table in PARTITIONED]
+    db.session.commit()
+    # VACUUM не выполняется внутри транзакции
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.exec_driver_sql('SET statement_timeout = 0')
+        for name in filter(None, names):
+            conn.exec_driver_sql(f'VACUUM (FREEZE, ANALYZE) {name}')
+    return [name for name in names if name]
+
+
+def archive_path(directory, table, month):
+    """Файл архива: у каждого узла свой подкаталог"""
+    return os.path.join(directory, current_app.config['NODE'], table, f'{month:%Y-%m}.parquet')
+
+
+def _arrow_schema(conn, table):
+    """Схема Parquet по столбцам таблицы"""
+    import pyarrow as pa
+
+    types = {
+        'smallint': pa.int16(),
+        'integer': pa.int32(),
+        'bigint': pa.int64(),
+        'numeric': pa.decimal128(38, 10),
+        'character varying': pa.string(),
+        'text': pa.string(),
+        'date': pa.date32(),
+        'timestamp without time zone': pa.timestamp('us'),
+        'boolean': pa.bool_(),
+    }
+    columns = conn.execute(text('''
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table
+        ORDER BY ordinal_position
+    '''), {'table': table}).all()
+    return pa.schema([(name, types[data_type]) for name, data_type in columns])
+
+
+def _write_parquet(conn, partition, schema, path):
+    """Потоковая выгрузка секции в Parquet (zstd); возвращает число строк"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    result = conn.execution_options(stream_results=True, yield_per=ARCHIVE_BATCH).execute(
+        text(f'SELECT {", ".join(schema.names)} FROM {partition}')
+    )
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in result.partitions():
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows += len(batch)
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+    return rows
+
+
+def _fsync_dir(directory):
+    """Переименование файла переживает сбой только после fsync каталога"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def archive_month(month, directory):
+    """Выгрузка месяца всех четырёх таблиц в Parquet и удаление его секций.
+
+    Всё выполняется в одной транзакции. Сначала под SHARE-блокировками самих
+    секций (закрыты для записи, остальные месяцы работают как обычно)
+    выгружаются все файлы. Затем DETACH и DROP всех секций: DETACH берёт
+    ACCESS EXCLUSIVE на родительские таблицы, поэтому этот шаг последний и
+    короткий, а ожидание блокировки ограничено ARCHIVE_LOCK_TIMEOUT_MS.
+    Файлы сохраняются на диск и получают окончательные имена до фиксации,
+    поэтому после сбоя в любой момент месяц есть либо в базе, либо в архиве
+    (лишний файл при оставшихся секциях перезапишет следующий запуск).
+    Удаление секции не вызывает строковых триггеров, поэтому агрегаты продаж и
+    лента не меняются; расход остатков месяца сохраняется в archived_stock для
+    сверки остатков.
+    """
+    conn = db.session.connection()
+    written = []
+    exported = []
+    committing = False
+    try:
+        # Выгрузка месяца дольше обычного таймаута запросов приложения
+        conn.execute(text('SET LOCAL statement_timeout = 0'))
+        for table in PARTITIONED:
+            partition = partitions(table).get(month)
+            if partition is None:
+                continue
+            conn.execute(text(f'LOCK TABLE {partition} IN SHARE MODE'))
+            path = archive_path(directory, table, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            written.append(path)
+            rows = _write_parquet(conn, partition, _arrow_schema(conn, table), path + '.tmp')
+            exported.append((table, partition, path, rows))
+        # DROP TABLE не вызывает триггеры: записи order_dates месяца удаляются здесь,
+        # а его расход остатков сохраняется для stock-reconcile
+        bounds = {'month': month, 'next_month': month_start(month, 1)}
+        conn.execute(ARCHIVE_MOVEMENTS, bounds)
+        conn.execute(text('''
+            DELETE FROM order_dates WHERE date_of_order >= :month AND date_of_order < :next_month
+        '''), bounds)
+
+        conn.execute(text(f"SET LOCAL lock_timeout = '{current_app.config['ARCHIVE_LOCK_TIMEOUT_MS']}ms'"))
+        for table, partition, path, rows in exported:
+            conn.execute(text(f'ALTER TABLE {table} DETACH PARTITION {partition}'))
+            conn.execute(text(f'DROP TABLE {partition}'))
+            conn.execute(text('''
+                INSERT INTO archived_partitions (table_name, month, path, row_count)
+                VALUES (:table, :month, :path, :rows)
+            '''), {'table': table, 'month': month, 'path': path, 'rows': rows})
+        for path in written:
+            os.replace(path + '.tmp', path)
+            _fsync_dir(os.path.dirname(path))
+        committing = True
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # При ошибке самой фиксации неизвестно, удалены ли секции: файлы остаются
+        if not committing:
+            for path in written:
+                for leftover in (path + '.tmp', path):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+        raise
+    return written
+
+
+def archive(keep_months, directory):
+    """Архивирование всех месяцев старше keep_months полных месяцев"""
+    cutoff = month_start(date.today(), -keep_months)
+    months = sorted({m for table in PARTITIONED for m in partitions(table) if m < cutoff})
+    db.session.commit()
+    return {month: archive_month(month, directory) for month in months}
+
+
+def _archived_files(date_from, date_to):
+    """Файлы архива по месяцам (новые первыми): {месяц: {таблица: путь}}"""
+    rows = db.session.execute(text('''
+        SELECT month, table_name, path FROM archived_partitions
+        WHERE (CAST(:date_from AS DATE) IS NULL OR month >= date_trunc('month', CAST(:date_from AS DATE)))
+          AND (CAST(:date_to AS DATE) IS NULL OR month <= CAST(:date_to AS DATE))
+        ORDER BY month DESC
+    '''), {'date_from': date_from, 'date_to': date_to}).all()
+    files = defaultdict(dict)
+    for month, table, path in rows:
+        files[month][table] = path
+    return files
+
+
+def _read(path, filters):
+    import pyarrow.parquet as pq
+
+    if path is None or not os.path.exists(path):
+        return []
+    return pq.read_table(path, filters=filters or None).to_pylist()
+
+
+def archive_rows(args):
+    """Строки выгрузки из архива в формате export.export_statement.
+
+    Фильтры те же, что у списка заказов; клиенты и товары берутся из базы
+    (справочники не архивируются). Чек ищется в архиве того же месяца.
+    """
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+    date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+
+    filters = []
+    if args.get('status', 'all') != 'all':
+        filters.append(('status', '=', args['status']))
+    if args.get('shop', 'all') != 'all':
+        filters.append(('shop_id', '=', int(args['shop'])))
+    if date_from:
+        filters.append(('date_of_order', '>=', date_from))
+    if date_to:
+        filters.append(('date_of_order', '<=', date_to))
+
+    for month, paths in _archived_files(date_from, date_to).items():
+        orders = _read(paths.get('orders'), filters)
+        if not orders:
+            continue
+        numbers = [o['order_number'] for o in orders]
+        receipts = {r['orders_id']: r
+                    for r in _read(paths.get('receipts'), [('orders_id', 'in', numbers)])}
+        items = defaultdict(list)
+        for item in _read(paths.get('ordered_goods'), [('order_id', 'in', numbers)]):
+            items[item['order_id']].append(item)
+
+        clients = {c.id: c for c in db.session.execute(
+            select(Client.id, Client.name, Client.email, Client.phone_number)
+            .where(Client.id.in_({o['client_id'] for o in orders}))
+        )}
+        goods = {g.invoicenumber: g for g in db.session.execute(
+            select(Invoice.invoicenumber, ListOfGoods.id, ListOfGoods.name)
+            .join(ListOfGoods, ListOfGoods.id == Invoice.goodid)
+            .where(Invoice.invoicenumber.in_({i['invoice_id'] for v in items.values() for i in v}))
+        )}
+
+        orders.sort(key=lambda o: (o['date_of_order'], o['order_number']), reverse=True)
+        for order in orders:
+            client = clients.get(order['client_id'])
+            receipt = receipts.get(order['order_number'], {})
+            row = {
+                'order_number': order['order_number'],
+                'date_of_order': order['date_of_order'],
+                'status': order['status'],
+                'shop_id': order['shop_id'],
+                'total_price': order['total_price'],
+                'client_id': order['client_id'],
+                'client_name': client.name if client else None,
+                'client_email': client.email if client else None,
+                'client_phone': client.phone_number if client else None,
+                'receipt_number': receipt.get('receipt_number'),
+                'receipt_date': receipt.get('date_oforder'),
+                'payment_method': receipt.get('payment_method'),
+                'worker_id': receipt.get('shop_workerid'),
+            }
+            lines = sorted(items.get(order['order_number'], []), key=lambda i: i['id'])
+            if not lines:
+                yield dict(row, item_id=None, quantity=None, price_per_unit=None, subtotal=None,
+                           invoice_id=None, good_id=None, good_name=None)
+            for item in lines:
+                good = goods.get(item['invoice_id'])
+                yield dict(row,
+                           item_id=item['id'],
+                           quantity=item['quantity'],
+                           price_per_unit=item['price_per_unit'],
+                           subtotal=item['subtotal'],
+                           invoice_id=item['invoice_id'],
+                           good_id=good.id if good else None,
+                           good_name=good.name if good else None)
+
+
+@click.command('partitions-maintain')
+@click.option('--ahead', default=None, type=int, help='Месяцев вперёд (по умолчанию PARTITION_MONTHS_AHEAD)')
+@with_appcontext
+def partitions_maintain_command(ahead):
+    """Создать секции на будущие месяцы и заморозить секции прошлого месяца"""
+    if ahead is None:
+        ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    click.echo(f'Создано секций: {ensure_partitions(ahead)}')
+    frozen = freeze_month(month_start(date.today(), -1))
+    if frozen:
+        click.echo(f'Заморожены: {", ".join(frozen)}')
+    for table, count in default_rows().items():
+        if count:
+            click.echo(f'{table}_default: {count} строк вне месячных секций', err=True)
+
+
+@click.command('partitions-archive')
+@click.option('--keep-months', default=None, type=int,
+              help='Сколько полных месяцев оставить в базе (по умолчанию ARCHIVE_KEEP_MONTHS)')
+@click.option('--dir', 'directory', default=None, help='Каталог архива (по умолчанию ARCHIVE_DIR)')
+@with_appcontext
+def partitions_archive_command(keep_months, directory):
+    """Выгрузить старые месяцы в Parquet и удалить их секции"""
+    if keep_months is None:
+        keep_months = current_app.config['ARCHIVE_KEEP_MONTHS']
+    directory = directory or current_app.config['ARCHIVE_DIR']
+    for month, paths in archive(keep_months, directory).items():
+        click.echo(f'{month:%Y-%m}: {", ".join(paths)}')
@@ -0,0 +1,296 @@
+import time
+from datetime import date, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db
+from routing import MASTER_BIND
+
+SEASON_WEEKS = 52
+
+CATALOGUE = text('''
+    SELECT (SELECT array_agg(id ORDER BY id) FROM shops),
+           array_agg(id ORDER BY id), array_agg(COALESCE(price, 0) ORDER BY id)
+    FROM list_of_goods
+''')
+
+# Продажи по неделям (0 — последняя полная неделя) одним запросом, столбцами-массивами.
+# Магазин и товар позиции — из её накладной, как у остатков (stock.py)
+SALES = text('''
+    SELECT array_agg(shop_id), array_agg(good_id), array_agg(weeks_ago), array_agg(quantity)
+    FROM (
+        SELECT i.shop_id, i.goodid AS good_id, (:end - og.order_date) / 7 AS weeks_ago,
+               sum(og.quantity) AS quantity
+        FROM ordered_goods og
+        JOIN invoices i ON i.invoicenumber = og.invoice_id
+        JOIN orders o ON o.order_number = og.order_id AND o.date_of_order = og.order_date
+        WHERE og.order_date > :end - 7 * CAST(:weeks AS INT) AND og.order_date <= :end
+          AND o.status IS DISTINCT FROM 'Отменен'
+          AND i.shop_id IS NOT NULL AND i.goodid IS NOT NULL
+        GROUP BY 1, 2, 3
+    ) s
+''')
+
+# Первый день истории, ещё не выгруженной в архив (partitions.archive_month):
+# архивные месяцы читаются как нулевые продажи
+HISTORY_START = text('''
+    SELECT (max(month) + INTERVAL '1 month')::date FROM archived_partitions
+    WHERE table_name = 'ordered_goods'
+''')
+
+# Остаток и товар в пути (отправленные, но не принятые накладные). Черновики
+# не отправлены и в пути не считаются: новый план заменяет их (CLEAR_DRAFTS)
+POSITIONS = text('''
+    SELECT array_agg(shop_id), array_agg(good_id), array_agg(available), array_agg(inbound)
+    FROM (
+        SELECT shop_id, good_id, sum(available) AS available, sum(inbound) AS inbound
+        FROM (
+            SELECT shop_id, good_id, available, 0 AS inbound FROM stock_balances
+            UNION ALL
+            SELECT shop_id, goodid, 0, COALESCE(quantity, 0) FROM invoices
+            WHERE receipt_date IS NULL AND shop_id IS NOT NULL AND goodid IS NOT NULL
+              AND status IS DISTINCT FROM 'draft'
+        ) p
+        GROUP BY 1, 2
+    ) s
+''')
+
+# Склад и поставка последней накладной по паре (магазин, товар)
+SOURCES = text('''
+    SELECT array_agg(shop_id), array_agg(good_id), array_agg(supply_id), array_agg(warehouse_id)
+    FROM (
+        SELECT DISTINCT ON (i.shop_id, i.goodid) i.shop_id, i.goodid AS good_id,
+               i.supply_id, s.warehouse_id
+        FROM invoices i
+        JOIN supplies_from_warehouse s ON s.serial_id = i.supply_id
+        WHERE i.shop_id IS NOT NULL AND i.goodid IS NOT NULL AND s.warehouse_id IS NOT NULL
+          AND i.status IS DISTINCT FROM 'draft'
+        ORDER BY i.shop_id, i.goodid, i.dispatch_date DESC
+    ) s
+''')
+
+LATEST_SUPPLY = text('''
+    SELECT serial_id, warehouse_id FROM supplies_from_warehouse
+    WHERE warehouse_id IS NOT NULL
+    ORDER BY delivery_date DESC, serial_id DESC
+    LIMIT 1
+''')
+
+# Неотправленные черновики этого и прошлых планов: их потребность пересчитана заново
+CLEAR_DRAFTS = text("DELETE FROM invoices WHERE status = 'draft' AND dispatch_date <= :plan_date")
+
+INSERT_DRAFTS = text('''
+    INSERT INTO invoices (invoicenumber, total_price, dispatch_date, receipt_date,
+                          supply_id, goodid, shop_id, status, quantity)
+    SELECT 'DRAFT-' || to_char(CAST(:plan_date AS DATE), 'YYYYMMDD') || '-' || shop_id || '-' || good_id,
+           price * quantity, :plan_date, NULL, supply_id, good_id, shop_id, 'draft', quantity
+    FROM unnest(CAST(:shops AS INT[]), CAST(:goods AS INT[]), CAST(:quantities AS INT[]),
+                CAST(:prices AS NUMERIC[]), CAST(:supplies AS INT[]))
+         AS d(shop_id, good_id, quantity, price, supply_id)
+''')
+
+
+def _columns(conn, statement, params, dtypes):
+    """Однострочный результат из массивов — в массивы NumPy (пустые, если строк нет)"""
+    row = conn.execute(statement, params).one()
+    return [np.asarray(values or [], dtype=dtype) for values, dtype in zip(row, dtypes)]
+
+
+def _scatter(shop_ids, good_ids, shops, goods, values, shape_tail=(), extra=None):
+    """Плотная матрица [магазин, товар(, неделя)] из столбцов (id, id, значение)"""
+    shape = (len(shop_ids), len(good_ids)) + tuple(shape_tail)
+    if not len(shop_ids) or not len(good_ids):
+        return np.zeros(shape)
+    si = np.searchsorted(shop_ids, shops)
+    gi = np.searchsorted(good_ids, goods)
+    # Пары с id вне каталога (например, удалённый товар) отбрасываются
+    known = ((si < len(shop_ids)) & (shop_ids[np.minimum(si, len(shop_ids) - 1)] == shops)
+             & (gi < len(good_ids)) & (good_ids[np.minimum(gi, len(good_ids) - 1)] == goods))
+    flat = si[known] * len(good_ids) + gi[known]
+    size = len(shop_ids) * len(good_ids)
+    if extra is not None:
+        width = shape_tail[0]
+        flat = flat * width + extra[known]
+        size *= width
+    matrix = np.bincount(flat, weights=values[known], minlength=size)
+    return matrix.reshape(shape)
+
+
+def sales_matrix(shop_ids, good_ids, shops, goods, weeks_ago, quantities, weeks):
+    """Продажи [магазин, товар, неделя]; последний столбец — последняя полная неделя"""
+    inside = (weeks_ago >= 0) & (weeks_ago < weeks)
+    return _scatter(shop_ids, good_ids, shops[inside], goods[inside],
+                    quantities[inside].astype(np.float64), (weeks,),
+                    extra=weeks - 1 - weeks_ago[inside])
+
+
+def forecast(sales, window, horizon):
+    """Недельный спрос и его разброс по всем парам сразу.
+
+    Базовый уровень — скользящее среднее за window недель. Если истории хватает
+    на год назад, он умножается на сезонный коэффициент: во сколько раз продажи
+    тех же horizon недель прошлого года отличались от уровня перед ними
+    (коэффициент ограничен 0.5..2, без продаж в прошлом году — 1).
+    """
+    recent = sales[..., -window:]
+    level = recent.mean(axis=-1)
+    sigma = recent.std(axis=-1)
+    weeks = sales.shape[-1]
+    factor = np.ones_like(level)
+    if weeks >= SEASON_WEEKS + window:
+        start = weeks - SEASON_WEEKS
+        before = sales[..., start - window:start].mean(axis=-1)
+        after = sales[..., start:start + horizon].mean(axis=-1)
+        np.divide(after, before, out=factor, where=before > 0)
+        np.clip(factor, 0.5, 2.0, out=factor)
+    return level * factor, sigma
+
+
+def reorder_quantities(weekly, sigma, position, lead_weeks, review_weeks, service_z):
+    """Заказ до уровня пополнения, если запас с учётом товара в пути ниже точки заказа"""
+    safety = service_z * sigma * np.sqrt(lead_weeks)
+    reorder_point = weekly * lead_weeks + safety
+    target = weekly * (lead_weeks + review_weeks) + safety
+    quantity = np.where(position < reorder_point, np.ceil(target - position), 0)
+    return np.maximum(quantity, 0).astype(np.int64)
+
+
+def plan(plan_date, window=8, lead_weeks=1, review_weeks=1, service_z=1.65):
+    """План пополнения на plan_date: матрицы и количество к отгрузке [магазин, товар]"""
+    horizon = lead_weeks + review_weeks
+    weeks = SEASON_WEEKS + window
+    end = plan_date - timedelta(days=1)
+    conn = db.session.connection()
+    # Сезонная база в архиве — без сезонного коэффициента (forecast берёт 1)
+    history_start = conn.execute(HISTORY_START).scalar()
+    if history_start is not None and end - timedelta(weeks=weeks, days=-1) < history_start:
+        weeks = window
+    shop_ids, good_ids, prices = _columns(conn, CATALOGUE, {}, (np.int64, np.int64, np.float64))
+    shops, goods, weeks_ago, quantities = _columns(
+        conn, SALES, {'end': end, 'weeks': weeks}, (np.int64,) * 4)
+    p_shops, p_goods, available, inbound = _columns(conn, POSITIONS, {}, (np.int64,) * 4)
+    s_shops, s_goods, supplies, warehouses = _columns(conn, SOURCES, {}, (np.int64,) * 4)
+    fallback = conn.execute(LATEST_SUPPLY).first()
+    db.session.commit()
+
+    sales = sales_matrix(shop_ids, good_ids, shops, goods, weeks_ago, quantities, weeks)
+    weekly, sigma = forecast(sales, window, horizon)
+    position = _scatter(shop_ids, good_ids, p_shops, p_goods, (available + inbound).astype(np.float64))
+    quantity = reorder_quantities(weekly, sigma, position, lead_weeks, review_weeks, service_z)
+
+    # Источник: склад последней накладной пары, иначе склад последней поставки (0 — нет)
+    supply = _scatter(shop_ids, good_ids, s_shops, s_goods, supplies.astype(np.float64)).astype(np.int64)
+    warehouse = _scatter(shop_ids, good_ids, s_shops, s_goods, warehouses.astype(np.float64)).astype(np.int64)
+    if fallback is not None:
+        missing = supply == 0
+        supply[missing] = fallback.serial_id
+        warehouse[missing] = fallback.warehouse_id
+    quantity[supply == 0] = 0
+
+    return {
+        'shop_ids': shop_ids, 'good_ids': good_ids, 'prices': prices,
+        'weekly': weekly, 'position': position, 'quantity': quantity,
+        'supply': supply, 'warehouse': warehouse,
+    }
+
+
+def emit_drafts(result, plan_date):
+    """Черновики накладных (status='draft') на узле administration.
+
+    Накладные — данные узла administration, оттуда они по rpc_pub приходят на
+    склады и в магазины. План заменяет свои черновики и неотправленные
+    черновики прошлых дат.
+    """
+    si, gi = np.nonzero(result['quantity'])
+    engine = db.engines[MASTER_BIND] if MASTER_BIND in db.engines else db.engine
+    with engine.begin() as conn:
+        conn.execute(CLEAR_DRAFTS, {'plan_date': plan_date})
+        if len(si):
+            conn.execute(INSERT_DRAFTS, {
+                'plan_date': plan_date,
+                'shops': result['shop_ids'][si].tolist(),
+                'goods': result['good_ids'][gi].tolist(),
+                'quantities': result['quantity'][si, gi].tolist(),
+                'prices': result['prices'][gi].tolist(),
+                'supplies': result['supply'][si, gi].tolist(),
+            })
+    return si, gi
+
+
+def by_warehouse(result, si, gi):
+    """Итоги черновиков по складам: {склад: (накладных, единиц, сумма)}"""
+    warehouse = result['warehouse'][si, gi]
+    quantity = result['quantity'][si, gi]
+    amount = quantity * result['prices'][gi]
+    ids = np.unique(warehouse)
+    return {int(w): (int((warehouse == w).sum()), int(quantity[warehouse == w].sum()),
+                     float(amount[warehouse == w].sum()))
+            for w in ids}
+
+
+@click.command('replenish-plan')
+@click.option('--date', 'plan_date', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Дата отгрузки (по умолчанию сегодня)')
+@click.option('--window', default=8, show_default=True, help='Недель в скользящем среднем')
+@click.option('--lead-weeks', default=1, show_default=True, help='Недель от отгрузки до магазина')
+@click.option('--review-weeks', default=1, show_default=True, help='Недель до следующего плана')
+@click.option('--service-z', default=1.65, show_default=True, help='Множитель страхового запаса')
+@click.option('--dry-run', is_flag=True, help='Только посчитать, без черновиков накладных')
+@with_appcontext
+def replenish_plan_command(plan_date, window, lead_weeks, review_weeks, service_z, dry_run):
+    """Прогноз спроса и черновики накладных со складов в магазины"""
+    plan_date = plan_date.date() if plan_date else date.today()
+    started = time.perf_counter()
+    result = plan(plan_date, window, lead_weeks, review_weeks, service_z)
+    elapsed = time.perf_counter() - started
+    shape = result['quantity'].shape
+    click.echo(f'Пар (магазин, товар): {shape[0] * shape[1]}, расчёт {elapsed:.2f} с')
+
+    if dry_run:
+        si, gi = np.nonzero(result['quantity'])
+    else:
+        si, gi = emit_drafts(result, plan_date)
+    nodes = current_app.config['DATABASE_CONFIGS']
+    for warehouse, (count, units, amount) in by_warehouse(result, si, gi).items():
+        node = f'warehouse{warehouse}'
+        label = f'склад {warehouse}' + (f' ({node})' if node in nodes else '')
+        click.echo(f'{label}: накладных {count}, единиц {units}, сумма {amount:.2f}')
+
+
+@click.command('replenish-bench')
+@click.option('--shops', default='2,10,20', show_default=True, help='Число магазинов (через запятую)')
+@click.option('--goods', default='1000,5000,10000', show_default=True, help='Число товаров (через запятую)')
+@click.option('--window', default=8, show_default=True)
+@click.option('--density', default=0.2, show_default=True, help='Доля недель с продажами')
+@click.option('--seed', 'random_seed', default=42, show_default=True)
+def replenish_bench_command(shops, goods, window, density, random_seed):
+    """Время расчёта плана на синтетической истории в зависимости от размера матрицы"""
+    rng = np.random.default_rng(random_seed)
+    weeks = SEASON_WEEKS + window
+    click.echo(f'{"магазинов":>10} {"товаров":>8} {"строк":>10} {"матрица, с":>11} '
+               f'{"прогноз, с":>11} {"пар/с":>12}')
+    for n_shops in (int(s) for s in shops.split(',')):
+        for n_goods in (int(g) for g in goods.split(',')):
+            shop_ids = np.arange(1, n_shops + 1)
+            good_ids = np.arange(1, n_goods + 1)
+            # Строки как из запроса SALES: (магазин, товар, неделя, количество)
+            rows = int(n_shops * n_goods * weeks * density)
+            shops_col = rng.integers(1, n_shops + 1, rows)
+            goods_col = rng.integers(1, n_goods + 1, rows)
+            weeks_col = rng.integers(0, weeks, rows)
+            quantity_col = rng.poisson(3, rows) + 1
+            position = rng.integers(0, 30, (n_shops, n_goods)).astype(np.float64)
+
+            started = time.perf_counter()
+            sales = sales_matrix(shop_ids, good_ids, shops_col, goods_col, weeks_col,
+                                 quantity_col, weeks)
+            built = time.perf_counter()
+            weekly, sigma = forecast(sales, window, 2)
+            reorder_quantities(weekly, sigma, position, 1, 1, 1.65)
+            done = time.perf_counter()
+            click.echo(f'{n_shops:>10} {n_goods:>8} {rows:>10} {built - started:>11.3f} '
+                       f'{done - built:>11.3f} {n_shops * n_goods / (done - started):>12.0f}')
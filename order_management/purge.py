@@ -0,0 +1,103 @@
+import logging
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db
+from orders import CANCELLED, delete_orders
+
+logger = logging.getLogger(__name__)
+
+# Пачка давно отменённых заказов (частичный индекс из миграции 010);
+# SKIP LOCKED — параллельный запуск берёт другие заказы.
+# Статус — литерал (CANCELLED), а не параметр: в общем плане подготовленного
+# запроса условие с параметром не совпадает с предикатом частичного индекса
+TAKE_BATCH = text(f'''
+    SELECT order_number FROM orders
+    WHERE status = '{CANCELLED}' AND updated_at < LOCALTIMESTAMP - make_interval(days => CAST(:days AS INT))
+    ORDER BY updated_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+''')
+
+# Наибольшее отставание логических слотов этого узла (подписчики его публикаций)
+SLOT_LAG = text('''
+    SELECT COALESCE(max(pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)), 0)::bigint
+    FROM pg_replication_slots
+    WHERE slot_type = 'logical' AND database = current_database()
+''')
+
+
+def replication_lag():
+    """Байты WAL, ещё не подтверждённые подписчиками публикаций узла"""
+    with db.engine.connect() as conn:
+        return conn.execute(SLOT_LAG).scalar()
+
+
+def wait_for_replication(max_lag, max_wait, poll=1.0):
+    """Пауза, пока подписчики не догонят; False, если не догнали за max_wait секунд"""
+    deadline = time.monotonic() + max_wait
+    while True:
+        lag = replication_lag()
+        if lag <= max_lag:
+            return True
+        if time.monotonic() >= deadline:
+            logger.warning('Очистка заказов приостановлена: отставание репликации %s байт', lag)
+            return False
+        time.sleep(poll)
+
+
+def purge_cancelled(retention_days, batch_size, pause, max_lag, max_wait, echo=print):
+    """Удаление отменённых заказов старше retention_days пачками по batch_size.
+
+    Каждая пачка — отдельная транзакция, поэтому удаления уходят подписчикам
+    небольшими порциями. Между пачками — пауза pause секунд, а если слоты
+    отстают больше чем на max_lag байт, очистка ждёт (не дольше max_wait) и
+    прекращается до следующего запуска.
+    """
+    total = 0
+    while True:
+        conn = db.session.connection()
+        numbers = conn.execute(TAKE_BATCH, {'days': retention_days, 'limit': batch_size}).scalars().all()
+        if not numbers:
+            db.session.commit()
+            return total
+        deleted = delete_orders(numbers)
+        db.session.commit()
+        total += deleted
+        echo(f'Удалено заказов: {total}')
+        if len(numbers) < batch_size:
+            return total
+        time.sleep(pause)
+        if not wait_for_replication(max_lag, max_wait):
+            return total
+
+
+@click.command('purge-orders')
+@click.option('--retention-days', default=None, type=int,
+              help='Сколько дней хранить отменённые заказы (по умолчанию PURGE_RETENTION_DAYS)')
+@click.option('--batch-size', default=None, type=int, help='Заказов на транзакцию')
+@click.option('--interval', default=0, show_default=True,
+              help='Повторять каждые N секунд (0 — один раз)')
+@with_appcontext
+def purge_orders_command(retention_days, batch_size, interval):
+    """Удалить давно отменённые заказы вместе с чеками и позициями"""
+    config = current_app.config
+    if retention_days is None:
+        retention_days = config['PURGE_RETENTION_DAYS']
+    while True:
+        total = purge_cancelled(
+            retention_days,
+            batch_size or config['PURGE_BATCH_SIZE'],
+            config['PURGE_PAUSE_MS'] / 1000,
+            config['PURGE_MAX_LAG_BYTES'],
+            config['PURGE_MAX_WAIT'],
+            echo=click.echo,
+        )
+        click.echo(f'Готово, удалено заказов: {total}')
+        if not interval:
+            return
+        time.sleep(interval)
@@ -0,0 +1,108 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import (db, Shop, Worker, Warehouse, ListOfGoods,
+                    NSICategoryOfGoods, NSIUnitOfMeasure, NSIOfSupplies)
+
+# Справочные таблицы, реплицируемые с узла administration (rpc_pub)
+REFERENCE_MODELS = {
+    model.__tablename__: model
+    for model in (Shop, Worker, Warehouse, ListOfGoods,
+                  NSICategoryOfGoods, NSIUnitOfMeasure, NSIOfSupplies)
+}
+
+
+def snapshot(obj):
+    """Копия значений колонок, не привязанная к сессии"""
+    mapper = obj.__mapper__
+    return SimpleNamespace(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+
+
+class ReferenceCache:
+    """Кэш справочников в пределах процесса с версионной инвалидацией.
+
+    Версии берутся из таблицы reference_versions (миграция 003), которую
+    триггеры обновляют и при локальных изменениях, и при применении репликации.
+    Сама таблица опрашивается не чаще одного раза в check_interval секунд.
+    """
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._rows = {}
+        self._versions = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_versions(self):
+        try:
+            # Отдельное соединение, чтобы ошибка не испортила транзакцию запроса
+            with db.engine.connect() as conn:
+                return dict(conn.execute(
+                    # Версия — сумма слотов счётчика (миграция 017)
+                    text('SELECT table_name, sum(version)::BIGINT FROM reference_versions '
+                         'GROUP BY table_name')
+                ).all())
+        except SQLAlchemyError:
+            return None
+
+    def _refresh_versions(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        versions = self._current_versions()
+        if versions is None:
+            # Таблицы версий нет: перечитываем справочники по интервалу
+            self._rows.clear()
+            return
+        for table in list(self._rows):
+            if versions.get(table) != self._versions.get(table):
+                del self._rows[table]
+        self._versions = versions
+
+    def get(self, table):
+        """Все строки справочника в виде снимков, отсортированные по id"""
+        with self._lock:
+            self._refresh_versions()
+            rows = self._rows.get(table)
+            if rows is None:
+                model = REFERENCE_MODELS[table]
+                rows = [snapshot(obj) for obj in model.query.order_by(model.id).all()]
+                self._rows[table] = rows
+            return rows
+
+    def version(self, table):
+        """Версия справочника из reference_versions (None, если таблицы версий нет)"""
+        with self._lock:
+            self._refresh_versions()
+            return self._versions.get(table)
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(table, None)
+
+
+reference_cache = ReferenceCache()
+
+
+def init_reference(app):
+    reference_cache.check_interval = app.config['REFERENCE_CHECK_INTERVAL']
+
+
+def get_shops():
+    return reference_cache.get('shops')
+
+
+def get_workers():
+    return reference_cache.get('workers')
+
+
+def get_goods():
+    return reference_cache.get('list_of_goods')
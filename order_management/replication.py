@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import psycopg
+from flask.cli import with_appcontext
+from psycopg.rows import dict_row
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, дубликаты ключей в которых ломают применение изменений
+# (Orders и Clients публикуются и узлом administration, и магазинами)
+CONFLICT_TABLES = {'orders', 'clients'}
+
+SUBSCRIPTIONS = '''
+    SELECT s.oid AS subid, s.subname, s.subenabled, s.subslotname,
+           st.pid, st.received_lsn::text, st.latest_end_lsn::text,
+           EXTRACT(EPOCH FROM now() - st.latest_end_time) AS lag_seconds,
+           EXTRACT(EPOCH FROM now() - st.last_msg_receipt_time) AS silence_seconds
+    FROM pg_subscription s
+    LEFT JOIN pg_stat_subscription st ON st.subid = s.oid AND st.relid IS NULL
+    WHERE s.subdbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    ORDER BY s.subname
+'''
+
+SUBSCRIPTION_TABLES = '''
+    SELECT srsubid AS subid, lower(c.relname) AS tablename
+    FROM pg_subscription_rel r
+    JOIN pg_class c ON c.oid = r.srrelid
+'''
+
+# Счётчики ошибок применения (PostgreSQL 15+; confl_* — с версии 18)
+SUBSCRIPTION_STATS = 'SELECT * FROM pg_stat_subscription_stats'
+
+SLOTS = '''
+    SELECT slot_name, slot_type, active, wal_status,
+           pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn)::bigint AS retained_bytes,
+           pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)::bigint AS lag_bytes,
+           safe_wal_size
+    FROM pg_replication_slots
+    WHERE database = current_database() OR database IS NULL
+    ORDER BY slot_name
+'''
+
+SENDERS = '''
+    SELECT application_name, client_addr::text, state,
+           pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn)::bigint AS lag_bytes,
+           EXTRACT(EPOCH FROM replay_lag) AS lag_seconds
+    FROM pg_stat_replication
+    ORDER BY application_name
+'''
+
+
+def _number(value):
+    return float(value) if value is not None else None
+
+
+class ReplicationMonitor:
+    """Опрос состояния логической репликации на всех узлах.
+
+    Между опросами хранит объём удерживаемого слотами WAL, чтобы по скорости
+    его роста предупредить о переполнении диска заранее (у каждого процесса
+    gunicorn своя история; первый опрос процесса только её начинает).
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.thresholds = {}
+        self.timeout = 3
+        self._history = {}
+        self._errors = {}
+        self._conflicts = {}
+        self._lock = threading.Lock()
+
+    def configure(self, nodes, timeout, thresholds):
+        self.nodes = nodes
+        self.timeout = timeout
+        self.thresholds = thresholds
+
+    def _query_node(self, name):
+        cfg = self.nodes[name]
+        started = time.perf_counter()
+        try:
+            with psycopg.connect(host=cfg['host'], port=cfg['port'], user=cfg['user'],
+                                 password=cfg['password'], dbname=cfg['database'],
+                                 connect_timeout=self.timeout, autocommit=True,
+                                 options=f'-c statement_timeout={self.timeout * 1000}',
+                                 row_factory=dict_row) as conn:
+                subscriptions = conn.execute(SUBSCRIPTIONS).fetchall()
+                tables = conn.execute(SUBSCRIPTION_TABLES).fetchall()
+                try:
+                    stats = {s['subid']: s for s in conn.execute(SUBSCRIPTION_STATS)}
+                except psycopg.errors.UndefinedTable:
+                    stats = {}
+                slots = conn.execute(SLOTS).fetchall()
+                senders = conn.execute(SENDERS).fetchall()
+        except psycopg.Error as e:
+            return {'node': name, 'reachable': False, 'error': str(e).strip().splitlines()[0]}
+
+        for sub in subscriptions:
+            sub['tables'] = sorted(t['tablename'] for t in tables if t['subid'] == sub['subid'])
+            sub_stats = stats.get(sub.pop('subid'), {})
+            sub['errors'] = {k: v for k, v in sub_stats.items()
+                             if k.endswith('_count') or k.startswith('confl_')}
+            sub['lag_seconds'] = _number(sub['lag_seconds'])
+            sub['silence_seconds'] = _number(sub['silence_seconds'])
+        for sender in senders:
+            sender['lag_seconds'] = _number(sender['lag_seconds'])
+        return {
+            'node': name,
+            'reachable': True,
+            'poll_seconds': round(time.perf_counter() - started, 3),
+            'subscriptions': subscriptions,
+            'slots': slots,
+            'senders': senders,
+        }
+
+    def poll(self):
+        """Состояние всех узлов (опрашиваются параллельно) и список тревог"""
+        with ThreadPoolExecutor(max_workers=len(self.nodes) or 1) as pool:
+            nodes = list(pool.map(self._query_node, self.nodes))
+        now = time.time()
+        with self._lock:
+            alerts = self._check(nodes, now)
+        for alert in alerts:
+            logger.warning('Репликация: %s', alert['message'])
+        return {
+            'checked_at': now,
+            'status': 'alert' if alerts else 'ok',
+            'alerts': alerts,
+            'nodes': nodes,
+        }
+
+    def _check(self, nodes, now):
+        limits = self.thresholds
+        alerts = []
+
+        def alert(node, kind, message):
+            alerts.append({'node': node, 'kind': kind, 'message': f'{node}: {message}'})
+
+        # Отставание подписки в байтах видно только на издателе — по слоту с её именем
+        slot_lag = {s['slot_name']: s['lag_bytes'] for n in nodes if n['reachable']
+                    for s in n['slots']}
+
+        for node in nodes:
+            name = node['node']
+            if not node['reachable']:
+                alert(name, 'unreachable', f'узел недоступен ({node["error"]})')
+                continue
+
+            for sub in node['subscriptions']:
+                sub['lag_bytes'] = slot_lag.get(sub['subslotname'])
+                label = f'подписка {sub["subname"]}'
+                if not sub['subenabled']:
+                    alert(name, 'disabled', f'{label} отключена')
+                elif sub['pid'] is None:
+                    alert(name, 'stalled', f'{label}: процесс применения не запущен')
+                if (sub['lag_seconds'] or 0) > limits['lag_seconds']:
+                    alert(name, 'lag', f'{label} отстаёт на {sub["lag_seconds"]:.0f} с')
+                if (sub['lag_bytes'] or 0) > limits['lag_bytes']:
+                    alert(name, 'lag', f'{label} отстаёт на {sub["lag_bytes"]} байт')
+
+                # Новые ошибки применения с прошлого опроса; при подписке на orders/clients
+                # это, как правило, нарушение уникальности ключа
+                key = (name, sub['subname'])
+                errors = sum(v or 0 for k, v in sub['errors'].items() if not k.startswith('confl_'))
+                previous = self._errors.get(key)
+                self._errors[key] = errors
+                if previous is not None and errors > previous:
+                    tables = CONFLICT_TABLES.intersection(sub['tables'])
+                    hint = f' (возможен дубликат ключа в {", ".join(sorted(tables))})' if tables else ''
+                    alert(name, 'conflict', f'{label}: новые ошибки применения{hint}')
+                # Счётчик накопительный: тревога только о конфликтах с прошлого опроса
+                conflicts = sub['errors'].get('confl_insert_exists') or 0
+                previous = self._conflicts.get(key)
+                self._conflicts[key] = conflicts
+                if previous is not None and conflicts > previous:
+                    alert(name, 'conflict', f'{label}: новые конфликты вставки существующего ключа '
+                                            f'({conflicts - previous}, всего {conflicts})')
+
+            for slot in node['slots']:
+                label = f'слот {slot["slot_name"]}'
+                retained = slot['retained_bytes'] or 0
+                if slot['wal_status'] in ('unreserved', 'lost'):
+                    alert(name, 'wal', f'{label}: WAL {slot["wal_status"]}, подписчику '
+                                       f'потребуется повторная синхронизация')
+                if not slot['active']:
+                    alert(name, 'inactive_slot', f'{label} не используется и удерживает {retained} байт WAL')
+                if retained > limits['wal_bytes']:
+                    alert(name, 'wal', f'{label} удерживает {retained} байт WAL')
+
+                # Прогноз: через сколько секунд при текущей скорости роста будет исчерпан
+                # запас (safe_wal_size при max_slot_wal_keep_size или порог wal_bytes)
+                key = (name, slot['slot_name'])
+                previous = self._history.get(key)
+                self._history[key] = (now, retained)
+                slot['growth_bytes_per_second'] = None
+                if previous and now > previous[0]:
+                    rate = (retained - previous[1]) / (now - previous[0])
+                    slot['growth_bytes_per_second'] = round(rate, 1)
+                    reserve = slot['safe_wal_size']
+                    if reserve is None:
+                        reserve = limits['wal_bytes'] - retained
+                    if rate > 0 and 0 < reserve / rate < limits['wal_horizon']:
+                        alert(name, 'wal_growth', f'{label}: при росте {rate:.0f} байт/с запас WAL '
+                                                  f'закончится через {reserve / rate:.0f} с')
+
+            for sender in node['senders']:
+                if (sender['lag_seconds'] or 0) > limits['lag_seconds']:
+                    alert(name, 'lag', f'отправка {sender["application_name"]} отстаёт на '
+                                       f'{sender["lag_seconds"]:.0f} с')
+        return alerts
+
+
+replication_monitor = ReplicationMonitor()
+
+
+def init_replication(app):
+    """Узлы и пороги мониторинга из конфигурации"""
+    replication_monitor.configure(
+        app.config['DATABASE_CONFIGS'],
+        app.config['REPLICATION_POLL_TIMEOUT'],
+        {
+            'lag_seconds': app.config['REPLICATION_LAG_ALERT_SECONDS'],
+            'lag_bytes': app.config['REPLICATION_LAG_ALERT_BYTES'],
+            'wal_bytes': app.config['REPLICATION_WAL_ALERT_BYTES'],
+            'wal_horizon': app.config['REPLICATION_WAL_ALERT_HORIZON'],
+        },
+    )
+
+
+@click.command('replication-check')
+@click.option('--interval', default=0, show_default=True,
+              help='Повторять опрос каждые N секунд (0 — один раз)')
+@with_appcontext
+def replication_check_command(interval):
+    """Проверить репликацию на всех узлах; код 1 при наличии тревог"""
+    while True:
+        report = replication_monitor.poll()
+        for node in report['nodes']:
+            if not node['reachable']:
+                continue
+            for sub in node['subscriptions']:
+                click.echo(f'{node["node"]:<15} подписка {sub["subname"]}: '
+                           f'{sub["lag_seconds"] or 0:.1f} с, {sub["lag_bytes"] or 0} байт')
+            for slot in node['slots']:
+                click.echo(f'{node["node"]:<15} слот {slot["slot_name"]}: '
+                           f'WAL {slot["retained_bytes"] or 0} байт ({slot["wal_status"]})')
+        for alert in report['alerts']:
+            click.echo(f'ТРЕВОГА {alert["message"]}', err=True)
+        if not interval:
+            if report['alerts']:
+                raise SystemExit(1)
+            return
+        time.sleep(interval)
@@ -0,0 +1,63 @@
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+
+# Таблицы, которыми владеет узел administration (публикация rpc_pub).
+# На узлах-подписчиках они только читаются из локальной реплики.
+MASTER_TABLES = {
+    'shops', 'workers', 'warehouses', 'list_of_goods',
+    'nsi_category_of_goods', 'nsi_unit_of_measure', 'nsi_of_supplies',
+    'supplies_from_warehouse', 'invoices',
+}
+
+MASTER_BIND = 'master'
+
+
+class MixedBindWrite(sa.exc.InvalidRequestError):
+    """Запись в локальную базу и на узел administration в одной транзакции"""
+
+
+def _written_table(mapper, clause, flushing):
+    """Имя таблицы, в которую идёт запись, или None для чтения"""
+    if clause is not None and getattr(clause, 'is_dml', False):
+        return clause.table.name
+    if flushing and mapper is not None:
+        return sa.inspect(mapper).local_table.name
+    return None
+
+
+class RoutingSession(Session):
+    """Сессия, направляющая запись справочных данных на узел-владелец.
+
+    Чтение любых таблиц идёт в локальную базу узла (для справочников это
+    реплика rpc_pub), а INSERT/UPDATE/DELETE таблиц из MASTER_TABLES — в bind
+    'master', если он настроен (на самом узле administration его нет).
+
+    Общей (двухфазной) фиксации у двух баз нет, поэтому транзакция сессии
+    пишет только в одну из них: запись во вторую отклоняется MixedBindWrite,
+    и изменения справочников нужно выполнять отдельной транзакцией. Записанное
+    на administration появляется в локальной реплике только после репликации,
+    поэтому сразу после записи справочник читается с bind 'master'.
+    Отслеживаются записи через ORM и DML-конструкции; текстовый SQL всегда
+    идёт в локальную базу.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and MASTER_BIND in self._db.engines:
+            table = _written_table(mapper, clause, self._flushing)
+            if table is not None:
+                target = MASTER_BIND if table in MASTER_TABLES else None
+                written = self.info.setdefault('written_binds', set())
+                written.add(target)
+                if len(written) > 1:
+                    raise MixedBindWrite(
+                        f'запись в {table} в транзакции, уже писавшей в другую базу; '
+                        f'справочники изменяются отдельной транзакцией')
+                if target is not None:
+                    return self._db.engines[target]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_written_binds(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('written_binds', None)
@@ -0,0 +1,147 @@
+import re
+
+from sqlalchemy import event, func, literal_column, or_
+
+from cache import LRUCache
+from models import db, Client, ListOfGoods
+from reference import reference_cache
+
+# Кэши результатов автодополнения; задаются в init_search из конфигурации.
+# Ключ включает версию таблицы из reference_versions (миграции 003 и 012): изменения
+# из других процессов и по репликации сбрасывают кэш не позже REFERENCE_CHECK_INTERVAL
+client_cache = LRUCache()
+goods_cache = LRUCache()
+
+PHONE_RE = re.compile(r'^\+?[\d\s()\-]{3,}$')
+
+
+def normalize_email(value):
+    """Email в нижнем регистре без пробелов по краям"""
+    return value.strip().lower()
+
+
+def normalize_phone(value):
+    """Только цифры номера; ведущая 8 российского номера заменяется на 7"""
+    digits = re.sub(r'\D', '', value)
+    if digits.startswith('8') and not value.strip().startswith('+'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def phone_digits_expr():
+    """Нормализованный номер в БД (совпадает с выражением индекса из миграции 002)"""
+    # Литералы, а не параметры: иначе планировщик не сопоставит выражение с индексом
+    return func.regexp_replace(Client.phone_number, literal_column(r"'\D'"),
+                               literal_column("''"), literal_column("'g'"))
+
+
+def email_expr():
+    return func.lower(Client.email)
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def classify_query(query):
+    """Тип поискового запроса: 'phone', 'email' или 'name'"""
+    if PHONE_RE.match(query) and re.search(r'\d', query):
+        return 'phone'
+    if '@' in query:
+        return 'email'
+    return 'name'
+
+
+def _find_clients(query, kind, limit):
+    if kind == 'phone':
+        digits = normalize_phone(query)
+        prefixes = [digits] if digits.startswith('7') else [digits, '7' + digits]
+        criteria = or_(*(phone_digits_expr().like(escape_like(p) + '%', escape='\\')
+                         for p in prefixes))
+        order = [phone_digits_expr()]
+    elif kind == 'email':
+        criteria = email_expr().like(escape_like(normalize_email(query)) + '%', escape='\\')
+        order = [email_expr()]
+    else:
+        # Имя ищется по подстроке (триграммный индекс), email — по префиксу
+        criteria = or_(
+            Client.name.ilike('%' + escape_like(query) + '%', escape='\\'),
+            email_expr().like(escape_like(normalize_email(query)) + '%', escape='\\')
+        )
+        order = [func.similarity(Client.name, query).desc(), Client.name]
+
+    clients = Client.query.filter(criteria).order_by(*order).limit(limit).all()
+    return [{
+        'id': c.id,
+        'name': c.name,
+        'email': c.email,
+        'phone': c.phone_number
+    } for c in clients]
+
+
+def search_clients(query, limit=10):
+    """Поиск клиентов: префикс по телефону/email, триграммы по имени"""
+    query = query.strip()
+    if not query:
+        return []
+    kind = classify_query(query)
+    key = (reference_cache.version('clients'), kind, query.lower(), limit)
+    result = client_cache.get(key)
+    if result is None:
+        result = _find_clients(query, kind, limit)
+        client_cache.set(key, result)
+    return result
+
+
+def search_goods(query, limit=10):
+    """Поиск товаров по названию с ранжированием по триграммному сходству"""
+    query = query.strip()
+    if not query:
+        return []
+    key = (reference_cache.version('list_of_goods'), query.lower(), limit)
+    result = goods_cache.get(key)
+    if result is None:
+        goods = ListOfGoods.query.filter(
+            ListOfGoods.name.ilike('%' + escape_like(query) + '%', escape='\\')
+        ).order_by(
+            func.similarity(ListOfGoods.name, query).desc(), ListOfGoods.name
+        ).limit(limit).all()
+        result = [{
+            'id': g.id,
+            'name': g.name,
+            'price': float(g.price) if g.price else 0
+        } for g in goods]
+        goods_cache.set(key, result)
+    return result
+
+
+def _track_changes(session, flush_context, instances):
+    """Запоминаем в сессии, менялись ли клиенты или товары (сброс в своём процессе — сразу)"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Client):
+            session.info['search_clients_dirty'] = True
+        elif isinstance(obj, ListOfGoods):
+            session.info['search_goods_dirty'] = True
+
+
+def _invalidate(session):
+    if session.info.pop('search_clients_dirty', False):
+        client_cache.clear()
+    if session.info.pop('search_goods_dirty', False):
+        goods_cache.clear()
+
+
+def _discard(session):
+    session.info.pop('search_clients_dirty', None)
+    session.info.pop('search_goods_dirty', None)
+
+
+def init_search(app):
+    """Настройка размеров кэшей и сброса при изменении клиентов/товаров"""
+    for cache in (client_cache, goods_cache):
+        cache.maxsize = app.config['SEARCH_CACHE_SIZE']
+        cache.ttl = app.config['SEARCH_CACHE_TTL']
+    if not event.contains(db.session, 'before_flush', _track_changes):
+        event.listen(db.session, 'before_flush', _track_changes)
+        event.listen(db.session, 'after_commit', _invalidate)
+        event.listen(db.session, 'after_rollback', _discard)
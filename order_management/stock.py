@@ -0,0 +1,142 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db
+
+# Движения остатков по всей истории: приход по накладным, дошедшим до магазина,
+# и расход позициями неотменённых заказов (те же правила, что у триггеров 009).
+# Расход архивированных месяцев — из archived_stock: их секций уже нет
+MOVEMENTS = '''
+    SELECT shop_id, good_id, sum(received) AS received, sum(ordered) AS ordered
+    FROM (
+        SELECT shop_id, goodid AS good_id, COALESCE(quantity, 0) AS received, 0 AS ordered
+        FROM invoices
+        WHERE receipt_date IS NOT NULL
+        UNION ALL
+        SELECT i.shop_id, i.goodid, 0, og.quantity
+        FROM ordered_goods og
+        JOIN invoices i ON i.invoicenumber = og.invoice_id
+        JOIN orders o ON o.order_number = og.order_id AND o.date_of_order = og.order_date
+        WHERE o.status IS DISTINCT FROM 'Отменен'
+        UNION ALL
+        SELECT shop_id, good_id, 0, ordered FROM archived_stock
+    ) movements
+    WHERE shop_id IS NOT NULL AND good_id IS NOT NULL
+    GROUP BY shop_id, good_id
+'''
+
+DRIFT = text(f'''
+    SELECT COALESCE(e.shop_id, b.shop_id) AS shop_id, COALESCE(e.good_id, b.good_id) AS good_id,
+           COALESCE(e.received, 0) AS received, COALESCE(e.ordered, 0) AS ordered,
+           COALESCE(b.received, 0) AS stored_received, COALESCE(b.ordered, 0) AS stored_ordered
+    FROM ({MOVEMENTS}) e
+    FULL JOIN stock_balances b ON b.shop_id = e.shop_id AND b.good_id = e.good_id
+    WHERE (COALESCE(e.received, 0), COALESCE(e.ordered, 0))
+          IS DISTINCT FROM (COALESCE(b.received, 0), COALESCE(b.ordered, 0))
+    ORDER BY 1, 2
+''')
+
+# Расход месяца перед удалением его секций (partitions.archive_month)
+ARCHIVE_MOVEMENTS = text('''
+    INSERT INTO archived_stock AS a (month, shop_id, good_id, ordered)
+    SELECT :month, i.shop_id, i.goodid, sum(og.quantity)
+    FROM ordered_goods og
+    JOIN invoices i ON i.invoicenumber = og.invoice_id
+    JOIN orders o ON o.order_number = og.order_id AND o.date_of_order = og.order_date
+    WHERE og.order_date >= :month AND og.order_date < :next_month
+      AND o.status IS DISTINCT FROM 'Отменен'
+      AND i.shop_id IS NOT NULL AND i.goodid IS NOT NULL
+    GROUP BY i.shop_id, i.goodid
+    ON CONFLICT (month, shop_id, good_id) DO UPDATE SET ordered = EXCLUDED.ordered
+''')
+
+FIX_DRIFT = text('''
+    INSERT INTO stock_balances AS b (shop_id, good_id, received, ordered)
+    SELECT * FROM unnest(CAST(:shops AS INT[]), CAST(:goods AS INT[]),
+                         CAST(:received AS BIGINT[]), CAST(:ordered AS BIGINT[]))
+    ON CONFLICT (shop_id, good_id) DO UPDATE
+    SET received = EXCLUDED.received, ordered = EXCLUDED.ordered, updated_at = now()
+''')
+
+
+class OutOfStock(ValueError):
+    """Товара в магазине меньше, чем в заказе"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(shortage_message(shortages))
+
+
+def shortage_message(shortages):
+    details = ', '.join(f'товар {good_id}: нужно {requested}, в наличии {available}'
+                        for good_id, (requested, available) in sorted(shortages.items()))
+    return f'Недостаточно товара в магазине ({details})'
+
+
+def availability(shop_id, good_ids, lock=False):
+    """Доступный остаток товаров магазина: {good_id: количество}.
+
+    Одно чтение stock_balances по первичному ключу; товара без строки остатка нет
+    в наличии. lock=True блокирует строки (в порядке good_id) до конца транзакции,
+    чтобы параллельный заказ не занял тот же остаток.
+    """
+    good_ids = sorted(set(good_ids))
+    if shop_id is None or not good_ids:
+        return {}
+    rows = db.session.execute(text(f'''
+        SELECT good_id, available FROM stock_balances
+        WHERE shop_id = :shop_id AND good_id = ANY(CAST(:goods AS INT[]))
+        ORDER BY good_id
+        {'FOR UPDATE' if lock else ''}
+    '''), {'shop_id': shop_id, 'goods': good_ids}).all()
+    available = dict(rows)
+    return {good_id: available.get(good_id, 0) for good_id in good_ids}
+
+
+def check_stock(shop_id, items, lock=False):
+    """Нехватка по позициям {good_id: количество}: {good_id: (нужно, в наличии)}.
+
+    Заказ без магазина не проверяется: остатки ведутся по магазинам.
+    """
+    available = availability(shop_id, items, lock=lock)
+    return {good_id: (quantity, available[good_id])
+            for good_id, quantity in items.items()
+            if good_id in available and quantity > available[good_id]}
+
+
+def reconcile(fix=False):
+    """Сверка счётчиков с историей; возвращает расхождения.
+
+    На время сверки таблица остатков закрыта для записи: триггеры ждут, а
+    уже начатые транзакции успевают зафиксироваться до подсчёта, поэтому
+    исправленные значения не теряют параллельных изменений.
+    """
+    conn = db.session.connection()
+    conn.execute(text('SET LOCAL statement_timeout = 0'))
+    conn.execute(text('LOCK TABLE stock_balances IN EXCLUSIVE MODE'))
+    drift = [dict(row) for row in conn.execute(DRIFT).mappings()]
+    if fix and drift:
+        conn.execute(FIX_DRIFT, {
+            'shops': [d['shop_id'] for d in drift],
+            'goods': [d['good_id'] for d in drift],
+            'received': [d['received'] for d in drift],
+            'ordered': [d['ordered'] for d in drift],
+        })
+    db.session.commit()
+    return drift
+
+
+@click.command('stock-reconcile')
+@click.option('--fix', is_flag=True, help='Исправить счётчики по истории')
+@with_appcontext
+def stock_reconcile_command(fix):
+    """Сверить остатки с накладными и заказами; код 1 при расхождениях без --fix"""
+    drift = reconcile(fix)
+    for d in drift:
+        click.echo(f'магазин {d["shop_id"]}, товар {d["good_id"]}: '
+                   f'поступило {d["stored_received"]} → {d["received"]}, '
+                   f'заказано {d["stored_ordered"]} → {d["ordered"]}')
+    click.echo(f'Расхождений: {len(drift)}' + (' (исправлены)' if fix and drift else ''))
+    if drift and not fix:
+        raise SystemExit(1)